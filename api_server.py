@@ -1,117 +1,271 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import sqlite3
 import json
 import os
 import base64
+import hashlib
+import io
 from datetime import datetime
 import logging
-import asyncio
-from aiogram import Bot
-from config import BOT_TOKEN
+from config import BLOB_ACCEL_REDIRECT_PREFIX, PHOTO_CACHE_MAX_AGE, SUBSCRIPTION_CHECK_DELAY, COUNTERS_RECONCILE_INTERVAL
+from config import (
+    RESPONSE_CACHE_TTL_PRIZES,
+    RESPONSE_CACHE_TTL_STATS,
+    RESPONSE_CACHE_TTL_TICKETS,
+    RESPONSE_CACHE_TTL_REFERRAL,
+)
+import counters
+from db_pool import get_pool
+from database import get_database, apply_photo_migrations
+from leaderboard import get_leaderboard
+from response_cache import response_cache, referral_tag
+from blob_store import get_blob_store, BlobTooLarge
+from upload_sessions import UploadSessions, UploadError, sniff_media_type, SNIFF_SIZE
+from job_queue import JobQueue
+from subscription_checker import SubscriptionChecker, ADMIN_STATUSES
+from thumbnails import ThumbnailPipeline, STATUS_PENDING, variant_name
 import threading
-import time
+from functools import wraps
+from urllib.parse import quote, urlencode
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)  # Разрешаем CORS для Flutter Web App
+CORS(app, expose_headers=['Upload-Offset', 'ETag'])  # Разрешаем CORS для Flutter Web App
 
 # Путь к базе данных
 DB_PATH = 'fsr.db'
+pool = get_pool(DB_PATH)
+
+# Максимальный размер загружаемого файла
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+# Лимит тела запроса: base64 раздувает файл на треть, плюс метаданные
+MAX_BASE64_REQUEST_SIZE = MAX_UPLOAD_SIZE * 4 // 3 + 64 * 1024
+# Лимит multipart-запроса: файл плюс поля формы
+MAX_MULTIPART_REQUEST_SIZE = MAX_UPLOAD_SIZE + 64 * 1024
+
+PHOTO_REQUIRED_FIELDS = ['id', 'userId', 'category', 'fileId', 'fileName', 'fileSize', 'mimeType', 'uploadDate']
+
+_upload_sessions = None
+
+def get_upload_sessions():
+    """Менеджер возобновляемых загрузок (создается при первом обращении)"""
+    global _upload_sessions
+    if _upload_sessions is None:
+        _upload_sessions = UploadSessions(pool, get_blob_store(), MAX_UPLOAD_SIZE)
+    return _upload_sessions
+
+_thumbnails = None
+
+def get_thumbnails():
+    """Фоновое создание миниатюр (создается при первом обращении)"""
+    global _thumbnails
+    if _thumbnails is None:
+        _thumbnails = ThumbnailPipeline(pool, get_blob_store())
+    return _thumbnails
+
+def thumbnail_urls(photo_id, status):
+    """Ссылки на миниатюры для списков; None, пока превью не готовы"""
+    if status != 'ready':
+        return None
+    return {
+        size: f"/api/photo/{quote(photo_id)}/raw?size={size}"
+        for size in get_thumbnails().sizes
+    }
 
 # Загрузка каналов из channels.json
 with open('channels.json', 'r') as f:
     CHANNEL_IDS = json.load(f)['channels']
 
+_subscription_checker = None
+_subscription_checker_lock = threading.Lock()
+
+def get_subscription_checker():
+    """Общий проверяющий подписки с одной сессией Bot API (создается при первом обращении)"""
+    global _subscription_checker
+    if _subscription_checker is None:
+        with _subscription_checker_lock:
+            if _subscription_checker is None:
+                _subscription_checker = SubscriptionChecker(CHANNEL_IDS)
+    return _subscription_checker
+
+def cached_response(ttl, tags, public=True):
+    """
+    Кэширование успешных JSON-ответов маршрута в response_cache.
+    Ключ — путь и отсортированные параметры запроса; tags — кортеж тегов или функция
+    от аргументов маршрута. Ответ получает слабый ETag и Cache-Control с оставшимся
+    временем жизни (public — можно хранить в nginx, иначе только в браузере);
+    повторный запрос с тем же If-None-Match получает 304 без тела
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            passthrough = []
+            
+            def compute():
+                response = app.make_response(view(**kwargs))
+                if response.status_code != 200 or not response.is_json:
+                    # Ошибки не кэшируются и отдаются как есть
+                    passthrough.append(response)
+                    return None
+                return response.get_data(), response.mimetype
+            
+            key = request.path
+            if request.args:
+                key += '?' + urlencode(sorted(request.args.items(multi=True)))
+            entry = response_cache.get_or_compute(key, ttl, tags(**kwargs) if callable(tags) else tags, compute)
+            if entry is None:
+                return passthrough[0]
+            
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag, weak=True)
+            response.cache_control.public = public
+            response.cache_control.private = not public
+            response.cache_control.max_age = entry.max_age()
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
 # Проверка, что бот админ во всех каналах при старте
-async def check_bot_admin_rights():
-    bot = Bot(token=BOT_TOKEN)
-    me = await bot.get_me()
-    for channel_id in CHANNEL_IDS:
-        try:
-            member = await bot.get_chat_member(chat_id=channel_id, user_id=me.id)
-            if member.status not in ['administrator', 'creator']:
-                logger.error(f"Bot is NOT admin in channel {channel_id}!")
-            else:
-                logger.info(f"Bot is admin in channel {channel_id}")
-        except Exception as e:
-            logger.error(f"Error checking admin rights in channel {channel_id}: {e}")
+def check_bot_admin_rights():
+    try:
+        results = get_subscription_checker().check_admin_rights()
+    except Exception as e:
+        logger.error(f"Error checking admin rights: {e}")
+        return
+    for result in results:
+        channel_id = result['channel_id']
+        if result.get('error'):
+            logger.error(f"Error checking admin rights in channel {channel_id}: {result['error']}")
+        elif not result['admin']:
+            logger.error(f"Bot is NOT admin in channel {channel_id}!")
+        else:
+            logger.info(f"Bot is admin in channel {channel_id}")
 
 def init_photo_uploads_table():
     """Инициализация таблицы для загруженных фото"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS photo_uploads (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            category TEXT NOT NULL,
-            file_id TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            file_size INTEGER NOT NULL,
-            mime_type TEXT NOT NULL,
-            upload_date TEXT NOT NULL,
-            description TEXT,
-            file_data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS photo_uploads (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                mime_type TEXT NOT NULL,
+                upload_date TEXT NOT NULL,
+                description TEXT,
+                file_data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+
+def init_photo_database():
+    """Схема базы фото: таблица photo_uploads и только относящиеся к фото миграции (без таблиц бота)"""
+    init_photo_uploads_table()
+    applied = apply_photo_migrations(pool)
+    if applied:
+        logger.info(f"Applied photo migrations to {DB_PATH}: {', '.join(applied)}")
+
+# Схема приводится при импорте, чтобы она была актуальной и под WSGI-сервером
+init_photo_database()
+
+def decode_base64_payload(value):
+    """Декодирование base64 (в том числе в виде data URL) в байты"""
+    if value.startswith('data:') and ',' in value:
+        value = value.split(',', 1)[1]
+    try:
+        return base64.b64decode(value, validate=True)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid base64 payload: {e}")
+
+def read_photo_content(blob_sha256, file_data):
+    """Содержимое фото в base64: из файлового хранилища или (для непереносенных записей) из file_data"""
+    if blob_sha256:
+        return base64.b64encode(get_blob_store().read(blob_sha256)).decode('ascii')
+    return file_data
+
+def save_photo_record(meta, blob_sha256, file_size):
+    """Сохранение метаданных загруженного файла в photo_uploads и постановка в очередь на миниатюры"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO photo_uploads 
+            (id, user_id, category, file_id, file_name, file_size, mime_type, upload_date, description,
+             blob_sha256, thumbnail_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            meta['id'],
+            meta['userId'],
+            meta['category'],
+            meta['fileId'],
+            meta['fileName'],
+            file_size,
+            meta['mimeType'],
+            meta['uploadDate'],
+            meta.get('description'),
+            blob_sha256,
+            STATUS_PENDING if blob_sha256 else None,
+        ))
+        conn.commit()
+    response_cache.invalidate('stats')
+    if blob_sha256:
+        get_thumbnails().submit(meta['id'])
 
 @app.route('/api/upload-photo', methods=['POST'])
 def upload_photo():
-    """API endpoint для загрузки фото"""
+    """API endpoint для загрузки фото (base64 в JSON; для больших файлов — /api/upload-photo/file и /api/uploads)"""
     try:
+        # Отклоняем заведомо слишком большие запросы до чтения тела
+        if request.content_length and request.content_length > MAX_BASE64_REQUEST_SIZE:
+            return jsonify({'error': 'File size too large. Maximum size: 10MB'}), 413
+        
         data = request.get_json()
         
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
         # Проверяем обязательные поля
-        required_fields = ['id', 'userId', 'category', 'fileId', 'fileName', 'fileSize', 'mimeType', 'uploadDate']
-        for field in required_fields:
+        for field in PHOTO_REQUIRED_FIELDS:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
         # Проверяем тип файла
-        mime_type = data['mimeType']
-        if not (mime_type.startswith('image/') or mime_type.startswith('video/')):
+        mime_type = data.get('mimeType')
+        if not isinstance(mime_type, str) or not mime_type.startswith(('image/', 'video/')):
             return jsonify({'error': 'Only image and video files are allowed'}), 400
         
         # Проверяем размер файла (максимум 10MB)
-        file_size = data['fileSize']
-        if file_size > 10 * 1024 * 1024:  # 10MB
+        try:
+            file_size = int(data.get('fileSize'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'fileSize must be an integer'}), 400
+        if file_size <= 0:
+            return jsonify({'error': 'fileSize must be positive'}), 400
+        if file_size > MAX_UPLOAD_SIZE:
             return jsonify({'error': 'File size too large. Maximum size: 10MB'}), 400
         
-        # Сохраняем в базу данных
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO photo_uploads 
-            (id, user_id, category, file_id, file_name, file_size, mime_type, upload_date, description, file_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['id'],
-            data['userId'],
-            data['category'],
-            data['fileId'],
-            data['fileName'],
-            data['fileSize'],
-            data['mimeType'],
-            data['uploadDate'],
-            data.get('description'),
-            data.get('base64_data', ''),  # Сохраняем base64 данные файла
-        ))
+        # Содержимое файла кладем в файловое хранилище, в базе остается только хэш
+        blob_sha256 = None
+        if data.get('base64_data'):
+            try:
+                content = decode_base64_payload(data['base64_data'])
+            except ValueError:
+                return jsonify({'error': 'Invalid base64_data'}), 400
+            if len(content) > MAX_UPLOAD_SIZE:
+                return jsonify({'error': 'File size too large. Maximum size: 10MB'}), 400
+            blob_sha256, file_size = get_blob_store().put_bytes(content)
         
-        conn.commit()
-        conn.close()
+        # Сохраняем в базу данных
+        save_photo_record(data, blob_sha256, file_size)
         
         # Логируем успешную загрузку
         logger.info(f"Photo uploaded successfully: user_id={data['userId']}, category={data['category']}, file={data['fileName']}")
@@ -126,67 +280,331 @@ def upload_photo():
         logger.error(f"Error uploading photo: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/upload-photo/file', methods=['POST'])
+def upload_photo_file():
+    """Загрузка фото/видео одним multipart/form-data запросом (файл в поле file)"""
+    try:
+        if request.content_length and request.content_length > MAX_MULTIPART_REQUEST_SIZE:
+            return jsonify({'error': 'File size too large. Maximum size: 10MB'}), 413
+        
+        # Werkzeug пишет крупные части multipart во временный файл, а не в память
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'Missing file part: file'}), 400
+        
+        data = request.form.to_dict()
+        data.setdefault('fileName', upload.filename or '')
+        data.setdefault('mimeType', upload.mimetype or '')
+        for field in PHOTO_REQUIRED_FIELDS:
+            if field != 'fileSize' and not data.get(field):
+                return jsonify({'error': f'Missing required field: {field}'}), 400
+        
+        mime_type = data['mimeType']
+        if not (mime_type.startswith('image/') or mime_type.startswith('video/')):
+            return jsonify({'error': 'Only image and video files are allowed'}), 400
+        
+        # Проверяем содержимое по сигнатуре, а не только по заявленному mimeType
+        head = upload.stream.read(SNIFF_SIZE)
+        upload.stream.seek(0)
+        detected = sniff_media_type(head)
+        if detected is None or not mime_type.startswith(detected[0] + '/'):
+            return jsonify({'error': 'File content does not match mimeType'}), 415
+        
+        try:
+            blob_sha256, file_size = get_blob_store().put_stream(upload.stream, max_size=MAX_UPLOAD_SIZE)
+        except BlobTooLarge:
+            return jsonify({'error': 'File size too large. Maximum size: 10MB'}), 413
+        
+        save_photo_record(data, blob_sha256, file_size)
+        
+        logger.info(f"Photo uploaded successfully (multipart): user_id={data['userId']}, category={data['category']}, file={data['fileName']}")
+        
+        return jsonify({
+            'success': True,
+            'message': 'Photo uploaded successfully',
+            'photo_id': data['id']
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error uploading photo file: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def upload_error_response(error):
+    """JSON-ответ для UploadError с текущим смещением в заголовке Upload-Offset"""
+    body = {'error': str(error)}
+    if error.offset is not None:
+        body['offset'] = error.offset
+    response = jsonify(body)
+    response.status_code = error.status
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response
+
+def upload_session_response(session, status=200):
+    response = jsonify({
+        'success': True,
+        'upload_id': session['upload_id'],
+        'photo_id': session['id'],
+        'offset': session['offset'],
+        'fileSize': session['fileSize']
+    })
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(session['offset'])
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Создание сессии возобновляемой загрузки (JSON с метаданными файла, без содержимого)"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        for field in PHOTO_REQUIRED_FIELDS:
+            if field not in data:
+                return jsonify({'error': f'Missing required field: {field}'}), 400
+        
+        session = get_upload_sessions().create(data)
+        response = upload_session_response(session, 201)
+        response.headers['Location'] = f"/api/uploads/{session['upload_id']}"
+        return response
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"Error creating upload: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def get_upload(upload_id):
+    """Текущее смещение загрузки (для продолжения после обрыва)"""
+    try:
+        session = get_upload_sessions().get(upload_id)
+        if session is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        return upload_session_response(session)
+    except Exception as e:
+        logger.error(f"Error getting upload: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH', 'PUT'])
+def upload_chunk(upload_id):
+    """Прием очередного куска файла (сырые байты, заголовок Upload-Offset)"""
+    try:
+        offset_header = request.headers.get('Upload-Offset')
+        if offset_header is None or not offset_header.isdigit():
+            return jsonify({'error': 'Missing or invalid Upload-Offset header'}), 400
+        
+        session = get_upload_sessions().append(
+            upload_id,
+            int(offset_header),
+            request.stream,
+            request.content_length
+        )
+        return upload_session_response(session)
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"Error uploading chunk: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Завершение загрузки: файл переносится в хранилище, создается запись photo_uploads"""
+    try:
+        sessions = get_upload_sessions()
+        session, blob_sha256 = sessions.complete(upload_id)
+        save_photo_record(session, blob_sha256, session['fileSize'])
+        sessions.discard(upload_id)
+        
+        logger.info(f"Photo uploaded successfully (resumable): user_id={session['userId']}, category={session['category']}, file={session['fileName']}")
+        
+        return jsonify({
+            'success': True,
+            'message': 'Photo uploaded successfully',
+            'photo_id': session['id']
+        }), 200
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        logger.error(f"Error completing upload: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Отмена загрузки"""
+    try:
+        sessions = get_upload_sessions()
+        if sessions.get(upload_id) is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        sessions.discard(upload_id)
+        return jsonify({'success': True}), 200
+    except Exception as e:
+        logger.error(f"Error cancelling upload: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Поля ответа /api/user-photos -> колонки photo_uploads
+PHOTO_LIST_FIELDS = {
+    'id': 'id',
+    'category': 'category',
+    'fileName': 'file_name',
+    'fileSize': 'file_size',
+    'mimeType': 'mime_type',
+    'uploadDate': 'upload_date',
+    'description': 'description',
+    'thumbnailStatus': 'thumbnail_status',
+    'thumbnails': 'thumbnail_status',
+    'placeholder': 'placeholder',
+}
+PHOTO_PAGE_SIZE = 50
+PHOTO_PAGE_MAX_SIZE = 200
+
+def encode_photo_cursor(upload_date, photo_id):
+    """Непрозрачный курсор страницы: позиция (upload_date, id) последнего фото"""
+    raw = json.dumps([upload_date, photo_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_photo_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_date, photo_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(upload_date, str) or not isinstance(photo_id, str):
+        raise ValueError('Invalid cursor')
+    return upload_date, photo_id
+
 @app.route('/api/user-photos/<user_id>', methods=['GET'])
 def get_user_photos(user_id):
-    """API endpoint для получения фото пользователя"""
+    """
+    API endpoint для получения фото пользователя, постранично от новых к старым.
+    Параметры: limit, cursor (nextCursor из предыдущего ответа), category, fields (через запятую)
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, category, file_name, file_size, mime_type, upload_date, description
-            FROM photo_uploads 
-            WHERE user_id = ?
-            ORDER BY upload_date DESC
-        ''', (user_id,))
+        limit = request.args.get('limit', PHOTO_PAGE_SIZE, type=int)
+        if limit is None or limit < 1:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        limit = min(limit, PHOTO_PAGE_MAX_SIZE)
+        
+        fields = list(PHOTO_LIST_FIELDS)
+        if request.args.get('fields'):
+            fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+            unknown = [f for f in fields if f not in PHOTO_LIST_FIELDS]
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        
+        # id и upload_date нужны всегда: из них строится курсор
+        columns = ['id', 'upload_date']
+        for field in fields:
+            if PHOTO_LIST_FIELDS[field] not in columns:
+                columns.append(PHOTO_LIST_FIELDS[field])
+        
+        conditions = ['user_id = ?']
+        params = [user_id]
+        category = request.args.get('category')
+        if category:
+            conditions.append('category = ?')
+            params.append(category)
+        if request.args.get('cursor'):
+            try:
+                after_date, after_id = decode_photo_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('(upload_date, id) < (?, ?)')
+            params.extend([after_date, after_id])
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        params.append(limit + 1)
+        
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+        
+            # Порядок совпадает с индексами idx_photo_uploads_user[_category]_date_id
+            cursor.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM photo_uploads 
+                WHERE {' AND '.join(conditions)}
+                ORDER BY upload_date DESC, id DESC
+                LIMIT ?
+            ''', params)
+            rows = cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         photos = []
-        for row in cursor.fetchall():
-            photos.append({
-                'id': row[0],
-                'category': row[1],
-                'fileName': row[2],
-                'fileSize': row[3],
-                'mimeType': row[4],
-                'uploadDate': row[5],
-                'description': row[6]
-            })
-        
-        conn.close()
+        for row in rows:
+            values = dict(zip(columns, row))
+            photo = {}
+            for field in fields:
+                if field == 'thumbnails':
+                    photo[field] = thumbnail_urls(values['id'], values['thumbnail_status'])
+                else:
+                    photo[field] = values[PHOTO_LIST_FIELDS[field]]
+            photos.append(photo)
+        
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_photo_cursor(rows[-1][1], rows[-1][0])
         
         return jsonify({
             'success': True,
-            'photos': photos
+            'photos': photos,
+            'nextCursor': next_cursor,
+            'hasMore': has_more
         }), 200
         
     except Exception as e:
         logger.error(f"Error getting user photos: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def requested_thumbnail_size():
+    """Размер миниатюры из параметра size; None — нужен оригинал"""
+    size = request.args.get('size')
+    if not size or size == 'original':
+        return None
+    if size not in get_thumbnails().sizes:
+        raise ValueError(f"Unknown size: {size}")
+    return size
+
 @app.route('/api/photo/<photo_id>', methods=['GET'])
 def get_photo(photo_id):
-    """API endpoint для получения конкретного фото"""
+    """API endpoint для получения конкретного фото (параметр size — миниатюра вместо оригинала)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        try:
+            size = requested_thumbnail_size()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        cursor.execute('''
-            SELECT file_data, mime_type, file_name
-            FROM photo_uploads 
-            WHERE id = ?
-        ''', (photo_id,))
+        with pool.connection() as conn:
+            cursor = conn.cursor()
         
-        row = cursor.fetchone()
-        conn.close()
+            cursor.execute('''
+                SELECT file_data, mime_type, file_name, blob_sha256
+                FROM photo_uploads 
+                WHERE id = ?
+            ''', (photo_id,))
+        
+            row = cursor.fetchone()
         
         if not row:
             return jsonify({'error': 'Photo not found'}), 404
         
-        file_data, mime_type, file_name = row
+        file_data, mime_type, file_name, blob_sha256 = row
+        
+        # Миниатюры еще нет (в обработке или видео) — отдаем оригинал
+        thumbnails = get_thumbnails()
+        if size and blob_sha256 and thumbnails.has_thumbnail(blob_sha256, size):
+            with open(thumbnails.thumbnail_path(blob_sha256, size), 'rb') as f:
+                content = base64.b64encode(f.read()).decode('ascii')
+            return jsonify({
+                'success': True,
+                'fileData': content,
+                'mimeType': 'image/jpeg',
+                'fileName': file_name,
+                'size': size
+            }), 200
         
         return jsonify({
             'success': True,
-            'fileData': file_data,
+            'fileData': read_photo_content(blob_sha256, file_data),
             'mimeType': mime_type,
             'fileName': file_name
         }), 200
@@ -195,21 +613,116 @@ def get_photo(photo_id):
         logger.error(f"Error getting photo: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def accel_redirect_response(relative_path, etag, mime_type, file_name):
+    """Передача отдачи файла nginx через X-Accel-Redirect (Range и sendfile делает nginx)"""
+    response = Response(status=200, mimetype=mime_type)
+    response.headers['X-Accel-Redirect'] = BLOB_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path
+    response.headers['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(file_name)}"
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/photo/<photo_id>/raw', methods=['GET', 'HEAD'])
+def download_photo(photo_id):
+    """Отдача фото/видео бинарным файлом с поддержкой Range, ETag и X-Accel-Redirect (size — миниатюра)"""
+    try:
+        try:
+            size = requested_thumbnail_size()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT blob_sha256, file_data, mime_type, file_name
+                FROM photo_uploads
+                WHERE id = ?
+            ''', (photo_id,))
+            row = cursor.fetchone()
+        
+        if not row:
+            return jsonify({'error': 'Photo not found'}), 404
+        
+        blob_sha256, file_data, mime_type, file_name = row
+        
+        if blob_sha256:
+            store = get_blob_store()
+            path = store.path(blob_sha256)
+            relative_path = store.relative_path(blob_sha256)
+            # Содержимое не меняется, поэтому SHA-256 — сильный ETag
+            etag = blob_sha256
+            # Миниатюры еще нет (в обработке или видео) — отдаем оригинал
+            if size and get_thumbnails().has_thumbnail(blob_sha256, size):
+                path = get_thumbnails().thumbnail_path(blob_sha256, size)
+                relative_path = f"{relative_path}.{variant_name(size)}"
+                etag = f"{blob_sha256}-{size}"
+                mime_type = 'image/jpeg'
+                file_name = f"{os.path.splitext(file_name)[0]}-{size}.jpg"
+            
+            if etag in request.if_none_match:
+                response = Response(status=304)
+                response.set_etag(etag)
+            elif BLOB_ACCEL_REDIRECT_PREFIX:
+                response = accel_redirect_response(relative_path, etag, mime_type, file_name)
+            else:
+                response = send_file(
+                    path,
+                    mimetype=mime_type,
+                    download_name=file_name,
+                    conditional=True,
+                    etag=etag,
+                    max_age=PHOTO_CACHE_MAX_AGE
+                )
+        elif file_data:
+            # Старая запись, еще не перенесенная в файловое хранилище
+            content = decode_base64_payload(file_data)
+            response = send_file(
+                io.BytesIO(content),
+                mimetype=mime_type,
+                download_name=file_name,
+                conditional=True,
+                etag=hashlib.sha256(content).hexdigest(),
+                max_age=PHOTO_CACHE_MAX_AGE
+            )
+        else:
+            return jsonify({'error': 'Photo content not found'}), 404
+        
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = PHOTO_CACHE_MAX_AGE
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error downloading photo: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/delete-photo/<photo_id>', methods=['DELETE'])
 def delete_photo(photo_id):
     """API endpoint для удаления фото"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
         
-        cursor.execute('DELETE FROM photo_uploads WHERE id = ?', (photo_id,))
+            cursor.execute('SELECT blob_sha256 FROM photo_uploads WHERE id = ?', (photo_id,))
+            row = cursor.fetchone()
+            cursor.execute('DELETE FROM photo_uploads WHERE id = ?', (photo_id,))
         
-        if cursor.rowcount == 0:
-            conn.close()
-            return jsonify({'error': 'Photo not found'}), 404
+            if cursor.rowcount == 0:
+                return jsonify({'error': 'Photo not found'}), 404
         
-        conn.commit()
-        conn.close()
+            # Файл удаляем, только если на него больше не ссылается ни одна загрузка
+            blob_sha256 = row[0] if row else None
+            orphaned = False
+            if blob_sha256:
+                cursor.execute('SELECT COUNT(*) FROM photo_uploads WHERE blob_sha256 = ?', (blob_sha256,))
+                orphaned = cursor.fetchone()[0] == 0
+        
+            conn.commit()
+        
+        response_cache.invalidate('stats')
+        if orphaned:
+            get_blob_store().discard(blob_sha256)
         
         logger.info(f"Photo deleted successfully: photo_id={photo_id}")
         
@@ -223,39 +736,23 @@ def delete_photo(photo_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/stats', methods=['GET'])
+@cached_response(RESPONSE_CACHE_TTL_STATS, ('stats',))
 def get_stats():
     """API endpoint для получения статистики загрузок"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Общее количество загрузок
-        cursor.execute('SELECT COUNT(*) FROM photo_uploads')
-        total_uploads = cursor.fetchone()[0]
+        # Готовые значения из таблицы counters (поддерживаются триггерами)
+        with pool.connection() as conn:
+            values = counters.read(conn, ('photos_total', 'photo_users'))
+            by_category = counters.read_prefix(conn, counters.CATEGORY_PREFIX)
         
-        # Количество уникальных пользователей
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM photo_uploads')
-        unique_users = cursor.fetchone()[0]
-        
-        # Статистика по категориям
-        cursor.execute('''
-            SELECT category, COUNT(*) as count
-            FROM photo_uploads
-            GROUP BY category
-            ORDER BY count DESC
-        ''')
-        
-        category_stats = {}
-        for row in cursor.fetchall():
-            category_stats[row[0]] = row[1]
-        
-        conn.close()
+        # Статистика по категориям (по убыванию числа загрузок)
+        category_stats = dict(sorted(by_category.items(), key=lambda item: item[1], reverse=True))
         
         return jsonify({
             'success': True,
             'stats': {
-                'total_uploads': total_uploads,
-                'unique_users': unique_users,
+                'total_uploads': values['photos_total'],
+                'unique_users': values['photo_users'],
                 'category_stats': category_stats
             }
         }), 200
@@ -269,11 +766,11 @@ def health_check():
     return jsonify({'status': 'ok'}), 200
 
 @app.route('/api/referral/<user_id>', methods=['GET'])
+@cached_response(RESPONSE_CACHE_TTL_REFERRAL, lambda user_id: (referral_tag(user_id),), public=False)
 def get_referral_info(user_id):
     """API endpoint для получения реферальной информации пользователя"""
     try:
-        from database import Database
-        db = Database()
+        db = get_database()
         user_id = int(user_id)
         ref_info = db.get_user_referral_info(user_id)
         return jsonify(ref_info), 200
@@ -282,11 +779,11 @@ def get_referral_info(user_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/giveaway/prizes', methods=['GET'])
+@cached_response(RESPONSE_CACHE_TTL_PRIZES, ('prizes',))
 def get_giveaway_prizes():
     """API endpoint для получения призов гивевея"""
     try:
-        from database import Database
-        db = Database()
+        db = get_database()
         prizes = db.get_giveaway_prizes()
         return jsonify({'prizes': prizes}), 200
     except Exception as e:
@@ -297,8 +794,7 @@ def get_giveaway_prizes():
 def get_user_stats(user_id):
     """API endpoint для получения статистики пользователя"""
     try:
-        from database import Database
-        db = Database()
+        db = get_database()
         user_id = int(user_id)
         stats = db.get_user_stats(user_id)
         return jsonify(stats), 200
@@ -306,6 +802,45 @@ def get_user_stats(user_id):
         logger.error(f"Error getting user stats: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+# Ограничения на размер ответов рейтинга
+LEADERBOARD_MAX_LIMIT = 100
+LEADERBOARD_MAX_RADIUS = 10
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard_top():
+    """API endpoint для топа пригласивших (?limit=10)"""
+    try:
+        limit = min(max(request.args.get('limit', 10, type=int), 1), LEADERBOARD_MAX_LIMIT)
+        leaderboard = get_leaderboard(get_database().pool)
+        return jsonify({
+            'success': True,
+            'entries': leaderboard.top(limit),
+            'size': leaderboard.size()
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting leaderboard: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboard/<int:user_id>', methods=['GET'])
+def get_leaderboard_user(user_id):
+    """API endpoint для места пользователя в рейтинге и соседей (?radius=2)"""
+    try:
+        radius = min(max(request.args.get('radius', 2, type=int), 0), LEADERBOARD_MAX_RADIUS)
+        leaderboard = get_leaderboard(get_database().pool)
+        around = leaderboard.around(user_id, radius)
+        entry = next((item for item in around if item['user_id'] == user_id), None)
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'rank': entry['rank'] if entry else None,
+            'entry': entry,
+            'around': around,
+            'size': leaderboard.size()
+        }), 200
+    except Exception as e:
+        logger.error(f"Error getting leaderboard rank: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/create-prepared-message', methods=['POST'])
 def create_prepared_message():
     """API endpoint для создания подготовленного сообщения"""
@@ -317,8 +852,7 @@ def create_prepared_message():
         user_id = int(data.get('user_id'))
         message_type = data.get('message_type', 'default')
         
-        from database import Database
-        db = Database()
+        db = get_database()
         
         # Логируем активность
         db.add_activity(user_id, f"create_message_{message_type}")
@@ -344,8 +878,7 @@ def log_task_completion():
         task_name = data.get('task_name')
         task_number = int(data.get('task_number', 1))
         
-        from database import Database
-        db = Database()
+        db = get_database()
         
         # Логируем выполнение задания
         db.complete_task(user_id, task_name, task_number)
@@ -369,8 +902,7 @@ def log_referral_stats():
         
         user_id = int(data.get('user_id'))
         
-        from database import Database
-        db = Database()
+        db = get_database()
         
         # Логируем реферальную статистику
         db.log_referral_stats(user_id)
@@ -384,32 +916,57 @@ def log_referral_stats():
         logger.error(f"Error logging referral stats: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-def async_check_and_award_ticket(user_id):
-    """Асинхронная проверка подписки и начисление билета"""
-    time.sleep(3)  # Дать время на подписку
-    from database import Database
-    db = Database()
-    bot = Bot(token=BOT_TOKEN)
+# Вид задачи в очереди: фоновая проверка подписки после подписки на папку
+CHECK_SUBSCRIPTION_JOB = 'check_subscription'
+
+def check_and_award_ticket(payload):
+    """Фоновая проверка подписки и начисление билета (задача очереди check_subscription)"""
+    user_id = int(payload['user_id'])
+    db = get_database()
     
-    # Проверяем подписку на все каналы
-    all_subscribed = True
-    for channel_id in CHANNEL_IDS:
-        try:
-            member = asyncio.run(bot.get_chat_member(chat_id=channel_id, user_id=user_id))
-            if member.status not in ['member', 'administrator', 'creator']:
-                all_subscribed = False
-                break
-        except Exception:
-            all_subscribed = False
-            break
+    # Проверяем подписку на все каналы (параллельно, через общую сессию бота)
+    result = get_subscription_checker().check_user(user_id)
+    errors = [channel for channel in result['channels'] if channel.get('error')]
+    if errors:
+        # Ошибка Bot API (лимиты, сеть) — очередь повторит задачу с задержкой
+        raise RuntimeError(f"Subscription check failed for {len(errors)} channel(s): {errors[0]['error']}")
+    all_subscribed = result['subscribed']
     
-    # Обновляем статус подписки в новой системе
-    db.set_subscription_status(user_id, all_subscribed)
+    # Обновляем статус подписки в новой системе (полностью закэшированный итог уже сохранен)
+    if not result['cached']:
+        db.set_subscription_status(user_id, all_subscribed)
     
     if all_subscribed:
         logger.info(f"User {user_id} подписан на все каналы, статус обновлен!")
     else:
         logger.info(f"User {user_id} не подписан на все каналы, статус обновлен.")
+    return {'subscribed': all_subscribed, 'cached': result['cached']}
+
+# Периодическая сверка таблицы counters с данными (в обеих базах)
+RECONCILE_COUNTERS_JOB = 'reconcile_counters'
+
+def reconcile_counters_job(payload):
+    """Пересчет счетчиков с нуля; расхождения исправляются и попадают в лог и результат задачи"""
+    report = {}
+    for db_pool, queries in ((get_database().pool, counters.COUNTER_QUERIES), (pool, counters.PHOTO_COUNTER_QUERIES)):
+        drift = counters.reconcile(db_pool, queries=queries)
+        if drift:
+            logger.warning(f"Counters drift in {db_pool.db_path}: {drift}")
+        report[db_pool.db_path] = {name: list(values) for name, values in drift.items()}
+    # Следующая сверка
+    get_job_queue().enqueue(RECONCILE_COUNTERS_JOB, {}, delay=COUNTERS_RECONCILE_INTERVAL, dedupe_key='periodic')
+    return report
+
+_job_queue = None
+
+def get_job_queue():
+    """Очередь фоновых задач в users.db (создается при первом обращении)"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(get_database().pool)
+        _job_queue.register(CHECK_SUBSCRIPTION_JOB, check_and_award_ticket)
+        _job_queue.register(RECONCILE_COUNTERS_JOB, reconcile_counters_job)
+    return _job_queue
 
 @app.route('/api/log-folder-subscription', methods=['POST'])
 def log_folder_subscription():
@@ -421,15 +978,23 @@ def log_folder_subscription():
         if 'user_id' not in data:
             return jsonify({'error': 'Missing user_id field'}), 400
         user_id = int(data['user_id'])
-        from database import Database
-        db = Database()
+        db = get_database()
         db.log_folder_subscription(user_id)
         logger.info(f"Folder subscription logged: user_id={user_id}")
-        # Асинхронно проверяем подписку и обновляем статус
-        threading.Thread(target=async_check_and_award_ticket, args=(user_id,)).start()
+        # Пользователь сообщил о подписке — прежние результаты проверки больше не актуальны
+        get_subscription_checker().invalidate(user_id)
+        # Проверяем подписку в фоне, дав пользователю время подписаться;
+        # повторные вызовы до запуска проверки не создают новых задач
+        job_id = get_job_queue().enqueue(
+            CHECK_SUBSCRIPTION_JOB,
+            {'user_id': user_id},
+            delay=SUBSCRIPTION_CHECK_DELAY,
+            dedupe_key=str(user_id)
+        )
         return jsonify({
             'success': True,
-            'message': 'Folder subscription logged successfully, checking subscription in background.'
+            'message': 'Folder subscription logged successfully, checking subscription in background.',
+            'job_id': job_id
         }), 200
     except Exception as e:
         logger.error(f"Error logging folder subscription: {str(e)}")
@@ -441,60 +1006,75 @@ def check_subscription():
     try:
         data = request.get_json()
         user_id = int(data.get('user_id'))
-        bot = Bot(token=BOT_TOKEN)
-        all_subscribed = True
-        for channel_id in CHANNEL_IDS:
-            try:
-                member = asyncio.run(bot.get_chat_member(chat_id=channel_id, user_id=user_id))
-                if member.status not in ['member', 'administrator', 'creator']:
-                    all_subscribed = False
-                    break
-            except Exception:
-                all_subscribed = False
-                break
-        
-        # Обновляем статус в базе данных
-        from database import Database
-        db = Database()
-        db.set_subscription_status(user_id, all_subscribed)
+        checker = get_subscription_checker()
+        # Повторная проверка после подписки: отрицательные результаты перепроверяем в Telegram
+        checker.invalidate(user_id, only_negative=True)
+        result = checker.check_user(user_id)
+        errors = [channel for channel in result['channels'] if channel.get('error')]
+        if errors:
+            # Ошибка Bot API (лимиты, сеть) — итог неизвестен, сохраненный статус не трогаем
+            logger.error(f"Subscription check failed for user {user_id} in {len(errors)} channel(s): {errors[0]['error']}")
+            return jsonify({'error': 'Subscription check is temporarily unavailable', 'channels': result['channels']}), 503
+
+        # Обновляем статус в базе данных (полностью закэшированный итог уже сохранен)
+        if not result['cached']:
+            db = get_database()
+            db.set_subscription_status(user_id, result['subscribed'])
         
-        return jsonify({'subscribed': all_subscribed}), 200
+        return jsonify({'subscribed': result['subscribed'], 'channels': result['channels']}), 200
     except Exception as e:
         logger.error(f"Error checking subscription: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def get_user_photo_counts(user_id):
+    """Число фото пользователя всего и по категориям (одна выборка по индексу user_id, category)"""
+    with pool.connection() as conn:
+        rows = conn.execute(
+            'SELECT category, COUNT(*) FROM photo_uploads WHERE user_id = ? GROUP BY category', (str(user_id),)
+        ).fetchall()
+    by_category = dict(rows)
+    return {'total': sum(by_category.values()), 'by_category': by_category}
+
+@app.route('/api/user/<user_id>/dashboard', methods=['GET'])
+def get_user_dashboard(user_id):
+    """
+    Экран пользователя одним ответом: билеты, подписка, задания, рефералы и фото.
+    Слабый ETag по содержимому: повторный опрос с If-None-Match получает 304 без тела
+    """
+    try:
+        user_id = int(user_id)
+        dashboard = get_database().get_user_dashboard(user_id)
+        if dashboard is None:
+            return jsonify({'error': 'Internal server error'}), 500
+        dashboard['photos'] = get_user_photo_counts(user_id)
+        
+        body = json.dumps(dashboard, sort_keys=True, ensure_ascii=False)
+        response = Response(body, mimetype='application/json')
+        response.set_etag(hashlib.sha256(body.encode('utf-8')).hexdigest()[:32], weak=True)
+        # Браузер хранит ответ, но перед каждым использованием сверяет ETag
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    except ValueError:
+        return jsonify({'error': 'Invalid user_id'}), 400
+    except Exception as e:
+        logger.error(f"Error getting user dashboard: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/user/<user_id>/tickets', methods=['GET'])
 def get_user_tickets(user_id):
     """Получение количества билетов пользователя и статусов заданий"""
     try:
-        from database import Database
-        db = Database()
-        user_id = int(user_id)
-        
-        # Используем новый метод для получения билетов
-        tickets = db.get_user_tickets(user_id)
-        
-        # Получаем информацию о пользователе
-        user_stats = db.get_user_stats(user_id)
-        username = user_stats.get('username', '')
-        
-        # Получаем статусы заданий
-        task_statuses = db.get_task_statuses(user_id)
-        
-        # Проверяем текущий статус подписки
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT is_subscribed_all FROM tickets_subscription WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        subscribed = result[0] if result else False
-        conn.close()
+        dashboard = get_database().get_user_dashboard(int(user_id))
+        if dashboard is None:
+            return jsonify({'error': 'Internal server error'}), 500
         
         return jsonify({
-            'tickets': tickets,
-            'subscribed': subscribed,
-            'username': username,
-            'task1_done': task_statuses['task1_done'],
-            'task2_done': task_statuses['task2_done']
+            'tickets': dashboard['tickets']['total'],
+            'subscribed': dashboard['subscribed'],
+            'username': dashboard['username'],
+            'task1_done': dashboard['tasks']['task1_done'],
+            'task2_done': dashboard['tasks']['task2_done']
         }), 200
     except Exception as e:
         logger.error(f"Error getting user tickets: {str(e)}")
@@ -507,14 +1087,13 @@ def check_subscription_by_username():
         data = request.get_json()
         username = data.get('username')
         channel_id = -1001973736826  # Пример: один канал
-        from aiogram import Bot
-        from config import BOT_TOKEN
-        bot = Bot(token=BOT_TOKEN)
+        checker = get_subscription_checker()
+        bot = checker.bot
         # Проверяем, что бот админ в канале
         try:
-            bot_id = asyncio.run(bot.get_me()).id
-            member = asyncio.run(bot.get_chat_member(chat_id=channel_id, user_id=bot_id))
-            if member.status not in ['administrator', 'creator']:
+            bot_id = checker.run(bot.get_me()).id
+            member = checker.run(bot.get_chat_member(chat_id=channel_id, user_id=bot_id))
+            if member.status not in ADMIN_STATUSES:
                 return jsonify({'error': 'Bot is not admin in channel', 'admin': False}), 403
         except Exception as e:
             return jsonify({'error': f'Bot admin check failed: {e}', 'admin': False}), 500
@@ -522,7 +1101,7 @@ def check_subscription_by_username():
         try:
             # В реальности Telegram API не позволяет искать по username напрямую,
             # нужен user_id. Здесь пример: ищем среди админов по username.
-            admins = asyncio.run(bot.get_chat_administrators(channel_id))
+            admins = checker.run(bot.get_chat_administrators(channel_id))
             found = False
             for admin in admins:
                 if admin.user.username and admin.user.username.lower() == username.lower():
@@ -541,8 +1120,7 @@ def add_ticket_for_referral():
         data = request.get_json()
         inviter_id = int(data.get('inviter_id'))
         invitee_id = int(data.get('invitee_id'))
-        from database import Database
-        db = Database()
+        db = get_database()
         
         # Используем новый метод для добавления билета за реферала
         db.add_referral_ticket(inviter_id, invitee_id)
@@ -555,25 +1133,17 @@ def add_ticket_for_referral():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tickets/total', methods=['GET'])
+@cached_response(RESPONSE_CACHE_TTL_TICKETS, ('tickets',))
 def get_total_tickets():
     """Получение общего количества билетов"""
     try:
-        from database import Database
-        db = Database()
-        
-        # Используем новую логику подсчета билетов
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Билеты за подписку на все каналы
-        cursor.execute('SELECT COUNT(*) FROM tickets_subscription WHERE is_subscribed_all = 1')
-        subscription_tickets = cursor.fetchone()[0]
+        db = get_database()
         
-        # Билеты за рефералов
-        cursor.execute('SELECT COUNT(*) FROM tickets_referral')
-        referral_tickets = cursor.fetchone()[0]
-        
-        conn.close()
+        # Билеты за подписку на все каналы и за рефералов — из таблицы counters базы бота
+        with db.pool.connection() as conn:
+            values = counters.read(conn, ('tickets_subscription', 'tickets_referral'))
+        subscription_tickets = values['tickets_subscription']
+        referral_tickets = values['tickets_referral']
         
         total = subscription_tickets + referral_tickets
         
@@ -589,14 +1159,87 @@ def get_total_tickets():
 def health():
     return jsonify({'status': 'ok'}), 200
 
+@app.route('/api/subscription/cache-stats', methods=['GET'])
+def get_subscription_cache_stats():
+    """Счётчики кэша проверок подписки (попадания, промахи, вытеснения)"""
+    try:
+        return jsonify({'success': True, 'cache': get_subscription_checker().cache.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting subscription cache stats: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/response-cache/stats', methods=['GET'])
+def get_response_cache_stats():
+    """Счётчики кэша ответов API (попадания, ожидания чужого пересчета, сбросы)"""
+    try:
+        return jsonify({'success': True, 'cache': response_cache.stats()}), 200
+    except Exception as e:
+        logger.error(f"Error getting response cache stats: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Глубина очереди фоновых задач; с ?user_id= — последние проверки подписки пользователя"""
+    try:
+        queue = get_job_queue()
+        response = {'success': True, 'queue': queue.stats()}
+        if request.args.get('user_id'):
+            response['jobs'] = queue.find(CHECK_SUBSCRIPTION_JOB, request.args['user_id'])
+        return jsonify(response), 200
+    except Exception as e:
+        logger.error(f"Error getting jobs: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Состояние фоновой задачи"""
+    try:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job}), 200
+    except Exception as e:
+        logger.error(f"Error getting job: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/storage/settings', methods=['GET'])
+def get_storage_settings():
+    """Текущие настройки хранения SQLite (PRAGMA), пула и checkpoint"""
+    try:
+        db = get_database()
+        databases = {}
+        for db_pool in (pool, db.pool):
+            databases[db_pool.db_path] = {
+                'settings': db_pool.settings(),
+                'pool': db_pool.stats()
+            }
+        return jsonify({'success': True, 'databases': databases}), 200
+    except Exception as e:
+        logger.error(f"Error getting storage settings: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 if __name__ == '__main__':
-    # Инициализируем таблицу при запуске
-    init_photo_uploads_table()
+    # Досоздаем миниатюры для загрузок, которые не успели обработаться до перезапуска
+    get_thumbnails().backfill()
+    # Периодический checkpoint WAL-журналов
+    pool.start_checkpointer()
+    get_database().pool.start_checkpointer()
     # Проверяем админство бота во всех каналах
-    asyncio.run(check_bot_admin_rights())
+    check_bot_admin_rights()
+    # Воркеры очереди фоновых задач (задачи, поставленные до перезапуска, тоже выполнятся)
+    get_job_queue().start()
+    # Сверка счетчиков при старте и дальше раз в COUNTERS_RECONCILE_INTERVAL секунд
+    # (sooner: периодическая задача от прошлого запуска переносится на сейчас)
+    get_job_queue().enqueue(RECONCILE_COUNTERS_JOB, {}, dedupe_key='periodic', sooner=True)
     # Запускаем сервер
-    app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=False
-    ) 
+    try:
+        app.run(
+            host='0.0.0.0',
+            port=5000,
+            debug=False
+        )
+    finally:
+        get_job_queue().stop()
+        # Закрываем HTTP-сессию бота
+        get_subscription_checker().close()
+
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """
 Скрипт для применения миграций базы данных
+Миграции из migrations/ применяются к базе бота (DATABASE_PATH), к базе фото
+(fsr.db) — только миграции фото (PHOTO_MIGRATIONS из database.py)
 """
 
 import sqlite3
@@ -8,6 +10,9 @@ import os
 import sys
 from pathlib import Path
 
+# База фото API (api_server.DB_PATH)
+PHOTO_DB_PATH = "fsr.db"
+
 def check_database_initialized(db_path):
     """Проверяет, инициализирована ли база данных (есть ли таблица users)"""
     if not os.path.exists(db_path):
@@ -42,32 +47,47 @@ def init_database_if_needed(db_path):
     return True
 
 def apply_migration(db_path, migration_file):
-    """Применяет миграцию из файла"""
+    """Применяет миграцию из файла (один раз, учёт ведётся в таблице schema_migrations)"""
     print(f"Применяем миграцию: {migration_file}")
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Читаем SQL из файла миграции
-        with open(migration_file, 'r', encoding='utf-8') as f:
-            sql_content = f.read()
+        from database import Database
+        db = Database(db_path)
         
-        # Выполняем SQL команды
-        cursor.executescript(sql_content)
-        conn.commit()
-        conn.close()
-        
-        print(f"✅ Миграция {migration_file} успешно применена")
+        if db.apply_migration(str(migration_file)):
+            print(f"✅ Миграция {migration_file} успешно применена")
+        else:
+            print(f"ℹ️ Миграция {migration_file} уже была применена ранее")
         return True
         
     except Exception as e:
         print(f"❌ Ошибка при применении миграции {migration_file}: {e}")
         return False
 
+def apply_photo_migrations(db_path):
+    """Применяет к базе фото только миграции фото (без таблиц бота)"""
+    if not os.path.exists(db_path):
+        print(f"ℹ️ База фото {db_path} еще не создана — ее инициализирует api_server.py")
+        return True
+
+    print(f"Применяем миграции фото к {db_path}")
+    try:
+        from database import apply_photo_migrations as apply
+        from db_pool import get_pool
+        applied = apply(get_pool(db_path))
+        if applied:
+            print(f"✅ Применены: {', '.join(applied)}")
+        else:
+            print("ℹ️ Все миграции фото уже были применены ранее")
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка при применении миграций фото: {e}")
+        return False
+
 def main():
-    # Путь к базе данных
-    db_path = "fsr.db"
+    # Путь к базе данных бота
+    from config import DATABASE_PATH
+    db_path = DATABASE_PATH
     
     # Инициализируем базу данных если нужно
     if not init_database_if_needed(db_path):
@@ -100,7 +120,10 @@ def main():
     
     print(f"\n📊 Результат: {success_count}/{len(migration_files)} миграций применено успешно")
     
-    if success_count == len(migration_files):
+    # База фото API (fsr.db)
+    photos_ok = apply_photo_migrations(PHOTO_DB_PATH)
+    
+    if success_count == len(migration_files) and photos_ok:
         print("✅ Все миграции применены успешно!")
     else:
         print("⚠️ Некоторые миграции не были применены")
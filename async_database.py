@@ -0,0 +1,120 @@
+"""
+Асинхронный доступ к Database для обработчиков aiogram.
+
+Методы Database синхронные (sqlite3), поэтому вызываются в отдельном пуле
+потоков, а не в event loop: медленная запись в SQLite больше не задерживает
+остальные обновления. Любой метод Database доступен как корутина:
+await adb.get_user_stats(user_id).
+
+update_user_activity копит записи активности в памяти и пишет их пачкой
+(Database.add_activities) раз в ACTIVITY_FLUSH_INTERVAL секунд или по
+достижении ACTIVITY_BATCH_SIZE записей.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from config import (
+    DB_POOL_SIZE,
+    ACTIVITY_FLUSH_INTERVAL,
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_MAX_PENDING,
+)
+from database import Database
+
+
+class AsyncDatabase:
+    def __init__(self, db: Database, max_workers: int = DB_POOL_SIZE,
+                 flush_interval: float = ACTIVITY_FLUSH_INTERVAL,
+                 batch_size: int = ACTIVITY_BATCH_SIZE,
+                 max_pending: int = ACTIVITY_MAX_PENDING):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # Потоков не больше, чем соединений в пуле: лишние все равно ждали бы соединения
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async-db')
+        self._pending: List[Tuple[int, str, Optional[str], str]] = []
+        self._flush_lock = None
+        self._flusher = None
+        self._stats = {'activities_queued': 0, 'activities_written': 0, 'flushes': 0, 'flush_errors': 0}
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнение синхронной функции в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def start(self):
+        """Запуск периодической записи активности (вызывать внутри работающего loop)"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def update_user_activity(self, user_id: int, action: str, details: str = None):
+        """Запись активности пользователя (пачкой, в фоне)"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self._pending.append((user_id, action, details, timestamp))
+        self._stats['activities_queued'] += 1
+        if len(self._pending) >= self.max_pending:
+            # Запись не успевает за потоком событий — ждем ее, а не копим память
+            await self.flush()
+        elif len(self._pending) >= self.batch_size:
+            asyncio.create_task(self.flush())
+
+    async def flush(self) -> int:
+        """Запись накопленной активности; возвращает число записанных строк"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                await self.run(self.db.add_activities, batch)
+            except Exception as e:
+                # Возвращаем пачку в начало очереди, чтобы не потерять ее при временной ошибке
+                print(f"Error flushing user activity: {e}")
+                self._pending = batch[-self.max_pending:] + self._pending
+                self._stats['flush_errors'] += 1
+                return 0
+            self._stats['activities_written'] += len(batch)
+            self._stats['flushes'] += 1
+            return len(batch)
+
+    async def close(self):
+        """Запись остатка активности и остановка пула потоков"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['pending'] = len(self._pending)
+        return stats
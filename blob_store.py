@@ -0,0 +1,192 @@
+"""
+Файловое хранилище бинарных данных с адресацией по содержимому.
+
+Файл хранится под именем своего SHA-256 в каталогах по первым символам хэша
+(blobs/ab/cd/abcd...), поэтому одинаковые загрузки занимают место один раз,
+а в SQLite остаются только метаданные и хэш.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from typing import BinaryIO, Iterable, Iterator, Optional, Set, Tuple
+
+from config import BLOB_STORE_PATH
+
+
+class BlobTooLarge(Exception):
+    """Размер данных превысил допустимый лимит"""
+
+
+class BlobStore:
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root: str = BLOB_STORE_PATH, depth: int = 2, width: int = 2):
+        self.root = os.path.abspath(root)
+        self.depth = depth
+        self.width = width
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def _check_digest(sha256: str):
+        if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+            raise ValueError(f"Invalid blob digest: {sha256!r}")
+
+    def relative_path(self, sha256: str) -> str:
+        """Путь блоба относительно корня хранилища"""
+        self._check_digest(sha256)
+        parts = [sha256[i * self.width:(i + 1) * self.width] for i in range(self.depth)]
+        return os.path.join(*parts, sha256)
+
+    def path(self, sha256: str) -> str:
+        """Абсолютный путь к блобу"""
+        return os.path.join(self.root, self.relative_path(sha256))
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def size(self, sha256: str) -> int:
+        return os.path.getsize(self.path(sha256))
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        """Сохранение байтов; возвращает (sha256, размер)"""
+        return self.put_chunks([data])
+
+    def put_stream(self, stream: BinaryIO, max_size: Optional[int] = None) -> Tuple[str, int]:
+        """Потоковое сохранение из файлоподобного объекта"""
+        def chunks():
+            while True:
+                chunk = stream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        return self.put_chunks(chunks(), max_size=max_size)
+
+    def put_chunks(self, chunks: Iterable[bytes], max_size: Optional[int] = None) -> Tuple[str, int]:
+        """Сохранение потока кусков с подсчётом хэша на лету (память не зависит от размера файла)"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLarge(f"Blob exceeds {max_size} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            self._commit(tmp_path, sha256)
+            return sha256, size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path: str, sha256: str):
+        """Перенос временного файла на место блоба (с дедупликацией)"""
+        target = self.path(sha256)
+        if os.path.exists(target):
+            # Такой блоб уже есть: обновляем mtime, чтобы параллельное удаление его не тронуло
+            os.utime(target)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+
+    def derived_path(self, sha256: str, variant: str) -> str:
+        """Путь производного файла (превью и т.п.), который лежит рядом с оригиналом"""
+        if not variant or any(c in variant for c in '/\\'):
+            raise ValueError(f"Invalid variant: {variant!r}")
+        return f"{self.path(sha256)}.{variant}"
+
+    def exists_derived(self, sha256: str, variant: str) -> bool:
+        return os.path.exists(self.derived_path(sha256, variant))
+
+    def put_derived(self, sha256: str, variant: str, data: bytes) -> str:
+        """Атомарная запись производного файла; возвращает путь"""
+        target = self.derived_path(sha256, variant)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return target
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self.path(sha256), 'rb')
+
+    def read(self, sha256: str) -> bytes:
+        with self.open(sha256) as f:
+            return f.read()
+
+    def iter_chunks(self, sha256: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """Чтение блоба (или его диапазона) кусками"""
+        with self.open(sha256) as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                to_read = self.CHUNK_SIZE if remaining is None else min(self.CHUNK_SIZE, remaining)
+                chunk = f.read(to_read)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def discard(self, sha256: str, grace_seconds: float = 60.0) -> bool:
+        """
+        Удаление блоба, на который больше не ссылается ни одна запись.
+        Недавно записанные блобы не трогаем: их может сейчас сохранять параллельная загрузка.
+        """
+        path = self.path(sha256)
+        try:
+            if time.time() - os.path.getmtime(path) < grace_seconds:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        # Вместе с оригиналом удаляем производные файлы (превью)
+        directory = os.path.dirname(path)
+        for name in os.listdir(directory):
+            if name.startswith(sha256 + '.'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        return True
+
+    def iter_digests(self) -> Iterator[str]:
+        """Все хэши, лежащие в хранилище"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if os.path.abspath(dirpath) == self.tmp_dir:
+                dirnames[:] = []
+                continue
+            for name in filenames:
+                if len(name) == 64:
+                    yield name
+
+    def gc(self, referenced: Set[str], grace_seconds: float = 3600.0) -> int:
+        """Удаление блобов, не входящих в referenced; возвращает количество удалённых"""
+        removed = 0
+        for sha256 in list(self.iter_digests()):
+            if sha256 not in referenced and self.discard(sha256, grace_seconds):
+                removed += 1
+        return removed
+
+
+_store = None
+
+
+def get_blob_store() -> BlobStore:
+    """Общий экземпляр хранилища"""
+    global _store
+    if _store is None:
+        _store = BlobStore()
+    return _store
@@ -9,8 +9,11 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
 import os
 from dotenv import load_dotenv
-from database import Database
-from logger import TelegramLogger
+from database import get_database
+from async_database import AsyncDatabase
+from logger import telegram_logger
+from outbox_dispatcher import OutboxDispatcher
+from leaderboard import get_leaderboard
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -24,8 +27,11 @@ bot = Bot(token=os.getenv('BOT_TOKEN'))
 dp = Dispatcher()
 
 # Инициализация базы данных и логгера
-db = Database()
-telegram_logger = TelegramLogger()
+db = get_database()
+# Обработчики работают с базой через adb: запросы выполняются вне event loop
+adb = AsyncDatabase(db)
+# Уведомления, записанные Database (в том числе из API), доставляются отсюда
+outbox = OutboxDispatcher(db, telegram_logger)
 
 # ID администраторов
 admin_ids = [int(os.getenv('ADMIN_CHAT_ID', '0'))]
@@ -52,6 +58,7 @@ async def set_bot_commands():
     
     if admin_ids[0] != 0:  # Если указан админ
         commands.append(BotCommand(command="stats", description="📊 Статистика (админ)"))
+        commands.append(BotCommand(command="rank", description="🏆 Место в рейтинге рефералов (админ)"))
     
     await bot.set_my_commands(commands)
 
@@ -101,14 +108,14 @@ async def cmd_start(message: types.Message):
             referred_by = ref_code[3:]  # Убираем 'ref' префикс
     
     # Добавляем пользователя в базу данных
-    db.add_user(user_id, username, first_name, last_name, referred_by)
+    await adb.add_user(user_id, username, first_name, last_name, referred_by)
     
     # Если пользователь пришел по реферальной ссылке — начисляем билет пригласившему
     if referred_by:
         try:
             inviter_id = int(referred_by)
             invitee_id = user_id
-            db.add_ticket_for_referral_start(inviter_id, invitee_id)
+            await adb.add_ticket_for_referral_start(inviter_id, invitee_id)
         except Exception as e:
             print(f"Error adding ticket for referral: {e}")
     
@@ -116,7 +123,7 @@ async def cmd_start(message: types.Message):
     if referred_by:
         # Получаем информацию о пригласившем пользователе
         try:
-            inviter_info = db.get_user_stats(int(referred_by))
+            inviter_info = await adb.get_user_stats(int(referred_by))
             if inviter_info:
                 inviter_username = inviter_info.get('username', 'без username')
                 inviter_name = inviter_info.get('first_name', 'Неизвестно')
@@ -129,9 +136,9 @@ async def cmd_start(message: types.Message):
     else:
         ref_info_text = "Пришел без реферальной ссылки"
     
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "start", ref_info_text
-    ))
+    )
     
     # Создаем клавиатуру
     builder = InlineKeyboardBuilder()
@@ -168,12 +175,12 @@ async def cmd_giveaway(message: types.Message):
     first_name = message.from_user.first_name
     
     # Логируем действие
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "giveaway", "User requested giveaway info"
-    ))
+    )
     
     # Получаем информацию о подарках
-    prizes = db.get_giveaway_prizes()
+    prizes = await adb.get_giveaway_prizes()
     
     prizes_text = "🎁 **ПРИЗЫ ГИВЕВЕЯ:**\n\n"
     total_value = 0
@@ -211,12 +218,12 @@ async def cmd_invite(message: types.Message):
     first_name = message.from_user.first_name
     
     # Логируем действие
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "invite", "User requested invite friends"
-    ))
+    )
     
     # Получаем реферальную информацию пользователя
-    ref_info = db.get_user_referral_info(user_id)
+    ref_info = await adb.get_user_referral_info(user_id)
     
     if not ref_info:
         await message.answer("❌ Ошибка получения реферальной информации")
@@ -279,12 +286,12 @@ async def cmd_stats(message: types.Message):
         return
     
     # Логируем действие
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "admin_stats", "Admin requested stats"
-    ))
+    )
     
     # Получаем глобальную статистику
-    global_stats = db.get_global_stats()
+    global_stats = await adb.get_global_stats()
     
     stats_text = f"""
 📊 **СТАТИСТИКА FSR БОТА**
@@ -306,6 +313,34 @@ async def cmd_stats(message: types.Message):
     
     await message.answer(stats_text, parse_mode=ParseMode.MARKDOWN)
 
+@dp.message(Command("rank"))
+async def cmd_rank(message: types.Message):
+    """Обработчик команды /rank <user_id> — место в рейтинге рефералов (только для админов)"""
+    if message.from_user.id not in admin_ids:
+        await message.answer("❌ У вас нет доступа к этой команде")
+        return
+    
+    args = (message.text or "").split()
+    if len(args) < 2 or not args[1].isdigit():
+        await message.answer("Использование: /rank <user_id>")
+        return
+    target_id = int(args[1])
+    
+    leaderboard = get_leaderboard(db.pool)
+    around = await adb.run(leaderboard.around, target_id, 2)
+    if not around:
+        await message.answer(f"Пользователь {target_id} пока не в рейтинге")
+        return
+    
+    size = await adb.run(leaderboard.size)
+    lines = []
+    for row in around:
+        username = row['username'] or row['first_name'] or "Unknown"
+        marker = "👉" if row['user_id'] == target_id else "•"
+        lines.append(f"{marker} {row['rank']}. {username}: {row['referral_count']} друзей, {row['total_referral_xp']} XP")
+    
+    await message.answer(f"🏆 Рейтинг рефералов (всего {size}):\n\n" + "\n".join(lines))
+
 @dp.message(Command("help"))
 async def cmd_help(message: types.Message):
     """Обработчик команды /help"""
@@ -314,9 +349,9 @@ async def cmd_help(message: types.Message):
     first_name = message.from_user.first_name
     
     # Логируем действие
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "help", "User requested help"
-    ))
+    )
     
     help_text = """
 <b>🤖 FSR Bot - Справка</b>
@@ -360,8 +395,10 @@ async def callback_my_stats(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     
     # Получаем статистику пользователя
-    user_stats = db.get_user_stats(user_id)
-    ref_info = db.get_user_referral_info(user_id)
+    user_stats, ref_info = await asyncio.gather(
+        adb.get_user_stats(user_id),
+        adb.get_user_referral_info(user_id)
+    )
     
     if not user_stats or not ref_info:
         await callback.answer("❌ Ошибка получения статистики")
@@ -393,35 +430,15 @@ async def callback_my_stats(callback: types.CallbackQuery):
 
 async def get_top_referrers() -> str:
     """Получение топ рефералов"""
-    try:
-        conn = db.db_path
-        import sqlite3
-        conn = sqlite3.connect(conn)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.username, u.first_name, u.referral_count, u.total_referral_xp
-            FROM users u
-            WHERE u.referral_count > 0
-            ORDER BY u.referral_count DESC, u.total_referral_xp DESC
-            LIMIT 5
-        ''')
-        
-        top_referrers = []
-        for row in cursor.fetchall():
-            username = row[0] or row[1] or "Unknown"
-            top_referrers.append(f"• {username}: {row[2]} друзей, {row[3]} XP")
-        
-        conn.close()
-        
-        if top_referrers:
-            return "\n".join(top_referrers)
-        else:
-            return "Пока нет рефералов"
-            
-    except Exception as e:
-        print(f"Error getting top referrers: {e}")
-        return "Ошибка получения данных"
+    top_referrers = []
+    for row in await adb.get_top_referrers(5):
+        username = row['username'] or row['first_name'] or "Unknown"
+        top_referrers.append(f"• {username}: {row['referral_count']} друзей, {row['total_referral_xp']} XP")
+    
+    if top_referrers:
+        return "\n".join(top_referrers)
+    else:
+        return "Пока нет рефералов"
 
 # Новые методы для поддержки shareMessage
 @dp.message(Command("save_message"))
@@ -520,11 +537,11 @@ async def handle_all_messages(message: types.Message):
     first_name = message.from_user.first_name
     
     # Логируем действие пользователя
-    asyncio.create_task(telegram_logger.log_user_action(
+    await telegram_logger.log_user_action(
         user_id, username, first_name, "message_sent", f"User sent message: {message.text[:50]}{'...' if len(message.text) > 50 else ''}"
-    ))
+    )
     
-    await db.update_user_activity(user_id, "message_sent")
+    await adb.update_user_activity(user_id, "message_sent")
     
     # Очистка памяти каждые 100 сообщений для оптимизации
     if message.message_id % 100 == 0:
@@ -549,13 +566,15 @@ async def check_bot_admin_status():
     except Exception as e:
         logger.error(f"❌ Ошибка проверки админства бота в канале {channel_id}: {e}")
 
-async def main():
-    """Основная функция"""
-    logger.info("Запуск FSR Telegram Bot...")
-    print("🚀 Запуск FSR Telegram Bot...")
-    print(f"🌐 WebApp URL: {WEBAPP_URL}")
-    print(f"📁 Giveaway Link: {GIVEAWAY_LINK}")
-    print("=" * 50)
+async def on_startup():
+    """Общий запуск для polling и webhook"""
+    # Периодический checkpoint WAL-журнала базы
+    db.pool.start_checkpointer()
+    # Пакетная запись активности пользователей
+    adb.start()
+    # Доставка логов, в том числе оставшихся в журнале с прошлого запуска
+    telegram_logger.start()
+    outbox.start()
 
     # Проверка админства бота в канале
     await check_bot_admin_status()
@@ -568,9 +587,39 @@ async def main():
         await telegram_logger.log_bot_start()
     except Exception as e:
         logger.error(f"Error logging bot start: {e}")
+
+async def on_shutdown():
+    """Дописываем накопленную активность и логи перед остановкой"""
+    await outbox.stop()
+    await adb.close()
+    await telegram_logger.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+def print_banner(mode: str):
+    logger.info(f"Запуск FSR Telegram Bot ({mode})...")
+    print(f"🚀 Запуск FSR Telegram Bot ({mode})...")
+    print(f"🌐 WebApp URL: {WEBAPP_URL}")
+    print(f"📁 Giveaway Link: {GIVEAWAY_LINK}")
+    print("=" * 50)
+
+async def main():
+    """Основная функция (long polling)"""
+    print_banner('polling')
+
+    # При установленном webhook Telegram не отдает обновления через getUpdates
+    await bot.delete_webhook()
     
     # Запускаем бота
     await dp.start_polling(bot)
 
+def main_webhook():
+    """Запуск в режиме webhook за nginx (блокирует до остановки)"""
+    from webhook_server import run_webhook, webhook_url
+    print_banner('webhook')
+    print(f"🔗 Webhook: {webhook_url()}")
+    run_webhook(dp, bot)
+
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Проверка, что горячие запросы используют индексы (EXPLAIN QUERY PLAN)
+Использование: python3 check_query_plans.py [путь_к_бд]
+"""
+
+import sys
+
+from config import DATABASE_PATH
+
+# (название, запрос, параметры, индекс (или кортеж допустимых индексов), который должен использоваться)
+HOT_QUERIES = [
+    (
+        'user_summary.rebuild / successful_invites (task2_done)',
+        "SELECT COUNT(*) FROM referral_invites WHERE inviter_id = ? AND status = 'joined'",
+        (1,),
+        'idx_referral_invites_inviter_status',
+    ),
+    (
+        'user_summary.rebuild / successful_invites',
+        '''SELECT referral_code, referral_count, total_referral_xp,
+                  (SELECT COUNT(*) FROM referral_invites WHERE inviter_id = users.user_id AND status = 'joined') as successful_invites
+           FROM users WHERE user_id = ?''',
+        (1,),
+        'idx_referral_invites_inviter_status',
+    ),
+    (
+        'referral_invites / (inviter_id, invitee_id)',
+        'SELECT COUNT(*) FROM referral_invites WHERE inviter_id = ? AND invitee_id = ?',
+        (1, 2),
+        'idx_referral_invites_inviter_invitee',
+    ),
+    (
+        'referral_invites by invitee',
+        'SELECT inviter_id FROM referral_invites WHERE invitee_id = ?',
+        (2,),
+        'idx_referral_invites_invitee_id',
+    ),
+    (
+        '/api/user-photos / первая страница',
+        '''SELECT id, category, file_name, file_size, mime_type, upload_date, description
+           FROM photo_uploads WHERE user_id = ?
+           ORDER BY upload_date DESC, id DESC LIMIT ?''',
+        ('1', 51),
+        'idx_photo_uploads_user_date_id',
+    ),
+    (
+        '/api/user-photos / следующая страница',
+        '''SELECT id, upload_date FROM photo_uploads
+           WHERE user_id = ? AND (upload_date, id) < (?, ?)
+           ORDER BY upload_date DESC, id DESC LIMIT ?''',
+        ('1', '2026-10-17', 'x', 51),
+        'idx_photo_uploads_user_date_id',
+    ),
+    (
+        '/api/user-photos / категория',
+        '''SELECT id, upload_date FROM photo_uploads
+           WHERE user_id = ? AND category = ? AND (upload_date, id) < (?, ?)
+           ORDER BY upload_date DESC, id DESC LIMIT ?''',
+        ('1', 'c', '2026-10-17', 'x', 51),
+        'idx_photo_uploads_user_category_date_id',
+    ),
+    (
+        'user_summary.rebuild / photos_uploaded',
+        '''SELECT u.user_id,
+                  (SELECT COUNT(*) FROM photo_uploads WHERE user_id = CAST(u.user_id AS TEXT)) as photos_uploaded
+           FROM users u WHERE u.user_id = ?''',
+        (1,),
+        ('idx_photo_uploads_user_date_id', 'idx_photo_uploads_user_category_date_id'),
+    ),
+    (
+        'get_global_stats / active_users_7d',
+        "SELECT COUNT(*) FROM users WHERE last_activity > datetime('now', '-7 days')",
+        (),
+        'idx_users_last_activity',
+    ),
+    (
+        'user_activity by user',
+        'SELECT action, timestamp FROM user_activity WHERE user_id = ? ORDER BY timestamp DESC',
+        (1,),
+        'idx_user_activity_user_time',
+    ),
+    (
+        'user_summary.rebuild / folder_entries (task1_done)',
+        'SELECT COUNT(*) FROM giveaway_participants WHERE user_id = ?',
+        (1,),
+        'idx_giveaway_participants_user_id',
+    ),
+    (
+        'leaderboard / изменения после seq',
+        'SELECT user_id, referral_count, total_referral_xp FROM leaderboard WHERE seq > ? ORDER BY seq',
+        (1,),
+        'idx_leaderboard_seq',
+    ),
+]
+
+
+def explain(conn, sql, params):
+    """Строки плана выполнения запроса"""
+    cursor = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+def check_query_plans(db_path):
+    """Возвращает список (название, индекс, план) для запросов, не использующих свой индекс"""
+    from database import Database
+    db = Database(db_path)
+
+    failures = []
+    with db.pool.connection() as conn:
+        for name, sql, params, index in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            indexes = index if isinstance(index, tuple) else (index,)
+            uses_index = any(candidate in line for candidate in indexes for line in plan)
+            status = '✅' if uses_index else '❌'
+            print(f"{status} {name}")
+            for line in plan:
+                print(f"     {line}")
+            if not uses_index:
+                failures.append((name, index, plan))
+    return failures
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DATABASE_PATH
+    print(f"🔍 Проверка планов запросов для {db_path}\n")
+
+    failures = check_query_plans(db_path)
+
+    print(f"\n📊 Результат: {len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} запросов используют индексы")
+    if failures:
+        for name, index, _ in failures:
+            print(f"⚠️ {name}: не используется {' / '.join(index) if isinstance(index, tuple) else index}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
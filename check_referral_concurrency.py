@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка начисления за рефералов при параллельных запросах
+Во временной БД много потоков одновременно и повторно регистрируют приглашенных
+по реферальному коду (add_user), начисляют билеты (add_ticket_for_referral_start,
+add_referral_ticket) и обновляют статус подписки. Затем проверяется, что каждая
+пара (inviter_id, invitee_id) засчитана ровно один раз.
+
+Использование: python3 check_referral_concurrency.py [--threads=16] [--inviters=10]
+               [--invitees=200] [--repeat=4]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+
+
+def get_option(name, default, cast):
+    prefix = f'--{name}='
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return cast(arg[len(prefix):])
+    return default
+
+
+def build_operations(inviter_ids, invitee_ids, referral_codes, repeat):
+    """Все операции с повторами, перемешанные (приглашенный i закреплен за одним пригласившим)"""
+    operations = []
+    for index, invitee_id in enumerate(invitee_ids):
+        inviter_id = inviter_ids[index % len(inviter_ids)]
+        for _ in range(repeat):
+            operations.append(('add_user', invitee_id, inviter_id, referral_codes[inviter_id]))
+            operations.append(('ticket_start', invitee_id, inviter_id, None))
+            operations.append(('referral_ticket', invitee_id, inviter_id, None))
+            operations.append(('subscription', invitee_id, inviter_id, None))
+    random.shuffle(operations)
+    return operations
+
+
+def run_operation(db, operation):
+    kind, invitee_id, inviter_id, referral_code = operation
+    if kind == 'add_user':
+        return db.add_user(invitee_id, f'user{invitee_id}', f'User {invitee_id}', referred_by=referral_code)
+    if kind == 'ticket_start':
+        db.add_ticket_for_referral_start(inviter_id, invitee_id)
+    elif kind == 'referral_ticket':
+        db.add_referral_ticket(inviter_id, invitee_id)
+    else:
+        db.set_subscription_status(invitee_id, invitee_id % 2 == 0)
+    return True
+
+
+def check_counts(db, inviter_ids, invitee_ids):
+    """Список расхождений с ожидаемыми значениями (пустой — все верно)"""
+    problems = []
+    expected_per_inviter = {inviter_id: 0 for inviter_id in inviter_ids}
+    for index in range(len(invitee_ids)):
+        expected_per_inviter[inviter_ids[index % len(inviter_ids)]] += 1
+
+    with db.pool.connection() as conn:
+        duplicates = conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM referral_invites GROUP BY inviter_id, invitee_id HAVING COUNT(*) > 1
+            )
+        ''').fetchone()[0]
+        if duplicates:
+            problems.append(f"дублей в referral_invites: {duplicates}")
+
+        for inviter_id, expected in expected_per_inviter.items():
+            referral_count, total_xp = conn.execute(
+                'SELECT referral_count, total_referral_xp FROM users WHERE user_id = ?', (inviter_id,)
+            ).fetchone()
+            invites, coded_invites = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(invite_code != ''), 0) FROM referral_invites WHERE inviter_id = ?
+            ''', (inviter_id,)).fetchone()
+            tickets = conn.execute('SELECT COUNT(*) FROM tickets_referral WHERE user_id = ?', (inviter_id,)).fetchone()[0]
+            if invites != expected:
+                problems.append(f"inviter {inviter_id}: приглашений {invites}, ожидалось {expected}")
+            if referral_count != expected:
+                problems.append(f"inviter {inviter_id}: referral_count {referral_count}, ожидалось {expected}")
+            # XP начисляется только при регистрации по коду (_process_referral)
+            if total_xp != 100 * coded_invites:
+                problems.append(f"inviter {inviter_id}: XP {total_xp}, ожидалось {100 * coded_invites}")
+            if tickets != expected:
+                problems.append(f"inviter {inviter_id}: билетов за рефералов {tickets}, ожидалось {expected}")
+
+        users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        if users != len(inviter_ids) + len(invitee_ids):
+            problems.append(f"пользователей {users}, ожидалось {len(inviter_ids) + len(invitee_ids)}")
+        subscriptions = conn.execute('SELECT COUNT(*) FROM tickets_subscription').fetchone()[0]
+        if subscriptions != len(invitee_ids):
+            problems.append(f"строк tickets_subscription {subscriptions}, ожидалось {len(invitee_ids)}")
+    return problems
+
+
+def main():
+    threads = get_option('threads', 16, int)
+    inviter_count = get_option('inviters', 10, int)
+    invitee_count = get_option('invitees', 200, int)
+    repeat = get_option('repeat', 4, int)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'stress.db'))
+        inviter_ids = list(range(1, inviter_count + 1))
+        invitee_ids = list(range(1000, 1000 + invitee_count))
+        for inviter_id in inviter_ids:
+            db.add_user(inviter_id, f'inviter{inviter_id}', f'Inviter {inviter_id}')
+        referral_codes = {inviter_id: db.get_user_referral_info(inviter_id)['referral_code'] for inviter_id in inviter_ids}
+
+        operations = build_operations(inviter_ids, invitee_ids, referral_codes, repeat)
+        print(f"🔄 {len(operations)} операций в {threads} потоках "
+              f"({inviter_count} пригласивших, {invitee_count} приглашенных, повторов {repeat})")
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            failed = sum(1 for ok in executor.map(lambda op: run_operation(db, op), operations) if not ok)
+        elapsed = time.monotonic() - started
+        print(f"⏱️ {elapsed:.2f} с, {len(operations) / elapsed:.0f} операций/с")
+        if failed:
+            print(f"⚠️ Неудачных регистраций: {failed}")
+
+        problems = check_counts(db, inviter_ids, invitee_ids)
+        db.pool.close()
+
+    if problems or failed:
+        print(f"❌ Найдено расхождений: {len(problems)}")
+        for problem in problems[:20]:
+            print(f"   • {problem}")
+        sys.exit(1)
+    print("✅ Каждое приглашение засчитано ровно один раз")
+
+
+if __name__ == "__main__":
+    main()
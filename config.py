@@ -7,11 +7,122 @@ load_dotenv()
 # Telegram Bot Token (получите у @BotFather)
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'your_bot_token_here')
 
+# Режим получения обновлений ботом: polling или webhook (можно переопределить в run.py)
+BOT_RUN_MODE = os.getenv('BOT_RUN_MODE', 'polling')
+# Webhook: публичный адрес за nginx и локальный aiohttp-сервер, куда nginx проксирует WEBHOOK_PATH
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', 'https://fsr.agency')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/tg/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8081'))
+# Сколько обновлений обрабатывается одновременно
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.getenv('WEBHOOK_MAX_CONCURRENT_UPDATES', '32'))
+
 # Web App URL (ваш Flutter web app)
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'https://FSR.agensy/')
 
 # Database path
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'users.db')
 
+# Проверка подписки на каналы через Bot API
+SUBSCRIPTION_CHECK_TIMEOUT = float(os.getenv('SUBSCRIPTION_CHECK_TIMEOUT', '10'))
+# Сколько запросов get_chat_member выполняется одновременно
+SUBSCRIPTION_CHECK_CONCURRENCY = int(os.getenv('SUBSCRIPTION_CHECK_CONCURRENCY', '10'))
+# Кэш результатов get_chat_member (секунды; 0 — не кэшировать)
+MEMBERSHIP_CACHE_POSITIVE_TTL = float(os.getenv('MEMBERSHIP_CACHE_POSITIVE_TTL', '300'))
+MEMBERSHIP_CACHE_NEGATIVE_TTL = float(os.getenv('MEMBERSHIP_CACHE_NEGATIVE_TTL', '30'))
+MEMBERSHIP_CACHE_MAX_ENTRIES = int(os.getenv('MEMBERSHIP_CACHE_MAX_ENTRIES', '50000'))
+
+# Массовая перепроверка подписок (reverify_subscriptions.py)
+SWEEP_CHUNK_SIZE = int(os.getenv('SWEEP_CHUNK_SIZE', '200'))
+SWEEP_RATE_LIMIT = float(os.getenv('SWEEP_RATE_LIMIT', '20'))  # запросов get_chat_member в секунду
+SWEEP_CONCURRENCY = int(os.getenv('SWEEP_CONCURRENCY', '8'))
+
+# Очередь фоновых задач (таблица jobs)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', '5'))
+JOB_RETRY_MAX_DELAY = float(os.getenv('JOB_RETRY_MAX_DELAY', '600'))
+# Сколько секунд задача считается занятой воркером (после падения процесса ее подхватит другой)
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_RETENTION_HOURS = float(os.getenv('JOB_RETENTION_HOURS', '72'))
+# Задержка проверки подписки после /api/log-folder-subscription (время на подписку)
+SUBSCRIPTION_CHECK_DELAY = float(os.getenv('SUBSCRIPTION_CHECK_DELAY', '3'))
+
 # Giveaway folder link
-GIVEAWAY_FOLDER_LINK = 'https://t.me/addlist/f3YaeLmoNsdkYjVl' 
\ No newline at end of file
+GIVEAWAY_FOLDER_LINK = 'https://t.me/addlist/f3YaeLmoNsdkYjVl' 
+
+# Пул соединений SQLite
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_MAX_AGE = float(os.getenv('DB_POOL_MAX_AGE', '600'))
+DB_POOL_MAX_USES = int(os.getenv('DB_POOL_MAX_USES', '5000'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+
+# Активность пользователей из бота пишется пачками (async_database.py)
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '2'))
+ACTIVITY_BATCH_SIZE = int(os.getenv('ACTIVITY_BATCH_SIZE', '200'))
+ACTIVITY_MAX_PENDING = int(os.getenv('ACTIVITY_MAX_PENDING', '5000'))
+
+# Профиль хранения SQLite (применяется к каждому новому соединению)
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))  # отрицательное значение — в KiB
+SQLITE_TEMP_STORE = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Периодический checkpoint WAL-журнала (секунды, 0 — отключить)
+SQLITE_CHECKPOINT_INTERVAL = float(os.getenv('SQLITE_CHECKPOINT_INTERVAL', '60'))
+SQLITE_CHECKPOINT_MODE = os.getenv('SQLITE_CHECKPOINT_MODE', 'PASSIVE')
+
+# Хранилище файлов (фото/видео) на диске, адресация по SHA-256
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', 'blobs')
+
+# Отдача файлов через nginx (X-Accel-Redirect): префикс internal-локации, пусто — отдаёт Flask
+BLOB_ACCEL_REDIRECT_PREFIX = os.getenv('BLOB_ACCEL_REDIRECT_PREFIX', '')
+# Время кэширования файлов фото в браузере (секунды)
+PHOTO_CACHE_MAX_AGE = int(os.getenv('PHOTO_CACHE_MAX_AGE', '86400'))
+
+# Миниатюры фото: имя размера -> длина большей стороны в пикселях (формат "small:160,medium:480")
+THUMBNAIL_SIZES = {
+    name.strip(): int(edge)
+    for name, edge in (
+        item.split(':') for item in os.getenv('THUMBNAIL_SIZES', 'small:160,medium:480,large:1080').split(',') if item
+    )
+}
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '82'))
+# Число фоновых потоков, создающих миниатюры
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+
+# Доставка логов в служебный чат (logger.py): события собираются в сводки
+LOG_DIGEST_WINDOW = float(os.getenv('LOG_DIGEST_WINDOW', '3'))  # секунд ожидания перед отправкой сводки
+LOG_DIGEST_MAX_EVENTS = int(os.getenv('LOG_DIGEST_MAX_EVENTS', '10'))
+LOG_QUEUE_MAX = int(os.getenv('LOG_QUEUE_MAX', '1000'))  # при переполнении старые события отбрасываются
+LOG_RATE_PER_MINUTE = float(os.getenv('LOG_RATE_PER_MINUTE', '18'))  # сообщений в чат в минуту
+LOG_SEND_ATTEMPTS = int(os.getenv('LOG_SEND_ATTEMPTS', '5'))
+LOG_CLOSE_TIMEOUT = float(os.getenv('LOG_CLOSE_TIMEOUT', '15'))  # секунд на доставку остатка при остановке
+# Журнал событий логгера на диске (пусто — только очередь в памяти)
+LOG_JOURNAL_DIR = os.getenv('LOG_JOURNAL_DIR', 'log_journal')
+LOG_JOURNAL_SEGMENT_BYTES = int(os.getenv('LOG_JOURNAL_SEGMENT_BYTES', str(1024 * 1024)))
+# fsync после каждой записи: события переживают и отключение питания, но запись медленнее
+LOG_JOURNAL_FSYNC = os.getenv('LOG_JOURNAL_FSYNC', '0') == '1'
+# Пауза перед повторной доставкой из журнала, если Telegram недоступен (секунды)
+LOG_RETRY_INTERVAL = float(os.getenv('LOG_RETRY_INTERVAL', '30'))
+
+# Outbox уведомлений в служебный чат (outbox_dispatcher.py, работает в процессе бота)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))  # секунд между проверками таблицы
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETENTION_HOURS = float(os.getenv('OUTBOX_RETENTION_HOURS', '72'))
+
+# Сверка таблицы counters с данными (секунды между запусками задачи reconcile_counters)
+COUNTERS_RECONCILE_INTERVAL = float(os.getenv('COUNTERS_RECONCILE_INTERVAL', '3600'))
+
+# Кэш ответов API (response_cache.py): время жизни по маршрутам (секунды, 0 — не кэшировать).
+# Записи API сбрасывают кэш сразу; изменения из бота видны не позже чем через TTL
+RESPONSE_CACHE_TTL_PRIZES = float(os.getenv('RESPONSE_CACHE_TTL_PRIZES', '300'))
+RESPONSE_CACHE_TTL_STATS = float(os.getenv('RESPONSE_CACHE_TTL_STATS', '10'))
+RESPONSE_CACHE_TTL_TICKETS = float(os.getenv('RESPONSE_CACHE_TTL_TICKETS', '10'))
+RESPONSE_CACHE_TTL_REFERRAL = float(os.getenv('RESPONSE_CACHE_TTL_REFERRAL', '10'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
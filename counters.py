@@ -0,0 +1,90 @@
+"""
+Счетчики в таблице counters (миграция 2026_10_17_counters.sql).
+
+Триггеры обновляют счетчики в той же транзакции, что и запись в users,
+photo_uploads и таблицы билетов, поэтому /api/stats, /api/tickets/total и
+get_global_stats читают готовые значения, а не сканируют таблицы.
+reconcile() пересчитывает все счетчики с нуля и возвращает расхождения.
+В базе фото (fsr.db) ведутся только счетчики фото (migrations/photos/2026_10_17_photo_counters.sql).
+"""
+
+from typing import Dict, Iterable, Tuple
+
+CATEGORY_PREFIX = 'photos_category:'
+
+# Счетчик -> запрос, считающий его с нуля
+COUNTER_QUERIES = {
+    'users_total': 'SELECT COUNT(*) FROM users',
+    'users_giveaway_completed': 'SELECT COUNT(*) FROM users WHERE giveaway_completed = 1',
+    'referrals_total': 'SELECT COALESCE(SUM(referral_count), 0) FROM users',
+    'photos_total': 'SELECT COUNT(*) FROM photo_uploads',
+    'photo_users': 'SELECT COUNT(DISTINCT user_id) FROM photo_uploads',
+    'tickets_subscription': 'SELECT COUNT(*) FROM tickets_subscription WHERE is_subscribed_all = 1',
+    'tickets_referral': 'SELECT COUNT(*) FROM tickets_referral',
+}
+
+# Счетчики базы фото (fsr.db): в ней есть только photo_uploads
+PHOTO_COUNTER_QUERIES = {name: COUNTER_QUERIES[name] for name in ('photos_total', 'photo_users')}
+
+
+def read(conn, names: Iterable[str]) -> Dict[str, int]:
+    """Значения счетчиков (отсутствующие — 0)"""
+    names = list(names)
+    placeholders = ','.join('?' * len(names))
+    rows = conn.execute(f'SELECT name, value FROM counters WHERE name IN ({placeholders})', names).fetchall()
+    values = dict.fromkeys(names, 0)
+    values.update(rows)
+    return values
+
+
+def read_prefix(conn, prefix: str) -> Dict[str, int]:
+    """Счетчики с общим префиксом (без префикса в ключе), например фото по категориям"""
+    # Диапазон по первичному ключу вместо LIKE: поиск по индексу
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    rows = conn.execute('''
+        SELECT name, value FROM counters WHERE name >= ? AND name < ? AND value != 0
+    ''', (prefix, upper)).fetchall()
+    return {name[len(prefix):]: value for name, value in rows}
+
+
+def compute(conn, queries: Dict[str, str] = COUNTER_QUERIES) -> Dict[str, int]:
+    """Счетчики queries и фото по категориям, посчитанные с нуля по таблицам"""
+    values = {name: conn.execute(query).fetchone()[0] for name, query in queries.items()}
+    for category, count in conn.execute('SELECT category, COUNT(*) FROM photo_uploads GROUP BY category'):
+        values[CATEGORY_PREFIX + category] = count
+    return values
+
+
+def reconcile(pool, fix: bool = True, queries: Dict[str, str] = COUNTER_QUERIES) -> Dict[str, Tuple[int, int]]:
+    """
+    Сверка счетчиков с таблицами: {счетчик: (сохранено, на самом деле)} для расходящихся.
+    queries — какие счетчики сверять (для базы фото — PHOTO_COUNTER_QUERIES).
+    С fix=True расхождения исправляются; пересчет и запись идут под BEGIN IMMEDIATE,
+    чтобы параллельные записи не попали между ними.
+    """
+    with pool.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            actual = compute(conn, queries)
+            # Служебные значения (например, leaderboard_seq) не пересчитываются
+            stored = {
+                name: value for name, value in conn.execute('SELECT name, value FROM counters')
+                if name in queries or name.startswith(CATEGORY_PREFIX)
+            }
+            drift = {
+                name: (stored.get(name, 0), actual.get(name, 0))
+                for name in set(actual) | set(stored)
+                if stored.get(name, 0) != actual.get(name, 0)
+            }
+            if fix and drift:
+                conn.executemany('''
+                    INSERT INTO counters (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                ''', [(name, values[1]) for name, values in drift.items()])
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception:
+            conn.rollback()
+            raise
+    return drift
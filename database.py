@@ -1,297 +1,476 @@
+import json
+import random
 import sqlite3
 import os
+import string
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from glob import glob
+from typing import Optional, List, Dict, Any, Tuple
+import counters
+from db_pool import get_pool
+from leaderboard import get_leaderboard
+import response_cache
+from response_cache import referral_tag
+
+# Версия схемы, записывается в PRAGMA user_version после инициализации.
+# Увеличивайте при любом изменении DDL в init_database и при добавлении
+# файла в migrations/, чтобы запущенные процессы применили его при старте.
+SCHEMA_VERSION = 14
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Реферальный код: FSR + user_id, переставленный в пространстве 36^8 и записанный
+# в base36. Множитель взаимно прост с 36^8 (не делится на 2 и 3), поэтому разные
+# user_id (меньше 36^8 ≈ 2.8e12) всегда дают разные коды — проверка в БД не нужна.
+# Старые случайные коды короче (FSR + 6 символов) и с новыми не пересекаются.
+REFERRAL_CODE_ALPHABET = string.digits + string.ascii_uppercase
+REFERRAL_CODE_LENGTH = 8
+REFERRAL_CODE_ATTEMPTS = 5
+_REFERRAL_CODE_SPACE = len(REFERRAL_CODE_ALPHABET) ** REFERRAL_CODE_LENGTH
+_REFERRAL_CODE_MULTIPLIER = 1580030173
+_REFERRAL_CODE_OFFSET = 918273645
+
+
+def referral_code_for(user_id: int) -> str:
+    """Детерминированный реферальный код пользователя"""
+    value = (user_id * _REFERRAL_CODE_MULTIPLIER + _REFERRAL_CODE_OFFSET) % _REFERRAL_CODE_SPACE
+    chars = []
+    for _ in range(REFERRAL_CODE_LENGTH):
+        value, index = divmod(value, len(REFERRAL_CODE_ALPHABET))
+        chars.append(REFERRAL_CODE_ALPHABET[index])
+    return "FSR" + ''.join(reversed(chars))
+
+
+def _split_sql(script: str) -> List[str]:
+    """Разбивает SQL-скрипт на отдельные выражения"""
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    return statements
+
+# Миграции базы фото (fsr.db): только photo_uploads, upload_sessions и их счетчики.
+# Файлы из migrations/photos/ не попадают в apply_migrations() базы бота
+PHOTO_MIGRATIONS = [
+    '2026_10_17_photo_blob_store.sql',
+    '2026_10_17_photo_keyset_pagination.sql',
+    '2026_10_17_photo_thumbnails.sql',
+    '2026_10_17_upload_sessions.sql',
+    'photos/2026_10_17_photo_counters.sql',
+]
+
+
+def apply_migration(pool, path: str) -> bool:
+    """Применяет миграцию в одной транзакции; False, если она уже была применена"""
+    name = os.path.basename(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        statements = _split_sql(f.read())
+
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute('SELECT 1 FROM schema_migrations WHERE name = ?', (name,))
+            if cursor.fetchone():
+                conn.rollback()
+                return False
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('INSERT INTO schema_migrations (name) VALUES (?)', (name,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return True
+
+
+def apply_photo_migrations(pool) -> List[str]:
+    """Применение ещё не применённых PHOTO_MIGRATIONS к базе фото (таблица photo_uploads уже должна быть)"""
+    return [
+        name for name in PHOTO_MIGRATIONS
+        if apply_migration(pool, os.path.join(MIGRATIONS_DIR, name))
+    ]
+
+# Файлы БД, схема которых уже проверена в этом процессе
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+_instances: Dict[str, 'Database'] = {}
+_instances_lock = threading.Lock()
+
+
+def get_database(db_path: str = "users.db") -> 'Database':
+    """Общий экземпляр Database для файла БД (один на процесс)"""
+    db = _instances.get(db_path)
+    if db is None:
+        with _instances_lock:
+            db = _instances.get(db_path)
+            if db is None:
+                db = Database(db_path)
+                _instances[db_path] = db
+    return db
+
 
 class Database:
     def __init__(self, db_path: str = "users.db"):
         self.db_path = db_path
-        self.init_database()
+        self.pool = get_pool(db_path)
+        self._ensure_schema()
+
+    def _connection(self):
+        """Соединение из общего пула (одно на поток, вложенные вызовы его переиспользуют)"""
+        return self.pool.connection()
+
+    def _ensure_schema(self):
+        """Однократная (на процесс) проверка версии схемы и инициализация при необходимости"""
+        if self.db_path in _bootstrapped:
+            return
+        with _bootstrap_lock:
+            if self.db_path in _bootstrapped:
+                return
+            with self._connection() as conn:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self.init_database()
+                self.apply_migrations()
+                with self._connection() as conn:
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            _bootstrapped.add(self.db_path)
+
+    def apply_migrations(self) -> List[str]:
+        """Применение ещё не применённых миграций из migrations/ (по порядку имён)"""
+        applied = []
+        for path in sorted(glob(os.path.join(MIGRATIONS_DIR, '*.sql'))):
+            if self.apply_migration(path):
+                applied.append(os.path.basename(path))
+        return applied
+
+    def apply_migration(self, path: str) -> bool:
+        """Применяет миграцию в одной транзакции; False, если она уже была применена"""
+        return apply_migration(self.pool, path)
 
     def init_database(self):
         """Инициализация базы данных с созданием всех таблиц"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                giveaway_completed BOOLEAN DEFAULT FALSE,
-                tasks_completed INTEGER DEFAULT 0,
-                referral_code TEXT UNIQUE,
-                referred_by TEXT,
-                referral_count INTEGER DEFAULT 0,
-                total_referral_xp INTEGER DEFAULT 0,
-                is_premium BOOLEAN DEFAULT FALSE
-            )
-        ''')
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            # Блокируем запись, чтобы бот и API не инициализировали схему одновременно
+            cursor.execute('BEGIN IMMEDIATE')
 
-        # Таблица активности пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                details TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+            # Таблица пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    giveaway_completed BOOLEAN DEFAULT FALSE,
+                    tasks_completed INTEGER DEFAULT 0,
+                    referral_code TEXT UNIQUE,
+                    referred_by TEXT,
+                    referral_count INTEGER DEFAULT 0,
+                    total_referral_xp INTEGER DEFAULT 0,
+                    is_premium BOOLEAN DEFAULT FALSE
+                )
+            ''')
 
-        # Таблица загрузок фото
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS photo_uploads (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                category TEXT NOT NULL,
-                file_id TEXT NOT NULL,
-                file_name TEXT NOT NULL,
-                file_size INTEGER NOT NULL,
-                mime_type TEXT NOT NULL,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                description TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+            # Таблица активности пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_activity (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    action TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    details TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
 
-        # Таблица реферальных приглашений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referral_invites (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                inviter_id INTEGER NOT NULL,
-                invitee_id INTEGER,
-                invitee_username TEXT,
-                invitee_first_name TEXT,
-                invite_code TEXT NOT NULL,
-                invited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                joined_at TIMESTAMP,
-                status TEXT DEFAULT 'pending', -- pending, joined, expired
-                FOREIGN KEY (inviter_id) REFERENCES users (user_id),
-                FOREIGN KEY (invitee_id) REFERENCES users (user_id)
-            )
-        ''')
+            # Таблица загрузок фото
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS photo_uploads (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    mime_type TEXT NOT NULL,
+                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    description TEXT,
+                    file_data TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
 
-        # Таблица подарков гивевея
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS giveaway_prizes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT NOT NULL,
-                value INTEGER NOT NULL, -- в рублях
-                category TEXT NOT NULL, -- certificate, beauty_service, etc.
-                image_url TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            # Таблица реферальных приглашений
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_invites (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    inviter_id INTEGER NOT NULL,
+                    invitee_id INTEGER,
+                    invitee_username TEXT,
+                    invitee_first_name TEXT,
+                    invite_code TEXT NOT NULL,
+                    invited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    joined_at TIMESTAMP,
+                    status TEXT DEFAULT 'pending', -- pending, joined, expired
+                    FOREIGN KEY (inviter_id) REFERENCES users (user_id),
+                    FOREIGN KEY (invitee_id) REFERENCES users (user_id)
+                )
+            ''')
 
-        # Таблица участников гивевея
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS giveaway_participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                referral_code TEXT,
-                tasks_completed INTEGER DEFAULT 0,
-                total_xp INTEGER DEFAULT 0,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+            # Таблица подарков гивевея
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS giveaway_prizes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    value INTEGER NOT NULL, -- в рублях
+                    category TEXT NOT NULL, -- certificate, beauty_service, etc.
+                    image_url TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-        # --- Новая таблица для каналов ---
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS giveaway_channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER NOT NULL,
-                username TEXT
-            )
-        ''')
-        # Добавляем тестовый канал, если его нет
-        cursor.execute('SELECT COUNT(*) FROM giveaway_channels WHERE channel_id = ?', (-1001973736826,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('INSERT INTO giveaway_channels (channel_id, username) VALUES (?, ?)', (-1001973736826, 'F_S_R_US'))
-
-        # Таблица подписки на все каналы
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tickets_subscription (
-                user_id INTEGER PRIMARY KEY,
-                is_subscribed_all BOOLEAN DEFAULT FALSE
-            )
-        ''')
+            # Таблица участников гивевея
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS giveaway_participants (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    referral_code TEXT,
+                    tasks_completed INTEGER DEFAULT 0,
+                    total_xp INTEGER DEFAULT 0,
+                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
 
-        # Таблица билетов за рефералов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tickets_referral (
-                user_id INTEGER NOT NULL,
-                referral_id INTEGER NOT NULL,
-                PRIMARY KEY (user_id, referral_id)
-            )
-        ''')
+            # --- Новая таблица для каналов ---
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS giveaway_channels (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id INTEGER NOT NULL,
+                    username TEXT
+                )
+            ''')
+            # Добавляем тестовый канал, если его нет
+            cursor.execute('SELECT COUNT(*) FROM giveaway_channels WHERE channel_id = ?', (-1001973736826,))
+            if cursor.fetchone()[0] == 0:
+                cursor.execute('INSERT INTO giveaway_channels (channel_id, username) VALUES (?, ?)', (-1001973736826, 'F_S_R_US'))
 
-        conn.commit()
-        conn.close()
+            # Таблица подписки на все каналы
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tickets_subscription (
+                    user_id INTEGER PRIMARY KEY,
+                    is_subscribed_all BOOLEAN DEFAULT FALSE
+                )
+            ''')
 
-        # Добавляем начальные подарки в гивевей
-        self._init_giveaway_prizes()
+            # Таблица билетов за рефералов
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tickets_referral (
+                    user_id INTEGER NOT NULL,
+                    referral_id INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, referral_id)
+                )
+            ''')
 
-    def _init_giveaway_prizes(self):
-        """Инициализация подарков гивевея"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Проверяем, есть ли уже подарки
-        cursor.execute("SELECT COUNT(*) FROM giveaway_prizes")
-        if cursor.fetchone()[0] == 0:
-            prizes = [
-                {
-                    'name': 'Сертификат Золотое Яблоко',
-                    'description': 'Сертификат на покупки в Золотом Яблоке на сумму 20,000 рублей',
-                    'value': 20000,
-                    'category': 'certificate',
-                    'image_url': 'assets/golden_apple_certificate.png'
-                },
-                {
-                    'name': 'Бьюти-услуги',
-                    'description': 'Комплекс бьюти-услуг на сумму 100,000 рублей (маникюр, педикюр, окрашивание, стрижка, макияж)',
-                    'value': 100000,
-                    'category': 'beauty_service',
-                    'image_url': 'assets/beauty_services.png'
-                },
-                {
-                    'name': 'Telegram Premium (3 мес)',
-                    'description': '3 Telegram Premium на 3 месяца',
-                    'value': 50000,
-                    'category': 'telegram_premium',
-                    'image_url': 'assets/telegram_premium.png'
-                }
-            ]
+            # Добавляем начальные подарки в гивевей
+            self._init_giveaway_prizes()
 
-            for prize in prizes:
-                cursor.execute('''
-                    INSERT INTO giveaway_prizes (name, description, value, category, image_url)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (prize['name'], prize['description'], prize['value'], prize['category'], prize['image_url']))
+            conn.commit()
+        response_cache.invalidate('prizes')
 
-        conn.commit()
-        conn.close()
+    def _init_giveaway_prizes(self):
+        """Инициализация подарков гивевея (коммит делает init_database)"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+
+            # Проверяем, есть ли уже подарки
+            cursor.execute("SELECT COUNT(*) FROM giveaway_prizes")
+            if cursor.fetchone()[0] == 0:
+                prizes = [
+                    {
+                        'name': 'Сертификат Золотое Яблоко',
+                        'description': 'Сертификат на покупки в Золотом Яблоке на сумму 20,000 рублей',
+                        'value': 20000,
+                        'category': 'certificate',
+                        'image_url': 'assets/golden_apple_certificate.png'
+                    },
+                    {
+                        'name': 'Бьюти-услуги',
+                        'description': 'Комплекс бьюти-услуг на сумму 100,000 рублей (маникюр, педикюр, окрашивание, стрижка, макияж)',
+                        'value': 100000,
+                        'category': 'beauty_service',
+                        'image_url': 'assets/beauty_services.png'
+                    },
+                    {
+                        'name': 'Telegram Premium (3 мес)',
+                        'description': '3 Telegram Premium на 3 месяца',
+                        'value': 50000,
+                        'category': 'telegram_premium',
+                        'image_url': 'assets/telegram_premium.png'
+                    }
+                ]
+
+                for prize in prizes:
+                    cursor.execute('''
+                        INSERT INTO giveaway_prizes (name, description, value, category, image_url)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (prize['name'], prize['description'], prize['value'], prize['category'], prize['image_url']))
 
     def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None, referred_by: str = None) -> bool:
         """Добавление нового пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            # Генерируем уникальный реферальный код
-            referral_code = self._generate_referral_code()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute('''
-                INSERT OR IGNORE INTO users 
-                (user_id, username, first_name, last_name, referral_code, referred_by)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name, referral_code, referred_by))
-
-            # Если пользователь был приглашен по реферальной ссылке
-            if referred_by:
-                self._process_referral(referred_by, user_id)
+                # Вернувшийся пользователь: ни кода, ни блокировки на запись
+                cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+                if cursor.fetchone():
+                    return True
 
-            conn.commit()
-            conn.close()
+                # Регистрация и начисление за приглашение — одна транзакция
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    referral_code = referral_code_for(user_id)
+                    for attempt in range(REFERRAL_CODE_ATTEMPTS):
+                        try:
+                            cursor.execute('''
+                                INSERT INTO users 
+                                (user_id, username, first_name, last_name, referral_code, referred_by)
+                                VALUES (?, ?, ?, ?, ?, ?)
+                                ON CONFLICT(user_id) DO NOTHING
+                            ''', (user_id, username, first_name, last_name, referral_code, referred_by))
+                            break
+                        except sqlite3.IntegrityError:
+                            # Код занят (UNIQUE referral_code) — берем случайный
+                            if attempt == REFERRAL_CODE_ATTEMPTS - 1:
+                                raise
+                            referral_code = self._generate_referral_code()
+
+                    # Приглашение засчитывается только при первой регистрации
+                    inviter_id = None
+                    if referred_by and cursor.rowcount == 1:
+                        inviter_id = self._process_referral(conn, referred_by, user_id)
+
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            # Закэшированные ответы /api/referral нового пользователя и пригласившего устарели
+            response_cache.invalidate(*(referral_tag(uid) for uid in (user_id, inviter_id) if uid))
             return True
         except Exception as e:
             print(f"Error adding user: {e}")
             return False
 
-    def _generate_referral_code(self) -> str:
-        """Генерация уникального реферального кода"""
-        import random
-        import string
-        
-        while True:
-            # Генерируем код формата FSR + 6 случайных символов
-            code = "FSR" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users WHERE referral_code = ?", (code,))
-            exists = cursor.fetchone()[0] > 0
-            conn.close()
-            
-            if not exists:
-                return code
+    @staticmethod
+    def _generate_referral_code() -> str:
+        """Случайный код — запасной вариант, если код из referral_code_for уже занят"""
+        # Длина отличается от кодов по user_id и старых кодов (FSR + 6 символов)
+        return "FSR" + ''.join(random.choices(REFERRAL_CODE_ALPHABET, k=REFERRAL_CODE_LENGTH + 1))
 
-    def _process_referral(self, referral_code: str, new_user_id: int):
-        """Обработка реферального приглашения"""
+    def _process_referral(self, conn, referral_code: str, new_user_id: int) -> Optional[int]:
+        """
+        Обработка реферального приглашения в транзакции conn (открыта в add_user).
+        Повторное приглашение той же пары ничего не начисляет (уникальный индекс
+        referral_invites(inviter_id, invitee_id)); ошибка откатывает только начисление.
+        Возвращает id пригласившего, если приглашение засчитано, иначе None.
+        """
+        conn.execute('SAVEPOINT process_referral')
         try:
-            conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
 
             # Находим пользователя, который пригласил
             cursor.execute("SELECT user_id, first_name FROM users WHERE referral_code = ?", (referral_code,))
             result = cursor.fetchone()
-            
-            if result:
-                inviter_id = result[0]
-                inviter_name = result[1] or "Неизвестно"
-                
-                # Получаем имя приглашенного пользователя
-                cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (new_user_id,))
-                invitee_result = cursor.fetchone()
-                invitee_name = invitee_result[0] if invitee_result else "Неизвестно"
-                
-                # Обновляем статистику пригласившего
-                cursor.execute('''
-                    UPDATE users 
-                    SET referral_count = referral_count + 1,
-                        total_referral_xp = total_referral_xp + 100
-                    WHERE user_id = ?
-                ''', (inviter_id,))
+            if not result or result[0] == new_user_id:
+                conn.execute('RELEASE process_referral')
+                return None
 
-                # Добавляем запись о приглашении
-                cursor.execute('''
-                    INSERT INTO referral_invites 
-                    (inviter_id, invitee_id, invite_code, status, joined_at)
-                    VALUES (?, ?, ?, 'joined', CURRENT_TIMESTAMP)
-                ''', (inviter_id, new_user_id, referral_code))
+            inviter_id = result[0]
+            inviter_name = result[1] or "Неизвестно"
+
+            # Добавляем запись о приглашении (не больше одной на пару)
+            cursor.execute('''
+                INSERT INTO referral_invites 
+                (inviter_id, invitee_id, invite_code, status, joined_at)
+                VALUES (?, ?, ?, 'joined', CURRENT_TIMESTAMP)
+                ON CONFLICT(inviter_id, invitee_id) DO NOTHING
+            ''', (inviter_id, new_user_id, referral_code))
+            if cursor.rowcount == 0:
+                conn.execute('RELEASE process_referral')
+                return None
+
+            # Получаем имя приглашенного пользователя
+            cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (new_user_id,))
+            invitee_result = cursor.fetchone()
+            invitee_name = invitee_result[0] if invitee_result else "Неизвестно"
+
+            # Обновляем статистику пригласившего
+            cursor.execute('''
+                UPDATE users 
+                SET referral_count = referral_count + 1,
+                    total_referral_xp = total_referral_xp + 100
+                WHERE user_id = ?
+            ''', (inviter_id,))
 
-                # Добавляем активность
-                self.add_activity(inviter_id, "referral_success", f"Пригласил пользователя {new_user_id}")
-                self.add_activity(new_user_id, "referred_by", f"Приглашен пользователем {inviter_id}")
+            # Уведомление в служебный чат — в той же транзакции, что и начисление
+            self._add_notification(conn, 'friend_invitation', {
+                'inviter_id': inviter_id, 'inviter_name': inviter_name,
+                'invitee_id': new_user_id, 'invitee_name': invitee_name,
+                'referral_code': referral_code,
+            })
 
-                # Логируем приглашение в Telegram (асинхронно)
-                try:
-                    import asyncio
-                    from logger import telegram_logger
-                    asyncio.create_task(telegram_logger.log_friend_invitation(
-                        inviter_id, inviter_name, new_user_id, invitee_name, referral_code
-                    ))
-                except Exception as log_error:
-                    print(f"Error logging referral: {log_error}")
+            # Добавляем активность
+            self._insert_activity(conn, inviter_id, "referral_success", f"Пригласил пользователя {new_user_id}")
+            self._insert_activity(conn, new_user_id, "referred_by", f"Приглашен пользователем {inviter_id}")
 
-            conn.commit()
-            conn.close()
+            conn.execute('RELEASE process_referral')
+            return inviter_id
         except Exception as e:
+            conn.execute('ROLLBACK TO process_referral')
+            conn.execute('RELEASE process_referral')
             print(f"Error processing referral: {e}")
+            return None
+
+    def get_top_referrers(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """Пользователи с наибольшим числом приглашенных друзей (из рейтинга в памяти)"""
+        try:
+            return get_leaderboard(self.pool).top(limit)
+        except Exception as e:
+            print(f"Error getting top referrers: {e}")
+            return []
 
     def get_user_referral_info(self, user_id: int) -> Dict[str, Any]:
         """Получение информации о рефералах пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute('''
-                SELECT referral_code, referral_count, total_referral_xp,
-                       (SELECT COUNT(*) FROM referral_invites WHERE inviter_id = users.user_id AND status = 'joined') as successful_invites
-                FROM users WHERE user_id = ?
-            ''', (user_id,))
+                cursor.execute('''
+                    SELECT u.referral_code, u.referral_count, u.total_referral_xp,
+                           COALESCE(s.successful_invites, 0) as successful_invites
+                    FROM users u
+                    LEFT JOIN user_summary s ON s.user_id = u.user_id
+                    WHERE u.user_id = ?
+                ''', (user_id,))
             
-            result = cursor.fetchone()
-            conn.close()
+                result = cursor.fetchone()
 
             if result:
                 return {
@@ -308,12 +487,11 @@ class Database:
     def get_referral_link(self, user_id: int) -> str:
         """Получение реферальной ссылки пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("SELECT referral_code FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
+                cursor.execute("SELECT referral_code FROM users WHERE user_id = ?", (user_id,))
+                result = cursor.fetchone()
 
             if result:
                 return f"https://t.me/FSRUBOT?start=ref{result[0]}"
@@ -325,16 +503,15 @@ class Database:
     def get_user_by_referral_code(self, referral_code: str) -> Optional[Dict[str, Any]]:
         """Получение пользователя по реферальному коду"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT user_id, username, first_name, last_name, referral_code
-                FROM users WHERE referral_code = ?
-            """, (referral_code,))
+                cursor.execute("""
+                    SELECT user_id, username, first_name, last_name, referral_code
+                    FROM users WHERE referral_code = ?
+                """, (referral_code,))
             
-            result = cursor.fetchone()
-            conn.close()
+                result = cursor.fetchone()
 
             if result:
                 return {
@@ -352,188 +529,207 @@ class Database:
     def get_giveaway_prizes(self) -> List[Dict[str, Any]]:
         """Получение списка подарков гивевея"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute('''
-                SELECT name, description, value, category, image_url
-                FROM giveaway_prizes
-                ORDER BY value DESC
-            ''')
+                cursor.execute('''
+                    SELECT name, description, value, category, image_url
+                    FROM giveaway_prizes
+                    ORDER BY value DESC
+                ''')
             
-            prizes = []
-            for row in cursor.fetchall():
-                prizes.append({
-                    'name': row[0],
-                    'description': row[1],
-                    'value': row[2],
-                    'category': row[3],
-                    'image_url': row[4]
-                })
-
-            conn.close()
+                prizes = []
+                for row in cursor.fetchall():
+                    prizes.append({
+                        'name': row[0],
+                        'description': row[1],
+                        'value': row[2],
+                        'category': row[3],
+                        'image_url': row[4]
+                    })
+
             return prizes
         except Exception as e:
             print(f"Error getting giveaway prizes: {e}")
             return []
 
+    @staticmethod
+    def _add_notification(conn, kind: str, payload: Dict[str, Any]):
+        """
+        Уведомление в служебный чат через outbox: строка фиксируется вместе с
+        транзакцией conn, доставляет ее OutboxDispatcher в процессе бота
+        """
+        conn.execute('''
+            INSERT INTO notification_outbox (kind, payload) VALUES (?, ?)
+        ''', (kind, json.dumps(payload, ensure_ascii=False)))
+
+    @staticmethod
+    def _insert_activity(conn, user_id: int, action: str, details: str = None):
+        """Запись активности в текущей транзакции conn (без commit)"""
+        conn.execute('''
+            INSERT INTO user_activity (user_id, action, details)
+            VALUES (?, ?, ?)
+        ''', (user_id, action, details))
+
+        # Обновляем время последней активности
+        conn.execute('''
+            UPDATE users SET last_activity = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', (user_id,))
+
     def add_activity(self, user_id: int, action: str, details: str = None):
         """Добавление записи активности пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                INSERT INTO user_activity (user_id, action, details)
-                VALUES (?, ?, ?)
-            ''', (user_id, action, details))
-
-            # Обновляем время последней активности
-            cursor.execute('''
-                UPDATE users SET last_activity = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (user_id,))
-
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                self._insert_activity(conn, user_id, action, details)
+                conn.commit()
         except Exception as e:
             print(f"Error adding activity: {e}")
     
+    def add_activities(self, entries: List[Tuple[int, str, Optional[str], str]]):
+        """
+        Пакетная запись активности: (user_id, action, details, timestamp) в одной транзакции.
+        Ошибки не перехватываются — вызывающий (AsyncDatabase.flush) повторит запись.
+        """
+        last_activity: Dict[int, str] = {}
+        for user_id, _, _, timestamp in entries:
+            if timestamp > last_activity.get(user_id, ''):
+                last_activity[user_id] = timestamp
+
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('''
+                    INSERT INTO user_activity (user_id, action, details, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', entries)
+                conn.executemany('''
+                    UPDATE users SET last_activity = ?
+                    WHERE user_id = ? AND (last_activity IS NULL OR last_activity < ?)
+                ''', [(timestamp, user_id, timestamp) for user_id, timestamp in last_activity.items()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
     def complete_task(self, user_id: int, task_name: str, task_number: int):
         """Отметить выполнение задания пользователем"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            # Получаем информацию о пользователе
-            cursor.execute("SELECT username, first_name FROM users WHERE user_id = ?", (user_id,))
-            user_result = cursor.fetchone()
+                # Получаем информацию о пользователе
+                cursor.execute("SELECT username, first_name FROM users WHERE user_id = ?", (user_id,))
+                user_result = cursor.fetchone()
             
-            if user_result:
-                username = user_result[0] or "Не указан"
-                first_name = user_result[1] or "Неизвестно"
+                if user_result:
+                    username = user_result[0] or "Не указан"
+                    first_name = user_result[1] or "Неизвестно"
                 
-                # Обновляем количество выполненных заданий
-                cursor.execute('''
-                    UPDATE users 
-                    SET tasks_completed = tasks_completed + 1
-                    WHERE user_id = ?
-                ''', (user_id,))
-                
-                # Проверяем, завершил ли пользователь гивевей
-                cursor.execute("SELECT tasks_completed, total_referral_xp FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                
-                if result and result[0] >= 2:  # Все задания выполнены
+                    # Обновляем количество выполненных заданий
                     cursor.execute('''
                         UPDATE users 
-                        SET giveaway_completed = 1
+                        SET tasks_completed = tasks_completed + 1
                         WHERE user_id = ?
                     ''', (user_id,))
-                    
-                    # Логируем завершение гивевея
-                    try:
-                        import asyncio
-                        from logger import telegram_logger
-                        asyncio.create_task(telegram_logger.log_giveaway_completion(
-                            user_id, username, first_name, result[1] or 0
-                        ))
-                    except Exception as log_error:
-                        print(f"Error logging giveaway completion: {log_error}")
                 
-                # Логируем выполнение задания
-                try:
-                    import asyncio
-                    from logger import telegram_logger
-                    asyncio.create_task(telegram_logger.log_task_completion(
-                        user_id, username, first_name, task_name, task_number
-                    ))
-                except Exception as log_error:
-                    print(f"Error logging task completion: {log_error}")
+                    # Проверяем, завершил ли пользователь гивевей
+                    cursor.execute("SELECT tasks_completed, total_referral_xp FROM users WHERE user_id = ?", (user_id,))
+                    result = cursor.fetchone()
+                
+                    if result and result[0] >= 2:  # Все задания выполнены
+                        cursor.execute('''
+                            UPDATE users 
+                            SET giveaway_completed = 1
+                            WHERE user_id = ?
+                        ''', (user_id,))
+                    
+                        # Уведомляем о завершении гивевея
+                        self._add_notification(conn, 'giveaway_completion', {
+                            'user_id': user_id, 'username': username,
+                            'first_name': first_name, 'total_xp': result[1] or 0,
+                        })
+
+                    # Уведомляем о выполнении задания
+                    self._add_notification(conn, 'task_completion', {
+                        'user_id': user_id, 'username': username, 'first_name': first_name,
+                        'task_name': task_name, 'task_number': task_number,
+                    })
                 
-                # Добавляем активность
-                self.add_activity(user_id, "task_completed", f"Выполнил задание: {task_name}")
+                    # Добавляем активность (в той же транзакции, что и уведомления)
+                    self._insert_activity(conn, user_id, "task_completed", f"Выполнил задание: {task_name}")
             
-            conn.commit()
-            conn.close()
+                conn.commit()
         except Exception as e:
             print(f"Error completing task: {e}")
     
     def log_referral_stats(self, user_id: int):
         """Логировать реферальную статистику пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("SELECT username, first_name, referral_count, total_referral_xp FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+                cursor.execute("SELECT username, first_name, referral_count, total_referral_xp FROM users WHERE user_id = ?", (user_id,))
+                result = cursor.fetchone()
             
-            if result:
-                username = result[0] or "Не указан"
-                first_name = result[1] or "Неизвестно"
-                referral_count = result[2] or 0
-                total_xp = result[3] or 0
+                if result:
+                    username = result[0] or "Не указан"
+                    first_name = result[1] or "Неизвестно"
+                    referral_count = result[2] or 0
+                    total_xp = result[3] or 0
                 
-                # Логируем реферальную статистику
-                try:
-                    import asyncio
-                    from logger import telegram_logger
-                    asyncio.create_task(telegram_logger.log_referral_stats(
-                        user_id, username, first_name, referral_count, total_xp
-                    ))
-                except Exception as log_error:
-                    print(f"Error logging referral stats: {log_error}")
+                    # Уведомляем о реферальной статистике
+                    self._add_notification(conn, 'referral_stats', {
+                        'user_id': user_id, 'username': username, 'first_name': first_name,
+                        'referral_count': referral_count, 'total_xp': total_xp,
+                    })
+                    conn.commit()
             
-            conn.close()
         except Exception as e:
             print(f"Error logging referral stats: {e}")
 
     def log_folder_subscription(self, user_id: int):
         """Логировать подписку на папку с каналами"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("SELECT username, first_name FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+                cursor.execute("SELECT username, first_name FROM users WHERE user_id = ?", (user_id,))
+                result = cursor.fetchone()
             
-            if result:
-                username = result[0] or "Не указан"
-                first_name = result[1] or "Неизвестно"
+                if result:
+                    username = result[0] or "Не указан"
+                    first_name = result[1] or "Неизвестно"
                 
-                # Логируем подписку на папку
-                try:
-                    import asyncio
-                    from logger import telegram_logger
-                    asyncio.create_task(telegram_logger.log_folder_subscription(
-                        user_id, username, first_name
-                    ))
-                except Exception as log_error:
-                    print(f"Error logging folder subscription: {log_error}")
+                    # Уведомляем о подписке на папку
+                    self._add_notification(conn, 'folder_subscription', {
+                        'user_id': user_id, 'username': username, 'first_name': first_name,
+                    })
                 
-                # Добавляем активность
-                self.add_activity(user_id, "folder_subscription", "Подписался на папку с каналами")
+                    # Добавляем активность (в той же транзакции, что и уведомление)
+                    self._insert_activity(conn, user_id, "folder_subscription", "Подписался на папку с каналами")
             
-            conn.close()
+                conn.commit()
         except Exception as e:
             print(f"Error logging folder subscription: {e}")
 
     def get_user_stats(self, user_id: int) -> Dict[str, Any]:
         """Получение статистики пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute('''
-                SELECT u.user_id, u.username, u.first_name, u.last_name,
-                       u.registered_at, u.last_activity, u.giveaway_completed,
-                       u.tasks_completed, u.referral_count, u.total_referral_xp,
-                       (SELECT COUNT(*) FROM photo_uploads WHERE user_id = u.user_id) as photos_uploaded
-                FROM users u WHERE u.user_id = ?
-            ''', (user_id,))
+                cursor.execute('''
+                    SELECT u.user_id, u.username, u.first_name, u.last_name,
+                           u.registered_at, u.last_activity, u.giveaway_completed,
+                           u.tasks_completed, u.referral_count, u.total_referral_xp,
+                           COALESCE(s.photos_uploaded, 0) as photos_uploaded
+                    FROM users u
+                    LEFT JOIN user_summary s ON s.user_id = u.user_id
+                    WHERE u.user_id = ?
+                ''', (user_id,))
             
-            result = cursor.fetchone()
-            conn.close()
+                result = cursor.fetchone()
 
             if result:
                 return {
@@ -557,31 +753,24 @@ class Database:
     def get_global_stats(self) -> Dict[str, Any]:
         """Получение глобальной статистики"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE giveaway_completed = 1")
-            giveaway_completed = cursor.fetchone()[0]
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute("SELECT COUNT(*) FROM photo_uploads")
-            total_photos = cursor.fetchone()[0]
+                # Итоги поддерживаются триггерами (таблица counters)
+                values = counters.read(conn, (
+                    'users_total', 'users_giveaway_completed', 'photos_total', 'referrals_total'
+                ))
 
-            cursor.execute("SELECT SUM(referral_count) FROM users")
-            total_referrals = cursor.fetchone()[0] or 0
+                # Зависит от текущего времени — считается по индексу idx_users_last_activity
+                cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > datetime('now', '-7 days')")
+                active_users_7d = cursor.fetchone()[0]
 
-            cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > datetime('now', '-7 days')")
-            active_users_7d = cursor.fetchone()[0]
-
-            conn.close()
 
             return {
-                'total_users': total_users,
-                'giveaway_completed': giveaway_completed,
-                'total_photos': total_photos,
-                'total_referrals': total_referrals,
+                'total_users': values['users_total'],
+                'giveaway_completed': values['users_giveaway_completed'],
+                'total_photos': values['photos_total'],
+                'total_referrals': values['referrals_total'],
                 'active_users_7d': active_users_7d
             }
         except Exception as e:
@@ -591,26 +780,26 @@ class Database:
     def add_photo_upload(self, photo_data: Dict[str, Any]) -> bool:
         """Добавление загрузки фото"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                INSERT INTO photo_uploads 
-                (id, user_id, category, file_id, file_name, file_size, mime_type, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                photo_data['id'],
-                photo_data['userId'],
-                photo_data['category'],
-                photo_data['fileId'],
-                photo_data['fileName'],
-                photo_data['fileSize'],
-                photo_data['mimeType'],
-                photo_data.get('description')
-            ))
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            conn.commit()
-            conn.close()
+                cursor.execute('''
+                    INSERT INTO photo_uploads 
+                    (id, user_id, category, file_id, file_name, file_size, mime_type, description)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    photo_data['id'],
+                    photo_data['userId'],
+                    photo_data['category'],
+                    photo_data['fileId'],
+                    photo_data['fileName'],
+                    photo_data['fileSize'],
+                    photo_data['mimeType'],
+                    photo_data.get('description')
+                ))
+
+                conn.commit()
+            response_cache.invalidate('stats')
             return True
         except Exception as e:
             print(f"Error adding photo upload: {e}")
@@ -619,40 +808,29 @@ class Database:
     def get_photo_stats(self) -> Dict[str, Any]:
         """Получение статистики загрузок фото"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute("SELECT COUNT(*) FROM photo_uploads")
-            total_uploads = cursor.fetchone()[0]
+                total_uploads = counters.read(conn, ('photos_total',))['photos_total']
+                category_stats = counters.read_prefix(conn, counters.CATEGORY_PREFIX)
 
-            cursor.execute('''
-                SELECT category, COUNT(*) as count
-                FROM photo_uploads
-                GROUP BY category
-            ''')
+                cursor.execute('''
+                    SELECT id, user_id, category, file_name, upload_date
+                    FROM photo_uploads
+                    ORDER BY upload_date DESC
+                    LIMIT 10
+                ''')
             
-            category_stats = {}
-            for row in cursor.fetchall():
-                category_stats[row[0]] = row[1]
+                recent_uploads = []
+                for row in cursor.fetchall():
+                    recent_uploads.append({
+                        'id': row[0],
+                        'user_id': row[1],
+                        'category': row[2],
+                        'file_name': row[3],
+                        'upload_date': row[4]
+                    })
 
-            cursor.execute('''
-                SELECT id, user_id, category, file_name, upload_date
-                FROM photo_uploads
-                ORDER BY upload_date DESC
-                LIMIT 10
-            ''')
-            
-            recent_uploads = []
-            for row in cursor.fetchall():
-                recent_uploads.append({
-                    'id': row[0],
-                    'user_id': row[1],
-                    'category': row[2],
-                    'file_name': row[3],
-                    'upload_date': row[4]
-                })
-
-            conn.close()
 
             return {
                 'totalUploads': total_uploads,
@@ -665,85 +843,77 @@ class Database:
 
     def add_ticket_for_referral_start(self, inviter_id: int, invitee_id: int) -> bool:
         """Начисляет 1 билет пригласившему, если друг стартует по реф-ссылке (только 1 раз за invitee)"""
+        if inviter_id == invitee_id:
+            return False
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            # Проверяем, не начислен ли уже билет за этого invitee
-            cursor.execute('''
-                SELECT COUNT(*) FROM referral_invites WHERE inviter_id = ? AND invitee_id = ?
-            ''', (inviter_id, invitee_id))
-            if cursor.fetchone()[0] > 0:
-                conn.close()
-                return False  # Уже начислен
-            # Добавляем запись о приглашении
-            cursor.execute('''
-                INSERT INTO referral_invites (inviter_id, invitee_id, invite_code, status, joined_at)
-                VALUES (?, ?, '', 'joined', CURRENT_TIMESTAMP)
-            ''', (inviter_id, invitee_id))
-            # Увеличиваем счетчик билетов (referral_count)
-            cursor.execute('''
-                UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?
-            ''', (inviter_id,))
-            conn.commit()
-            conn.close()
-            return True
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    # Запись о приглашении; повтор (в том числе параллельный) упирается в уникальный индекс
+                    cursor.execute('''
+                        INSERT INTO referral_invites (inviter_id, invitee_id, invite_code, status, joined_at)
+                        VALUES (?, ?, '', 'joined', CURRENT_TIMESTAMP)
+                        ON CONFLICT(inviter_id, invitee_id) DO NOTHING
+                    ''', (inviter_id, invitee_id))
+                    credited = cursor.rowcount == 1
+                    if credited:
+                        # Увеличиваем счетчик билетов (referral_count)
+                        cursor.execute('''
+                            UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?
+                        ''', (inviter_id,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            if credited:
+                response_cache.invalidate(referral_tag(inviter_id))
+            return credited
         except Exception as e:
             print(f"Error adding ticket for referral start: {e}")
             return False
 
     def set_subscription_status(self, user_id: int, is_subscribed_all: bool):
         """Устанавливает статус подписки на все каналы (True/False)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM tickets_subscription WHERE user_id = ?', (user_id,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute(
-                'INSERT INTO tickets_subscription (user_id, is_subscribed_all) VALUES (?, ?)',
-                (user_id, is_subscribed_all)
-            )
-        else:
-            cursor.execute(
-                'UPDATE tickets_subscription SET is_subscribed_all = ? WHERE user_id = ?',
-                (is_subscribed_all, user_id)
-            )
-        conn.commit()
-        conn.close()
-
-    def add_referral_ticket(self, user_id: int, referral_id: int):
-        """Добавляет билет за реферала (одна запись на каждого приглашённого)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM tickets_referral WHERE user_id = ? AND referral_id = ?', (user_id, referral_id))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute(
-                'INSERT INTO tickets_referral (user_id, referral_id) VALUES (?, ?)',
-                (user_id, referral_id)
-            )
+        with self._connection() as conn:
+            conn.execute('''
+                INSERT INTO tickets_subscription (user_id, is_subscribed_all, verified_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    is_subscribed_all = excluded.is_subscribed_all,
+                    verified_at = excluded.verified_at
+            ''', (user_id, is_subscribed_all))
+            conn.commit()
+        response_cache.invalidate('tickets')
+
+    def add_referral_ticket(self, user_id: int, referral_id: int) -> bool:
+        """Добавляет билет за реферала (одна запись на каждого приглашённого); True — билет начислен сейчас"""
+        with self._connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO tickets_referral (user_id, referral_id) VALUES (?, ?)
+                ON CONFLICT(user_id, referral_id) DO NOTHING
+            ''', (user_id, referral_id))
             conn.commit()
-        conn.close()
+            credited = cursor.rowcount == 1
+        if credited:
+            response_cache.invalidate('tickets')
+        return credited
 
     def set_user_premium(self, user_id: int, is_premium: bool):
         """Устанавливает статус Telegram Premium"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET is_premium = ? WHERE user_id = ?', (is_premium, user_id))
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE users SET is_premium = ? WHERE user_id = ?', (is_premium, user_id))
+            conn.commit()
 
     def get_user_tickets(self, user_id: int) -> int:
         """Возвращает количество билетов пользователя (1 за подписку на все каналы + 1 за каждого реферала)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            # Билет за подписку
-            cursor.execute('SELECT is_subscribed_all FROM tickets_subscription WHERE user_id = ?', (user_id,))
-            sub = cursor.fetchone()
-            tickets_sub = 1 if sub and sub[0] else 0
-            # Билеты за рефералов
-            cursor.execute('SELECT COUNT(*) FROM tickets_referral WHERE user_id = ?', (user_id,))
-            tickets_ref = cursor.fetchone()[0]
-            conn.close()
-            return tickets_sub + tickets_ref
+            with self._connection() as conn:
+                row = conn.execute(
+                    'SELECT subscribed, referral_tickets FROM user_summary WHERE user_id = ?', (user_id,)
+                ).fetchone()
+            return row[0] + row[1] if row else 0
         except Exception as e:
             print(f"Error getting user tickets: {e}")
             return 0
@@ -753,18 +923,65 @@ class Database:
         Возвращает статусы выполнения заданий:
         - task1_done: подписка на папку (есть в giveaway_participants)
         - task2_done: есть хотя бы один успешный invite (referral_invites.status = 'joined')
+        Оба значения — из user_summary (одна строка по первичному ключу)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            # task1: подписка на папку (есть запись в giveaway_participants)
-            cursor.execute('SELECT COUNT(*) FROM giveaway_participants WHERE user_id = ?', (user_id,))
-            task1_done = cursor.fetchone()[0] > 0
-            # task2: хотя бы один успешный invite
-            cursor.execute('SELECT COUNT(*) FROM referral_invites WHERE inviter_id = ? AND status = "joined"', (user_id,))
-            task2_done = cursor.fetchone()[0] > 0
-            conn.close()
-            return {'task1_done': task1_done, 'task2_done': task2_done}
+            with self._connection() as conn:
+                row = conn.execute(
+                    'SELECT folder_entries, successful_invites FROM user_summary WHERE user_id = ?', (user_id,)
+                ).fetchone()
+            if not row:
+                return {'task1_done': False, 'task2_done': False}
+            return {'task1_done': row[0] > 0, 'task2_done': row[1] > 0}
         except Exception as e:
             print(f"Error getting task statuses: {e}")
-            return {'task1_done': False, 'task2_done': False} 
\ No newline at end of file
+            return {'task1_done': False, 'task2_done': False} 
+    def get_user_dashboard(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Все данные экрана пользователя одним запросом по первичному ключу (users + user_summary):
+        билеты, подписка, задания, рефералы (фото хранятся в базе API и добавляются там)
+        """
+        try:
+            with self._connection() as conn:
+                row = conn.execute('''
+                    SELECT u.user_id IS NOT NULL,
+                           u.username, u.first_name, u.referral_code,
+                           COALESCE(u.referral_count, 0), COALESCE(u.total_referral_xp, 0),
+                           COALESCE(u.giveaway_completed, 0),
+                           COALESCE(s.subscribed, 0), COALESCE(s.referral_tickets, 0),
+                           COALESCE(s.folder_entries, 0) > 0, COALESCE(s.successful_invites, 0)
+                    FROM (SELECT ? AS user_id) k
+                    LEFT JOIN users u ON u.user_id = k.user_id
+                    LEFT JOIN user_summary s ON s.user_id = k.user_id
+                ''', (user_id,)).fetchone()
+
+            (registered, username, first_name, referral_code, referral_count, total_referral_xp,
+             giveaway_completed, subscribed, referral_tickets, task1_done, successful_invites) = row
+            subscription_tickets = 1 if subscribed else 0
+            return {
+                'user_id': user_id,
+                'registered': bool(registered),
+                'username': username or '',
+                'first_name': first_name or '',
+                'giveaway_completed': bool(giveaway_completed),
+                'tickets': {
+                    'total': subscription_tickets + referral_tickets,
+                    'subscription': subscription_tickets,
+                    'referral': referral_tickets
+                },
+                'subscribed': bool(subscribed),
+                'tasks': {
+                    'task1_done': bool(task1_done),
+                    'task2_done': successful_invites > 0
+                },
+                'referral': {
+                    'referral_code': referral_code,
+                    'referral_link': f"https://t.me/FSRUBOT?start=ref{referral_code}" if referral_code else None,
+                    'referral_count': referral_count,
+                    'total_referral_xp': total_referral_xp,
+                    'successful_invites': successful_invites
+                }
+            }
+        except Exception as e:
+            print(f"Error getting user dashboard: {e}")
+            return None
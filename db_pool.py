@@ -0,0 +1,319 @@
+"""
+Пул соединений SQLite.
+
+Каждый поток получает одно соединение на время работы с базой: вложенные
+вызовы (например, add_user -> _process_referral) переиспользуют его, а не
+открывают второе. После выхода из внешнего блока соединение возвращается
+в ограниченный пул и достаётся следующему потоку. Подготовленные выражения
+кэшируются самим sqlite3 (cached_statements) и живут вместе с соединением.
+
+На каждое новое соединение применяется профиль хранения из config.py
+(WAL, synchronous, mmap, cache, temp_store, busy_timeout): бот и API пишут
+в один файл из разных процессов, и в режиме WAL читатели не блокируют писателя.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_MAX_AGE,
+    DB_POOL_MAX_USES,
+    DB_STATEMENT_CACHE_SIZE,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    SQLITE_TEMP_STORE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CHECKPOINT_INTERVAL,
+    SQLITE_CHECKPOINT_MODE,
+)
+
+_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+_TEMP_STORES = {'DEFAULT', 'FILE', 'MEMORY'}
+_CHECKPOINT_MODES = {'PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'}
+
+
+def _choice(value: str, allowed: set, name: str) -> str:
+    value = str(value).upper()
+    if value not in allowed:
+        raise ValueError(f"Unsupported {name}: {value}")
+    return value
+
+
+def default_storage_profile() -> List[Tuple[str, Any]]:
+    """PRAGMA-настройки из config.py в порядке применения"""
+    return [
+        ('busy_timeout', int(SQLITE_BUSY_TIMEOUT_MS)),
+        ('journal_mode', _choice(SQLITE_JOURNAL_MODE, _JOURNAL_MODES, 'journal_mode')),
+        ('synchronous', _choice(SQLITE_SYNCHRONOUS, _SYNCHRONOUS_MODES, 'synchronous')),
+        ('mmap_size', int(SQLITE_MMAP_SIZE)),
+        ('cache_size', int(SQLITE_CACHE_SIZE)),
+        ('temp_store', _choice(SQLITE_TEMP_STORE, _TEMP_STORES, 'temp_store')),
+    ]
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class _PooledConnection:
+    """Соединение вместе со служебной информацией для переиспользования"""
+
+    __slots__ = ('conn', 'created_at', 'last_used', 'uses')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+
+class ConnectionPool:
+    # Как долго соединение может простаивать без проверки SELECT 1
+    PING_INTERVAL = 30.0
+
+    def __init__(self, db_path: str, max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, max_age: float = DB_POOL_MAX_AGE,
+                 max_uses: int = DB_POOL_MAX_USES,
+                 statement_cache_size: int = DB_STATEMENT_CACHE_SIZE,
+                 profile: Optional[List[Tuple[str, Any]]] = None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.statement_cache_size = statement_cache_size
+        self.profile = profile if profile is not None else default_storage_profile()
+
+        self._checkpoint_thread = None
+        self._checkpoint_stop = threading.Event()
+        self._last_checkpoint = None
+
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'created': 0, 'reused': 0, 'recycled': 0, 'broken': 0, 'timeouts': 0}
+
+    def _open(self) -> _PooledConnection:
+        """Открытие нового соединения"""
+        profile = dict(self.profile)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=profile.get('busy_timeout', SQLITE_BUSY_TIMEOUT_MS) / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        for name, value in self.profile:
+            conn.execute(f'PRAGMA {name} = {value}').fetchall()
+        with self._lock:
+            self._stats['created'] += 1
+        return _PooledConnection(conn)
+
+    def _is_expired(self, pooled: _PooledConnection) -> bool:
+        """Соединение отработало свой срок и должно быть пересоздано"""
+        if self.max_age and time.monotonic() - pooled.created_at > self.max_age:
+            return True
+        return bool(self.max_uses) and pooled.uses >= self.max_uses
+
+    def _is_healthy(self, pooled: _PooledConnection) -> bool:
+        """Проверка живости давно простаивавшего соединения"""
+        if time.monotonic() - pooled.last_used < self.PING_INTERVAL:
+            return True
+        try:
+            pooled.conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, pooled: _PooledConnection, reason: str):
+        try:
+            pooled.conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats[reason] += 1
+
+    def _checkout(self) -> _PooledConnection:
+        """Получение соединения из пула (или открытие нового)"""
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No free SQLite connection for {self.db_path} after {self.timeout}s")
+
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    return self._open()
+                if self._is_expired(pooled):
+                    self._discard(pooled, 'recycled')
+                    continue
+                if not self._is_healthy(pooled):
+                    self._discard(pooled, 'broken')
+                    continue
+                with self._lock:
+                    self._stats['reused'] += 1
+                return pooled
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, pooled: _PooledConnection, broken: bool = False):
+        """Возврат соединения в пул"""
+        try:
+            if not broken and pooled.conn.in_transaction:
+                # Незакоммиченные изменения откатываются, как при conn.close()
+                pooled.conn.rollback()
+        except sqlite3.Error:
+            broken = True
+
+        pooled.uses += 1
+        pooled.last_used = time.monotonic()
+        if broken:
+            self._discard(pooled, 'broken')
+        elif self._is_expired(pooled):
+            self._discard(pooled, 'recycled')
+        else:
+            with self._lock:
+                self._idle.append(pooled)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Соединение текущего потока; вложенные вызовы получают то же соединение"""
+        local = self._local
+        pooled = getattr(local, 'pooled', None)
+        if pooled is not None:
+            local.depth += 1
+            try:
+                yield pooled.conn
+            finally:
+                local.depth -= 1
+            return
+
+        pooled = self._checkout()
+        local.pooled = pooled
+        local.depth = 1
+        broken = False
+        try:
+            yield pooled.conn
+        except sqlite3.DatabaseError as e:
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            local.pooled = None
+            local.depth = 0
+            self._checkin(pooled, broken=broken)
+
+    def close(self):
+        """Закрытие всех простаивающих соединений"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for pooled in idle:
+            try:
+                pooled.conn.close()
+            except sqlite3.Error:
+                pass
+
+    def checkpoint(self, mode: str = SQLITE_CHECKPOINT_MODE) -> Dict[str, Any]:
+        """Checkpoint WAL-журнала; возвращает результат PRAGMA wal_checkpoint"""
+        mode = _choice(mode, _CHECKPOINT_MODES, 'checkpoint mode')
+        with self.connection() as conn:
+            busy, log_frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        result = {
+            'mode': mode,
+            'busy': bool(busy),
+            'log_frames': log_frames,
+            'checkpointed_frames': checkpointed,
+            'at': time.time(),
+        }
+        self._last_checkpoint = result
+        return result
+
+    def _checkpoint_loop(self, interval: float, mode: str):
+        while not self._checkpoint_stop.wait(interval):
+            try:
+                self.checkpoint(mode)
+            except Exception as e:
+                print(f"Error checkpointing {self.db_path}: {e}")
+
+    def start_checkpointer(self, interval: float = SQLITE_CHECKPOINT_INTERVAL,
+                           mode: str = SQLITE_CHECKPOINT_MODE) -> bool:
+        """Запуск фонового потока с периодическим checkpoint (повторный вызов ничего не делает)"""
+        if interval <= 0:
+            return False
+        with self._lock:
+            if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+                return False
+            self._checkpoint_stop.clear()
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_loop, args=(interval, mode),
+                name=f"sqlite-checkpoint:{self.db_path}", daemon=True,
+            )
+            self._checkpoint_thread.start()
+        return True
+
+    def stop_checkpointer(self):
+        """Остановка фонового checkpoint"""
+        self._checkpoint_stop.set()
+        thread = self._checkpoint_thread
+        if thread is not None:
+            thread.join(timeout=5)
+        self._checkpoint_thread = None
+
+    def settings(self) -> Dict[str, Any]:
+        """Фактические значения PRAGMA на соединении из пула"""
+        synchronous_names = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+        temp_store_names = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+        with self.connection() as conn:
+            read = lambda name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+            settings = {
+                'journal_mode': str(read('journal_mode')).upper(),
+                'synchronous': synchronous_names.get(read('synchronous')),
+                'mmap_size': read('mmap_size'),
+                'cache_size': read('cache_size'),
+                'temp_store': temp_store_names.get(read('temp_store')),
+                'busy_timeout': read('busy_timeout'),
+                'wal_autocheckpoint': read('wal_autocheckpoint'),
+                'page_size': read('page_size'),
+            }
+        settings['configured'] = dict(self.profile)
+        settings['checkpointer_running'] = (
+            self._checkpoint_thread is not None and self._checkpoint_thread.is_alive()
+        )
+        settings['last_checkpoint'] = self._last_checkpoint
+        return settings
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики пула для мониторинга"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['max_size'] = self.max_size
+        return stats
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Общий пул для файла базы данных (один на процесс)"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    return pool
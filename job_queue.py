@@ -0,0 +1,288 @@
+"""
+Очередь фоновых задач в SQLite (таблица jobs).
+
+Задачи переживают перезапуск процесса, выполняются фиксированным пулом
+потоков и могут быть отложены (run_at) вместо time.sleep в обработчике.
+Ожидающая задача с тем же (kind, dedupe_key) не дублируется, а сдвигается.
+Упавшая задача повторяется с экспоненциальной задержкой, после max_attempts
+попыток остается в статусе failed. Если процесс умер посреди выполнения,
+задача снова становится доступной после истечения аренды (locked_until),
+если попытки не исчерпаны, иначе — failed с ошибкой 'lease expired'.
+"""
+
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_DELAY,
+    JOB_RETRY_MAX_DELAY,
+    JOB_LEASE_SECONDS,
+    JOB_RETENTION_HOURS,
+)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class JobQueue:
+    # Как часто простаивающий воркер заглядывает в таблицу, даже если его не разбудили
+    POLL_INTERVAL = 5.0
+    # Как часто удаляются старые завершенные задачи
+    PURGE_INTERVAL = 3600.0
+
+    def __init__(self, pool, workers: int = JOB_WORKERS, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.pool = pool
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        """Обработчик задач вида kind: получает payload, возвращает результат (сохраняется в JSON)"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], delay: float = 0.0,
+                dedupe_key: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS,
+                sooner: bool = False) -> int:
+        """
+        Постановка задачи; возвращает id.
+        Если такая же (kind, dedupe_key) задача уже ждет, новая не создается,
+        а время запуска существующей сдвигается на более позднее
+        (sooner=True — на более раннее, например чтобы запустить ее сейчас).
+        """
+        run_at = time.time() + delay
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO jobs (kind, dedupe_key, payload, max_attempts, run_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (kind, dedupe_key, json.dumps(payload), max_attempts, run_at))
+            if cursor.rowcount:
+                job_id = cursor.lastrowid
+            else:
+                conn.execute(f'''
+                    UPDATE jobs
+                    SET run_at = {'MIN' if sooner else 'MAX'}(run_at, ?), payload = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE kind = ? AND dedupe_key = ? AND status = ?
+                ''', (run_at, json.dumps(payload), kind, dedupe_key, STATUS_QUEUED))
+                job_id = conn.execute('''
+                    SELECT id FROM jobs WHERE kind = ? AND dedupe_key = ? AND status = ?
+                ''', (kind, dedupe_key, STATUS_QUEUED)).fetchone()[0]
+            conn.commit()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Захват следующей готовой задачи (или задачи с истекшей арендой)"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Аренда истекла, а попытки исчерпаны (обработчик убивал или вешал воркер) — задача не повторяется
+                conn.execute('''
+                    UPDATE jobs
+                    SET status = ?, last_error = 'lease expired', locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE status = ? AND locked_until < ? AND attempts >= max_attempts
+                ''', (STATUS_FAILED, STATUS_RUNNING, now))
+                row = conn.execute('''
+                    SELECT id, kind, payload, attempts, max_attempts FROM jobs
+                    WHERE (status = ? AND run_at <= ?)
+                       OR (status = ? AND locked_until < ? AND attempts < max_attempts)
+                    ORDER BY run_at
+                    LIMIT 1
+                ''', (STATUS_QUEUED, now, STATUS_RUNNING, now)).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                conn.execute('''
+                    UPDATE jobs
+                    SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (STATUS_RUNNING, now + self.lease_seconds, row[0]))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'payload': json.loads(row[2]),
+            'attempts': row[3] + 1,
+            'max_attempts': row[4],
+        }
+
+    def _finish(self, job: Dict[str, Any], result: Any):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                UPDATE jobs
+                SET status = ?, result = ?, last_error = NULL, locked_until = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (STATUS_DONE, json.dumps(result), job['id']))
+            conn.commit()
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """Экспоненциальная задержка перед повтором (со случайным разбросом)"""
+        delay = min(JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), JOB_RETRY_MAX_DELAY)
+        return delay * random.uniform(0.8, 1.2)
+
+    def _fail(self, job: Dict[str, Any], error: str):
+        """Повтор с задержкой или окончательная ошибка после max_attempts"""
+        with self.pool.connection() as conn:
+            if job['attempts'] >= job['max_attempts']:
+                conn.execute('''
+                    UPDATE jobs
+                    SET status = ?, last_error = ?, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (STATUS_FAILED, error, job['id']))
+            else:
+                # Пока задача выполнялась, могла появиться ожидающая с тем же ключом — тогда повтор не нужен
+                conn.execute('''
+                    UPDATE OR IGNORE jobs
+                    SET status = ?, run_at = ?, last_error = ?, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (STATUS_QUEUED, time.time() + self.retry_delay(job['attempts']), error, job['id']))
+                conn.execute('''
+                    UPDATE jobs SET status = ?, last_error = ?, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = ?
+                ''', (STATUS_FAILED, f"{error} (superseded by a queued job)", job['id'], STATUS_RUNNING))
+            conn.commit()
+
+    def run_once(self) -> bool:
+        """Выполнение одной готовой задачи; False — выполнять нечего"""
+        job = self._claim()
+        if job is None:
+            return False
+        handler = self._handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job['kind']}")
+            result = handler(job['payload'])
+        except Exception as e:
+            print(f"Error running job {job['id']} ({job['kind']}): {e}")
+            self._fail(job, str(e))
+        else:
+            self._finish(job, result)
+        return True
+
+    def _next_due_in(self) -> float:
+        """Через сколько секунд станет готова ближайшая задача"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT MIN(run_at) FROM jobs WHERE status = ?', (STATUS_QUEUED,)).fetchone()
+        if row[0] is None:
+            return self.POLL_INTERVAL
+        return max(0.0, min(row[0] - time.time(), self.POLL_INTERVAL))
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+                if time.time() - self._last_purge > self.PURGE_INTERVAL:
+                    self._last_purge = time.time()
+                    self.purge()
+                wait = self._next_due_in()
+            except Exception as e:
+                print(f"Error in job worker: {e}")
+                wait = self.POLL_INTERVAL
+            with self._wakeup:
+                if not self._stop.is_set():
+                    self._wakeup.wait(wait)
+
+    def start(self) -> bool:
+        """Запуск пула воркеров (повторный вызов ничего не делает)"""
+        if any(thread.is_alive() for thread in self._threads):
+            return False
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """Остановка воркеров; выполняемые задачи дорабатывают"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def purge(self, retention_hours: float = JOB_RETENTION_HOURS) -> int:
+        """Удаление завершенных задач старше retention_hours"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                DELETE FROM jobs
+                WHERE status IN (?, ?) AND updated_at < datetime('now', ?)
+            ''', (STATUS_DONE, STATUS_FAILED, f'-{retention_hours} hours'))
+            conn.commit()
+            return cursor.rowcount
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Состояние задачи"""
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT id, kind, dedupe_key, payload, status, attempts, max_attempts,
+                       run_at, last_error, result, created_at, updated_at
+                FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def find(self, kind: str, dedupe_key: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Последние задачи по ключу (например, все проверки подписки пользователя)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, kind, dedupe_key, payload, status, attempts, max_attempts,
+                       run_at, last_error, result, created_at, updated_at
+                FROM jobs WHERE kind = ? AND dedupe_key = ?
+                ORDER BY id DESC LIMIT ?
+            ''', (kind, dedupe_key, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'dedupe_key': row[2],
+            'payload': json.loads(row[3]),
+            'status': row[4],
+            'attempts': row[5],
+            'max_attempts': row[6],
+            'run_at': row[7],
+            'last_error': row[8],
+            'result': json.loads(row[9]) if row[9] else None,
+            'created_at': row[10],
+            'updated_at': row[11],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и число задач по статусам"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            due, oldest_due = conn.execute('''
+                SELECT COUNT(*), MIN(run_at) FROM jobs WHERE status = ? AND run_at <= ?
+            ''', (STATUS_QUEUED, now)).fetchone()
+        return {
+            'depth': counts.get(STATUS_QUEUED, 0),
+            'due': due,
+            'oldest_due_seconds': round(now - oldest_due, 1) if oldest_due else 0,
+            'by_status': {status: counts.get(status, 0)
+                          for status in (STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED)},
+            'workers': sum(1 for thread in self._threads if thread.is_alive()),
+        }
@@ -0,0 +1,148 @@
+"""
+Рейтинг пригласивших друзей: топ N, место пользователя и соседи по рейтингу.
+
+Порядок: referral_count по убыванию, затем total_referral_xp по убыванию,
+при равенстве — меньший user_id выше. В рейтинге только пользователи
+хотя бы с одним приглашением.
+
+Источник — таблица leaderboard, которую триггеры на users обновляют в той
+же транзакции, что и начисление (миграция 2026_10_17_referral_leaderboard.sql).
+Каждый процесс держит упорядоченную копию рейтинга в памяти и перед
+запросом сверяет счетчик leaderboard_seq (одно чтение по первичному ключу);
+если он вырос, догружает только изменившиеся строки по индексу seq.
+Место и соседи находятся двоичным поиском.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+
+# Ключ сортировки: (-referral_count, -total_referral_xp, user_id)
+Key = Tuple[int, int, int]
+
+
+class Leaderboard:
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._keys: List[Key] = []
+        self._by_user: Dict[int, Key] = {}
+        self._seq: Optional[int] = None
+
+    @staticmethod
+    def _key(user_id: int, referral_count: int, total_referral_xp: int) -> Key:
+        return (-referral_count, -total_referral_xp, user_id)
+
+    def _apply(self, user_id: int, referral_count: int, total_referral_xp: int):
+        """Перестановка одного пользователя в упорядоченном списке"""
+        old_key = self._by_user.pop(user_id, None)
+        if old_key is not None:
+            del self._keys[bisect_left(self._keys, old_key)]
+        if referral_count > 0:
+            key = self._key(user_id, referral_count, total_referral_xp)
+            insort(self._keys, key)
+            self._by_user[user_id] = key
+
+    def refresh(self):
+        """Догрузка изменений из таблицы leaderboard (полная загрузка при первом вызове)"""
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM counters WHERE name = 'leaderboard_seq'").fetchone()
+            seq = row[0] if row else 0
+            if seq == self._seq:
+                return
+            with self._lock:
+                if seq == self._seq:
+                    return
+                if self._seq is None:
+                    rows = conn.execute('''
+                        SELECT user_id, referral_count, total_referral_xp FROM leaderboard
+                        WHERE referral_count > 0
+                    ''').fetchall()
+                    self._keys = sorted(self._key(*row) for row in rows)
+                    self._by_user = {key[2]: key for key in self._keys}
+                else:
+                    rows = conn.execute('''
+                        SELECT user_id, referral_count, total_referral_xp FROM leaderboard
+                        WHERE seq > ?
+                        ORDER BY seq
+                    ''', (self._seq,)).fetchall()
+                    for user_id, referral_count, total_referral_xp in rows:
+                        self._apply(user_id, referral_count, total_referral_xp)
+                # Строки с seq больше прочитанного счетчика будут догружены в следующий раз
+                self._seq = seq
+
+    def _entries(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Строки рейтинга с местами start+1..stop и именами пользователей"""
+        with self._lock:
+            keys = self._keys[max(start, 0):stop]
+            start = max(start, 0)
+        if not keys:
+            return []
+        user_ids = [key[2] for key in keys]
+        placeholders = ','.join('?' * len(user_ids))
+        with self.pool.connection() as conn:
+            names = {
+                row[0]: (row[1], row[2])
+                for row in conn.execute(
+                    f'SELECT user_id, username, first_name FROM users WHERE user_id IN ({placeholders})', user_ids
+                )
+            }
+        return [
+            {
+                'rank': start + index + 1,
+                'user_id': key[2],
+                'username': names.get(key[2], (None, None))[0],
+                'first_name': names.get(key[2], (None, None))[1],
+                'referral_count': -key[0],
+                'total_referral_xp': -key[1],
+            }
+            for index, key in enumerate(keys)
+        ]
+
+    def size(self) -> int:
+        """Число пользователей в рейтинге"""
+        self.refresh()
+        return len(self._keys)
+
+    def top(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Первые limit мест"""
+        self.refresh()
+        return self._entries(0, limit)
+
+    def _position(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            key = self._by_user.get(user_id)
+            return bisect_left(self._keys, key) if key is not None else None
+
+    def rank(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Место пользователя (None — пользователя нет в рейтинге)"""
+        self.refresh()
+        position = self._position(user_id)
+        if position is None:
+            return None
+        entries = self._entries(position, position + 1)
+        return entries[0] if entries else None
+
+    def around(self, user_id: int, radius: int = 2) -> List[Dict[str, Any]]:
+        """Пользователь и до radius соседей выше и ниже по рейтингу"""
+        self.refresh()
+        position = self._position(user_id)
+        if position is None:
+            return []
+        return self._entries(position - radius, position + radius + 1)
+
+
+_leaderboards: Dict[str, Leaderboard] = {}
+_leaderboards_lock = threading.Lock()
+
+
+def get_leaderboard(pool) -> Leaderboard:
+    """Общий рейтинг для файла базы данных (один на процесс)"""
+    leaderboard = _leaderboards.get(pool.db_path)
+    if leaderboard is None:
+        with _leaderboards_lock:
+            leaderboard = _leaderboards.get(pool.db_path)
+            if leaderboard is None:
+                leaderboard = Leaderboard(pool)
+                _leaderboards[pool.db_path] = leaderboard
+    return leaderboard
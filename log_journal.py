@@ -0,0 +1,176 @@
+"""
+Журнал событий логгера на диске (JSON lines, сегменты с ротацией).
+
+TelegramLogger сначала дописывает событие в журнал, а отправка в чат читает
+журнал с сохраненной позиции (cursor.json). Позиция сдвигается только после
+успешной доставки, поэтому недоставленные события переживают перезапуск.
+Сегмент закрывается по достижении LOG_JOURNAL_SEGMENT_BYTES; полностью
+доставленные сегменты удаляются. Журналом пользуется один процесс —
+каталог блокируется файлом .lock.
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import LOG_JOURNAL_SEGMENT_BYTES, LOG_JOURNAL_FSYNC
+
+_SEGMENT_RE = re.compile(r'^events-(\d{12})\.jsonl$')
+
+# Позиция в журнале: (номер сегмента, смещение в байтах)
+Position = Tuple[int, int]
+
+
+class JournalLockedError(RuntimeError):
+    """Каталог журнала уже используется другим процессом"""
+
+
+class LogJournal:
+    CURSOR_FILE = 'cursor.json'
+    LOCK_FILE = '.lock'
+
+    def __init__(self, directory: str, segment_bytes: int = LOG_JOURNAL_SEGMENT_BYTES,
+                 fsync: bool = LOG_JOURNAL_FSYNC):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock_file = open(os.path.join(directory, self.LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise JournalLockedError(f"Log journal {directory} is used by another process")
+
+        self._lock = threading.Lock()
+        segments = self._segments()
+        self._cursor = self._load_cursor() or ((segments[0] if segments else 1), 0)
+        # Новые записи — в новый сегмент: хвост старого мог оборваться при падении процесса
+        self._write_seq = max(segments[-1] + 1 if segments else 1, self._cursor[0])
+        self._file = None
+        self._written = 0
+        self._stats = {'appended': 0, 'committed': 0, 'corrupt': 0, 'rotations': 0}
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f'events-{seq:012d}.jsonl')
+
+    def _segments(self) -> List[int]:
+        return sorted(int(m.group(1)) for m in map(_SEGMENT_RE.match, os.listdir(self.directory)) if m)
+
+    def _load_cursor(self) -> Optional[Position]:
+        try:
+            with open(os.path.join(self.directory, self.CURSOR_FILE), 'r') as f:
+                data = json.load(f)
+            return int(data['segment']), int(data['offset'])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Поврежден cursor журнала логов, читаем с начала: {e}")
+            return None
+
+    def _save_cursor(self, position: Position):
+        path = os.path.join(self.directory, self.CURSOR_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, event: Dict[str, Any]):
+        """Запись события в конец журнала (до возврата данные переданы ОС)"""
+        line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._file is not None and self._written and self._written + len(line) > self.segment_bytes:
+                self._file.close()
+                self._file = None
+                self._write_seq += 1
+                self._stats['rotations'] += 1
+            if self._file is None:
+                self._file = open(self._path(self._write_seq), 'ab')
+                self._written = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._written += len(line)
+            self._stats['appended'] += 1
+
+    def read(self, max_events: int) -> List[Tuple[Dict[str, Any], Position]]:
+        """До max_events недоставленных событий с позицией после каждого"""
+        with self._lock:
+            write_seq = self._write_seq
+        seq, offset = self._cursor
+        entries = []
+        while len(entries) < max_events:
+            try:
+                with open(self._path(seq), 'rb') as f:
+                    f.seek(offset)
+                    for raw in f:
+                        if not raw.endswith(b'\n'):
+                            # Строка еще дописывается (или оборвана при падении)
+                            break
+                        offset += len(raw)
+                        try:
+                            event = json.loads(raw)
+                        except ValueError:
+                            self._stats['corrupt'] += 1
+                            continue
+                        entries.append((event, (seq, offset)))
+                        if len(entries) >= max_events:
+                            break
+            except FileNotFoundError:
+                pass
+            if len(entries) >= max_events or seq >= write_seq:
+                break
+            # Сегмент дочитан и в него больше не пишут — переходим к следующему
+            seq, offset = seq + 1, 0
+            if not entries:
+                # Пропущенные пустые/битые сегменты тоже считаются пройденными
+                self.commit((seq, offset))
+        return entries
+
+    def commit(self, position: Position):
+        """Сохранение позиции после доставки и удаление пройденных сегментов"""
+        previous = self._cursor
+        self._cursor = position
+        self._save_cursor(position)
+        self._stats['committed'] += 1
+        for seq in range(previous[0], position[0]):
+            try:
+                os.remove(self._path(seq))
+            except FileNotFoundError:
+                pass
+
+    def backlog_bytes(self) -> int:
+        """Объем недоставленных данных на диске"""
+        total = 0
+        for seq in self._segments():
+            if seq < self._cursor[0]:
+                continue
+            try:
+                size = os.path.getsize(self._path(seq))
+            except FileNotFoundError:
+                continue
+            total += size - (self._cursor[1] if seq == self._cursor[0] else 0)
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['segments'] = len(self._segments())
+        stats['backlog_bytes'] = self.backlog_bytes()
+        stats['cursor'] = list(self._cursor)
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
@@ -1,13 +1,272 @@
+"""
+Логирование событий бота в служебный чат Telegram.
+
+log_* не отправляют сообщение сами: событие сначала дописывается в журнал
+на диске (log_journal.py, каталог LOG_JOURNAL_DIR), поэтому недоставленные
+события переживают перезапуск и недоступность Telegram. Фоновая задача
+читает журнал, собирает события за LOG_DIGEST_WINDOW секунд в одно
+сообщение-сводку (не длиннее лимита Telegram и не больше
+LOG_DIGEST_MAX_EVENTS событий) и отправляет сводки не чаще
+LOG_RATE_PER_MINUTE в минуту; на 429 ждет retry_after и повторяет.
+Если журнал недоступен (отключен или занят другим процессом), события
+держатся в памяти: очередь ограничена LOG_QUEUE_MAX событиями, при
+переполнении отбрасываются самые старые обычные события, а их число
+попадает в следующую сводку.
+"""
+
 import asyncio
+import time
+from collections import deque
+from itertools import islice
 from datetime import datetime
-from typing import Optional
+from typing import Deque, List, Optional, Tuple
 from aiogram import Bot
-from config import BOT_TOKEN
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import (
+    BOT_TOKEN,
+    LOG_DIGEST_WINDOW,
+    LOG_DIGEST_MAX_EVENTS,
+    LOG_QUEUE_MAX,
+    LOG_RATE_PER_MINUTE,
+    LOG_SEND_ATTEMPTS,
+    LOG_CLOSE_TIMEOUT,
+    LOG_JOURNAL_DIR,
+    LOG_RETRY_INTERVAL,
+)
+from log_journal import LogJournal
+from rate_limit import TokenBucket
+
+# Лимит длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
 
 class TelegramLogger:
-    def __init__(self, chat_id: int = -4948669471):
+    def __init__(self, chat_id: int = -4948669471,
+                 digest_window: float = LOG_DIGEST_WINDOW,
+                 digest_max_events: int = LOG_DIGEST_MAX_EVENTS,
+                 queue_max: int = LOG_QUEUE_MAX,
+                 rate_per_minute: float = LOG_RATE_PER_MINUTE,
+                 journal_dir: str = LOG_JOURNAL_DIR):
         self.chat_id = chat_id
         self.bot = Bot(token=BOT_TOKEN)
+        self.digest_window = digest_window
+        self.digest_max_events = digest_max_events
+        self.queue_max = queue_max
+        # Telegram ограничивает частоту сообщений в группу (около 20 в минуту)
+        self.rate_limiter = TokenBucket(rate_per_minute / 60.0, capacity=3)
+        self.journal_dir = journal_dir
+        # Журнал открывается при первом событии: процессы, которые ничего не логируют, его не блокируют
+        self.journal = None
+        self._journal_opened = False
+        # События в памяти, если журнал недоступен: (parse_mode, текст, приоритетное)
+        self._queue: Deque[Tuple[Optional[str], str, bool]] = deque()
+        self._wakeup = None
+        self._closed = None
+        self._worker = None
+        self._closing = False
+        self._dropped_unreported = 0
+        self._stats = {
+            'queued': 0, 'journaled': 0, 'dropped': 0, 'sent_messages': 0, 'sent_events': 0,
+            'digests': 0, 'retries': 0, 'failed_events': 0,
+        }
+
+    def _open_journal(self):
+        if self._journal_opened:
+            return
+        self._journal_opened = True
+        if not self.journal_dir:
+            return
+        try:
+            self.journal = LogJournal(self.journal_dir)
+        except Exception as e:
+            print(f"Журнал логов недоступен, события хранятся в памяти: {e}")
+
+    def start(self):
+        """Запуск доставки (вызывать внутри работающего loop): дослать события, оставшиеся в журнале"""
+        self._open_journal()
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def _enqueue(self, message: str, parse_mode: Optional[str] = None, priority: bool = False):
+        """Постановка события в очередь доставки (не ждет сети)"""
+        self._open_journal()
+        self._stats['queued'] += 1
+        if self.journal is not None:
+            try:
+                self.journal.append({'ts': time.time(), 'parse_mode': parse_mode,
+                                     'text': message, 'priority': priority})
+                self._stats['journaled'] += 1
+                if not self._closing:
+                    self._ensure_worker()
+                    self._wakeup.set()
+                # После close() событие остается в журнале до следующего запуска
+                return
+            except OSError as e:
+                print(f"Ошибка записи в журнал логов: {e}")
+        if self._closing:
+            print("Ошибка логирования: логгер закрыт, событие отброшено")
+            self._stats['dropped'] += 1
+            return
+        if len(self._queue) >= self.queue_max:
+            self._drop_one()
+        self._queue.append((parse_mode, message, priority))
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def _drop_one(self):
+        """Отбрасывание самого старого обычного события (приоритетные — в последнюю очередь)"""
+        for index, (_, _, priority) in enumerate(self._queue):
+            if not priority:
+                del self._queue[index]
+                break
+        else:
+            self._queue.popleft()
+        self._stats['dropped'] += 1
+        self._dropped_unreported += 1
+
+    def _ensure_worker(self):
+        """Ленивый запуск задачи доставки в текущем event loop"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._closed = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._delivery_loop())
+
+    def _peek(self) -> Tuple[List[Tuple[Optional[str], str]], list]:
+        """
+        Следующие события для сводки: сначала из памяти, затем из журнала.
+        Возвращает [(parse_mode, текст)] и позиции журнала после каждого (для памяти — пусто).
+        """
+        if self._queue:
+            events = [(mode, text) for mode, text, _ in islice(self._queue, self.digest_max_events)]
+            return events, []
+        if self.journal is None:
+            return [], []
+        entries = self.journal.read(self.digest_max_events)
+        return [(event.get('parse_mode'), event.get('text', '')) for event, _ in entries], \
+            [position for _, position in entries]
+
+    def _build_digest(self, events: List[Tuple[Optional[str], str]]) -> Tuple[Optional[str], str, int]:
+        """Сборка сводки из первых событий с одинаковым parse_mode; возвращает и число вошедших"""
+        parse_mode = events[0][0]
+        notice = ""
+        if self._dropped_unreported:
+            notice = f"⚠️ Пропущено событий из-за переполнения очереди: {self._dropped_unreported}"
+        # Запас под заголовок сводки и уведомление о пропусках
+        budget = MESSAGE_LIMIT - 200
+        parts = []
+        size = 0
+        for mode, text in events[:self.digest_max_events]:
+            if mode != parse_mode:
+                break
+            text = text[:budget]
+            if parts and size + len(DIGEST_SEPARATOR) + len(text) > budget:
+                break
+            parts.append(text)
+            size += len(text) + len(DIGEST_SEPARATOR)
+
+        header = [notice] if notice else []
+        if len(parts) > 1:
+            header.append(f"🧾 Сводка: {len(parts)} событий")
+        text = DIGEST_SEPARATOR.join(parts)
+        if header:
+            text = "\n".join(header) + "\n\n" + text
+        return parse_mode, text, len(parts)
+
+    async def _send(self, text: str, parse_mode: Optional[str]) -> Optional[bool]:
+        """
+        Отправка одного сообщения с учетом лимита частоты и повторами.
+        True — доставлено, None — Telegram отверг сообщение (повтор бесполезен),
+        False — не удалось за LOG_SEND_ATTEMPTS попыток.
+        """
+        for attempt in range(1, LOG_SEND_ATTEMPTS + 1):
+            await self.rate_limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
+            except TelegramRetryAfter as e:
+                # 429: вся отправка в чат ждет, сколько сказал Telegram
+                self.rate_limiter.pause(e.retry_after)
+                self._stats['retries'] += 1
+                continue
+            except TelegramBadRequest as e:
+                if parse_mode is None:
+                    print(f"Ошибка логирования: {e}")
+                    return None
+                # Разметка сломана данными пользователя — отправляем как обычный текст
+                parse_mode = None
+                self._stats['retries'] += 1
+                continue
+            except Exception as e:
+                print(f"Ошибка логирования (попытка {attempt}/{LOG_SEND_ATTEMPTS}): {e}")
+                self._stats['retries'] += 1
+                if self._closing:
+                    # При остановке не ждем: события останутся в журнале
+                    return False
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            return True
+        return False
+
+    def _consume(self, count: int, positions: list):
+        """Удаление доставленных (или отвергнутых) событий из памяти или сдвиг позиции журнала"""
+        if positions:
+            self.journal.commit(positions[count - 1])
+        else:
+            for _ in range(count):
+                self._queue.popleft()
+
+    async def _sleep_unless_closing(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._closed.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _delivery_loop(self):
+        while True:
+            events, positions = self._peek()
+            if not events:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Окно сводки: даем набраться событиям, если их еще меньше, чем входит в сводку
+            if len(events) < self.digest_max_events and not self._closing:
+                await self._sleep_unless_closing(self.digest_window)
+                events, positions = self._peek()
+
+            parse_mode, text, count = self._build_digest(events)
+            try:
+                result = await self._send(text, parse_mode)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка логирования: {e}")
+                result = False
+
+            if result is False and positions:
+                # Журнал хранит события до доставки — повторим позже, ничего не теряя
+                if self._closing:
+                    return
+                await self._sleep_unless_closing(LOG_RETRY_INTERVAL)
+                continue
+
+            self._consume(count, positions)
+            self._dropped_unreported = 0
+            if result:
+                self._stats['sent_messages'] += 1
+                self._stats['sent_events'] += count
+                if count > 1:
+                    self._stats['digests'] += 1
+            else:
+                self._stats['failed_events'] += count
+
+    def stats(self) -> dict:
+        """Счетчики очереди доставки"""
+        stats = dict(self._stats)
+        stats['pending'] = len(self._queue)
+        stats['journal'] = self.journal.stats() if self.journal is not None else None
+        return stats
     
     async def log_user_action(self, user_id: int, username: Optional[str], 
                             first_name: Optional[str], action: str, 
@@ -31,11 +290,7 @@ class TelegramLogger:
 {additional_info}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования: {e}")
     
@@ -54,11 +309,7 @@ class TelegramLogger:
 ✅ **Бот готов к работе!**
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode="Markdown"
-            )
+            self._enqueue(message, parse_mode="Markdown", priority=True)
         except Exception as e:
             print(f"Ошибка логирования запуска: {e}")
     
@@ -80,11 +331,7 @@ class TelegramLogger:
 📝 **Детали:** {details}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode="Markdown"
-            )
+            self._enqueue(message, parse_mode="Markdown")
         except Exception as e:
             print(f"Ошибка логирования БД: {e}")
     
@@ -101,11 +348,7 @@ class TelegramLogger:
 🕐 **Время:** {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode="Markdown"
-            )
+            self._enqueue(message, parse_mode="Markdown", priority=True)
         except Exception as e:
             print(f"Ошибка логирования ошибки: {e}")
     
@@ -123,11 +366,7 @@ class TelegramLogger:
 🕐 **Время:** {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode="Markdown"
-            )
+            self._enqueue(message, parse_mode="Markdown")
         except Exception as e:
             print(f"Ошибка логирования статистики: {e}")
     
@@ -157,11 +396,7 @@ class TelegramLogger:
 🕐 Время: {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования приглашения: {e}")
     
@@ -188,11 +423,7 @@ class TelegramLogger:
 🕐 Время: {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования выполнения задания: {e}")
     
@@ -223,11 +454,7 @@ class TelegramLogger:
 🕐 Время: {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования завершения гивевея: {e}")
     
@@ -257,11 +484,7 @@ class TelegramLogger:
 🕐 Время: {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования реферальной статистики: {e}")
     
@@ -286,16 +509,31 @@ class TelegramLogger:
 🕐 Время: {timestamp}
             """.strip()
             
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=None
-            )
+            self._enqueue(message, parse_mode=None)
         except Exception as e:
             print(f"Ошибка логирования подписки на папку: {e}")
     
-    async def close(self):
-        """Закрытие соединения с ботом"""
+    async def close(self, timeout: float = LOG_CLOSE_TIMEOUT):
+        """Доставка оставшихся событий (не дольше timeout секунд) и закрытие соединения с ботом"""
+        self._closing = True
+        if self._worker is not None and not self._worker.done():
+            self._wakeup.set()
+            self._closed.set()
+            try:
+                await asyncio.wait_for(self._worker, timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._worker = None
+        if self._queue:
+            print(f"Ошибка логирования: не доставлено событий при остановке: {len(self._queue)}")
+            self._stats['failed_events'] += len(self._queue)
+            self._queue.clear()
+        if self.journal is not None:
+            backlog = self.journal.backlog_bytes()
+            if backlog:
+                print(f"📒 В журнале логов осталось {backlog} байт недоставленных событий — отправим при следующем запуске")
+            self.journal.close()
+            self.journal = None
         await self.bot.session.close()
 
 # Создаем глобальный экземпляр логгера
@@ -0,0 +1,89 @@
+"""
+Кэш результатов get_chat_member по ключу (channel_id, user_id).
+
+Положительные результаты (подписан) живут дольше отрицательных: отписка
+случается редко, а только что подписавшийся пользователь должен увидеть
+билет быстро. Ошибки Bot API не кэшируются. Размер ограничен числом записей,
+при переполнении вытесняются давно не использованные (LRU).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import MEMBERSHIP_CACHE_MAX_ENTRIES, MEMBERSHIP_CACHE_NEGATIVE_TTL, MEMBERSHIP_CACHE_POSITIVE_TTL
+
+
+class MembershipCache:
+    def __init__(self, positive_ttl: float = MEMBERSHIP_CACHE_POSITIVE_TTL,
+                 negative_ttl: float = MEMBERSHIP_CACHE_NEGATIVE_TTL,
+                 max_entries: int = MEMBERSHIP_CACHE_MAX_ENTRIES):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # (channel_id, user_id) -> (истекает, результат)
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    def get(self, channel_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """Результат из кэша или None"""
+        key = (channel_id, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            expires_at, result = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return dict(result)
+
+    def put(self, channel_id: int, user_id: int, result: Dict[str, Any]):
+        """Сохранение результата; ответы с ошибкой не кэшируются"""
+        if result.get('error'):
+            return
+        ttl = self.positive_ttl if result['subscribed'] else self.negative_ttl
+        if ttl <= 0:
+            return
+        key = (channel_id, user_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def invalidate(self, user_id: int, channel_ids: Iterable[int], only_negative: bool = False) -> int:
+        """Удаление записей пользователя по указанным каналам; возвращает число удаленных"""
+        removed = 0
+        with self._lock:
+            for channel_id in channel_ids:
+                entry = self._entries.get((channel_id, user_id))
+                if entry is None or (only_negative and entry[1]['subscribed']):
+                    continue
+                del self._entries[(channel_id, user_id)]
+                removed += 1
+            self._stats['invalidated'] += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidated'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кэша для мониторинга"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['max_entries'] = self.max_entries
+        return stats
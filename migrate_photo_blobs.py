@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Перенос содержимого фото из photo_uploads.file_data (base64) в файловое хранилище
+Использование: python3 migrate_photo_blobs.py [путь_к_бд] [--vacuum] [--gc]
+"""
+
+import base64
+import sys
+
+from blob_store import get_blob_store
+
+BATCH_SIZE = 100
+
+
+def has_column(conn, table, column):
+    cursor = conn.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def migrate(pool, batch_size=BATCH_SIZE):
+    """Переносит file_data в хранилище пачками; возвращает (перенесено, ошибок)"""
+    store = get_blob_store()
+    moved = 0
+    failed = 0
+    last_id = ''
+
+    with pool.connection() as conn:
+        if not has_column(conn, 'photo_uploads', 'file_data'):
+            print("ℹ️ В photo_uploads нет колонки file_data — переносить нечего")
+            return 0, 0
+
+        while True:
+            cursor = conn.execute('''
+                SELECT id, file_data FROM photo_uploads
+                WHERE blob_sha256 IS NULL AND file_data IS NOT NULL AND file_data != ''
+                  AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for photo_id, file_data in rows:
+                try:
+                    if file_data.startswith('data:') and ',' in file_data:
+                        file_data = file_data.split(',', 1)[1]
+                    content = base64.b64decode(file_data, validate=True)
+                    sha256, size = store.put_bytes(content)
+                    updates.append((sha256, size, photo_id))
+                except Exception as e:
+                    print(f"❌ {photo_id}: {e}")
+                    failed += 1
+
+            conn.executemany('''
+                UPDATE photo_uploads
+                SET blob_sha256 = ?, file_size = ?, file_data = NULL
+                WHERE id = ?
+            ''', updates)
+            conn.commit()
+            moved += len(updates)
+            print(f"📦 Перенесено: {moved}")
+
+    return moved, failed
+
+
+def collect_garbage(pool):
+    """Удаление файлов, на которые не ссылается ни одна запись"""
+    with pool.connection() as conn:
+        cursor = conn.execute('SELECT DISTINCT blob_sha256 FROM photo_uploads WHERE blob_sha256 IS NOT NULL')
+        referenced = {row[0] for row in cursor.fetchall()}
+    return get_blob_store().gc(referenced)
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else 'fsr.db'
+
+    # Только миграции базы фото (колонка blob_sha256), без таблиц бота
+    from database import apply_photo_migrations
+    from db_pool import get_pool
+    pool = get_pool(db_path)
+    apply_photo_migrations(pool)
+
+    print(f"🔧 Перенос фото из {db_path} в {get_blob_store().root}...")
+    moved, failed = migrate(pool)
+    print(f"\n📊 Результат: перенесено {moved}, ошибок {failed}")
+
+    if '--vacuum' in sys.argv and moved:
+        print("🧹 VACUUM для освобождения места...")
+        with pool.connection() as conn:
+            conn.execute('VACUUM')
+
+    if '--gc' in sys.argv:
+        removed = collect_garbage(pool)
+        print(f"🗑️ Удалено неиспользуемых файлов: {removed}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
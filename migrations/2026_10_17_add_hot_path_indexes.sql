@@ -0,0 +1,26 @@
+-- Миграция: Индексы для горячих запросов
+-- Дата: 2026-10-17
+
+-- referral_invites: get_task_statuses и подзапрос successful_invites в get_user_referral_info
+-- (inviter_id = ? AND status = 'joined')
+CREATE INDEX IF NOT EXISTS idx_referral_invites_inviter_status ON referral_invites(inviter_id, status);
+
+-- referral_invites: проверка повторного начисления в add_ticket_for_referral_start
+-- (inviter_id = ? AND invitee_id = ?), покрывающий
+CREATE INDEX IF NOT EXISTS idx_referral_invites_inviter_invitee ON referral_invites(inviter_id, invitee_id);
+
+-- referral_invites: поиск приглашения по приглашённому
+CREATE INDEX IF NOT EXISTS idx_referral_invites_invitee_id ON referral_invites(invitee_id);
+
+-- photo_uploads: список фото пользователя (user_id = ? ORDER BY upload_date DESC)
+-- и подзапрос photos_uploaded в get_user_stats
+CREATE INDEX IF NOT EXISTS idx_photo_uploads_user_date ON photo_uploads(user_id, upload_date);
+
+-- users: активные за 7 дней в get_global_stats (last_activity > ?)
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_activity);
+
+-- user_activity: история действий пользователя
+CREATE INDEX IF NOT EXISTS idx_user_activity_user_time ON user_activity(user_id, timestamp);
+
+-- giveaway_participants: task1_done в get_task_statuses (user_id = ?)
+CREATE INDEX IF NOT EXISTS idx_giveaway_participants_user_id ON giveaway_participants(user_id);
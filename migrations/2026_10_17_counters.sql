@@ -0,0 +1,116 @@
+-- Миграция: Счетчики для /api/stats, /api/tickets/total и get_global_stats (counters.py)
+-- Дата: 2026-10-17
+
+-- Значения поддерживаются триггерами при любой записи (бот, API, скрипты);
+-- reconcile_counters.py пересчитывает их с нуля и сообщает о расхождениях
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+-- users: всего, завершили гивевей, сумма referral_count
+CREATE TRIGGER IF NOT EXISTS trg_counters_users_insert AFTER INSERT ON users
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('users_total', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('users_giveaway_completed', NEW.giveaway_completed = 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + (NEW.giveaway_completed = 1);
+    INSERT INTO counters (name, value) VALUES ('referrals_total', COALESCE(NEW.referral_count, 0))
+        ON CONFLICT(name) DO UPDATE SET value = value + COALESCE(NEW.referral_count, 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_users_delete AFTER DELETE ON users
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'users_total';
+    UPDATE counters SET value = value - (OLD.giveaway_completed = 1) WHERE name = 'users_giveaway_completed';
+    UPDATE counters SET value = value - COALESCE(OLD.referral_count, 0) WHERE name = 'referrals_total';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_users_update AFTER UPDATE OF giveaway_completed, referral_count ON users
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('users_giveaway_completed', 0)
+        ON CONFLICT(name) DO UPDATE SET value = value + (NEW.giveaway_completed = 1) - (OLD.giveaway_completed = 1);
+    INSERT INTO counters (name, value) VALUES ('referrals_total', 0)
+        ON CONFLICT(name) DO UPDATE SET value = value + COALESCE(NEW.referral_count, 0) - COALESCE(OLD.referral_count, 0);
+END;
+
+-- photo_uploads: всего, по категориям и число пользователей с загрузками
+-- (проверка «первое/последнее фото пользователя» идет по индексу по user_id)
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_insert AFTER INSERT ON photo_uploads
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('photos_total', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('photos_category:' || NEW.category, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value)
+        SELECT 'photo_users', 1
+        WHERE NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = NEW.user_id AND rowid != NEW.rowid)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_delete AFTER DELETE ON photo_uploads
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_total';
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_category:' || OLD.category;
+    UPDATE counters SET value = value - 1
+        WHERE name = 'photo_users' AND NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = OLD.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_category AFTER UPDATE OF category ON photo_uploads
+    WHEN NEW.category IS NOT OLD.category
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_category:' || OLD.category;
+    INSERT INTO counters (name, value) VALUES ('photos_category:' || NEW.category, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_user AFTER UPDATE OF user_id ON photo_uploads
+    WHEN NEW.user_id IS NOT OLD.user_id
+BEGIN
+    UPDATE counters SET value = value - 1
+        WHERE name = 'photo_users' AND NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = OLD.user_id);
+    INSERT INTO counters (name, value)
+        SELECT 'photo_users', 1
+        WHERE NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = NEW.user_id AND rowid != NEW.rowid)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+-- Билеты: за подписку на все каналы и за рефералов
+CREATE TRIGGER IF NOT EXISTS trg_counters_tickets_subscription_insert AFTER INSERT ON tickets_subscription
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tickets_subscription', NEW.is_subscribed_all = 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + (NEW.is_subscribed_all = 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_tickets_subscription_delete AFTER DELETE ON tickets_subscription
+BEGIN
+    UPDATE counters SET value = value - (OLD.is_subscribed_all = 1) WHERE name = 'tickets_subscription';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_tickets_subscription_update AFTER UPDATE OF is_subscribed_all ON tickets_subscription
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tickets_subscription', 0)
+        ON CONFLICT(name) DO UPDATE SET value = value + (NEW.is_subscribed_all = 1) - (OLD.is_subscribed_all = 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_tickets_referral_insert AFTER INSERT ON tickets_referral
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tickets_referral', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_tickets_referral_delete AFTER DELETE ON tickets_referral
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'tickets_referral';
+END;
+
+-- Начальные значения по текущим данным
+INSERT OR REPLACE INTO counters (name, value) SELECT 'users_total', COUNT(*) FROM users;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'users_giveaway_completed', COUNT(*) FROM users WHERE giveaway_completed = 1;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'referrals_total', COALESCE(SUM(referral_count), 0) FROM users;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'photos_total', COUNT(*) FROM photo_uploads;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'photo_users', COUNT(DISTINCT user_id) FROM photo_uploads;
+INSERT OR REPLACE INTO counters (name, value)
+    SELECT 'photos_category:' || category, COUNT(*) FROM photo_uploads GROUP BY category;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'tickets_subscription', COUNT(*) FROM tickets_subscription WHERE is_subscribed_all = 1;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'tickets_referral', COUNT(*) FROM tickets_referral;
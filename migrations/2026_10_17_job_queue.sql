@@ -0,0 +1,26 @@
+-- Миграция: Очередь фоновых задач (job_queue.py)
+-- Дата: 2026-10-17
+
+-- status: queued / running / done / failed; run_at и locked_until — unix-время
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT,
+    payload TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Не больше одной ожидающей задачи на ключ (например, проверка подписки одного user_id)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_queued_dedupe ON jobs(kind, dedupe_key)
+    WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+
+-- Выбор следующей задачи к выполнению и подсчет глубины очереди
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at);
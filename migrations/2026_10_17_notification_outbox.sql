@@ -0,0 +1,18 @@
+-- Миграция: Outbox уведомлений в служебный чат (outbox_dispatcher.py)
+-- Дата: 2026-10-17
+
+-- Строка пишется в той же транзакции, что и изменение состояния;
+-- kind — имя метода TelegramLogger без префикса log_, payload — его аргументы (JSON)
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP
+);
+
+-- Выбор недоставленных уведомлений по порядку (индекс содержит только их)
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox(id)
+    WHERE delivered_at IS NULL;
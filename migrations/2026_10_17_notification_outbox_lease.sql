@@ -0,0 +1,6 @@
+-- Миграция: Аренда пачки уведомлений диспетчером outbox (outbox_dispatcher.py)
+-- Дата: 2026-10-17
+
+-- Unix-время, до которого строку передает захвативший ее диспетчер;
+-- захват и отметка доставки идут короткими транзакциями, передача — вне транзакции
+ALTER TABLE notification_outbox ADD COLUMN claimed_until REAL;
@@ -0,0 +1,8 @@
+-- Миграция: Вынос содержимого фото из SQLite в файловое хранилище
+-- Дата: 2026-10-17
+
+-- SHA-256 содержимого в blob_store; file_data для новых загрузок больше не заполняется,
+-- старые записи переносятся скриптом migrate_photo_blobs.py
+ALTER TABLE photo_uploads ADD COLUMN blob_sha256 TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_photo_uploads_blob_sha256 ON photo_uploads(blob_sha256);
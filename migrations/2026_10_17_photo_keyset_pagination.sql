@@ -0,0 +1,12 @@
+-- Миграция: Индексы для постраничной выдачи /api/user-photos
+-- Дата: 2026-10-17
+
+-- Курсор (upload_date, id): страница читается из индекса без сортировки,
+-- id делает порядок однозначным при одинаковой upload_date.
+-- Заменяет idx_photo_uploads_user_date (его префикс), подзапрос photos_uploaded использует новый индекс
+CREATE INDEX IF NOT EXISTS idx_photo_uploads_user_date_id ON photo_uploads(user_id, upload_date, id);
+
+-- То же с фильтром по категории
+CREATE INDEX IF NOT EXISTS idx_photo_uploads_user_category_date_id ON photo_uploads(user_id, category, upload_date, id);
+
+DROP INDEX IF EXISTS idx_photo_uploads_user_date;
@@ -0,0 +1,7 @@
+-- Миграция: Миниатюры и размытая заглушка для загруженных фото
+-- Дата: 2026-10-17
+
+-- pending / ready / failed / unsupported; NULL — превью еще не ставились в очередь
+ALTER TABLE photo_uploads ADD COLUMN thumbnail_status TEXT;
+-- Крошечная размытая JPEG-заглушка в виде data URL
+ALTER TABLE photo_uploads ADD COLUMN placeholder TEXT;
@@ -0,0 +1,24 @@
+-- Миграция: Одно начисление за приглашение (inviter_id, invitee_id)
+-- Дата: 2026-10-17
+
+-- Удаляем дубли, появившиеся из-за гонок (оставляем самую раннюю запись)
+DELETE FROM referral_invites
+WHERE invitee_id IS NOT NULL
+  AND id NOT IN (
+      SELECT MIN(id) FROM referral_invites
+      WHERE invitee_id IS NOT NULL
+      GROUP BY inviter_id, invitee_id
+  );
+
+-- Пересчитываем счетчик приглашений: каждое начисление сопровождалось записью в referral_invites
+UPDATE users
+SET referral_count = (
+    SELECT COUNT(*) FROM referral_invites
+    WHERE referral_invites.inviter_id = users.user_id AND referral_invites.invitee_id IS NOT NULL
+)
+WHERE referral_count > 0;
+
+-- Прежний неуникальный индекс заменяется уникальным с тем же именем;
+-- на него опирается INSERT ... ON CONFLICT в add_ticket_for_referral_start и _process_referral
+DROP INDEX IF EXISTS idx_referral_invites_inviter_invitee;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_referral_invites_inviter_invitee ON referral_invites(inviter_id, invitee_id);
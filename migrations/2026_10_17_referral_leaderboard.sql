@@ -0,0 +1,59 @@
+-- Миграция: Таблица рейтинга пригласивших (leaderboard.py)
+-- Дата: 2026-10-17
+
+-- Копия referral_count / total_referral_xp, которую поддерживают триггеры на users.
+-- seq растет при каждом изменении: процессы догружают в память только изменившиеся строки
+CREATE TABLE IF NOT EXISTS leaderboard (
+    user_id INTEGER PRIMARY KEY,
+    referral_count INTEGER NOT NULL DEFAULT 0,
+    total_referral_xp INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+
+-- Выборка изменений после известного seq (порядок рейтинга строится в памяти)
+CREATE INDEX IF NOT EXISTS idx_leaderboard_seq ON leaderboard(seq);
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_users_insert AFTER INSERT ON users
+    WHEN COALESCE(NEW.referral_count, 0) > 0
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('leaderboard_seq', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO leaderboard (user_id, referral_count, total_referral_xp, seq)
+        VALUES (NEW.user_id, COALESCE(NEW.referral_count, 0), COALESCE(NEW.total_referral_xp, 0),
+                (SELECT value FROM counters WHERE name = 'leaderboard_seq'))
+        ON CONFLICT(user_id) DO UPDATE SET
+            referral_count = excluded.referral_count,
+            total_referral_xp = excluded.total_referral_xp,
+            seq = excluded.seq;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_users_update AFTER UPDATE OF referral_count, total_referral_xp ON users
+    WHEN NEW.referral_count IS NOT OLD.referral_count OR NEW.total_referral_xp IS NOT OLD.total_referral_xp
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('leaderboard_seq', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO leaderboard (user_id, referral_count, total_referral_xp, seq)
+        VALUES (NEW.user_id, COALESCE(NEW.referral_count, 0), COALESCE(NEW.total_referral_xp, 0),
+                (SELECT value FROM counters WHERE name = 'leaderboard_seq'))
+        ON CONFLICT(user_id) DO UPDATE SET
+            referral_count = excluded.referral_count,
+            total_referral_xp = excluded.total_referral_xp,
+            seq = excluded.seq;
+END;
+
+-- Удаленный пользователь остается строкой с нулями, чтобы процессы увидели удаление
+CREATE TRIGGER IF NOT EXISTS trg_leaderboard_users_delete AFTER DELETE ON users
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('leaderboard_seq', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    UPDATE leaderboard
+    SET referral_count = 0, total_referral_xp = 0,
+        seq = (SELECT value FROM counters WHERE name = 'leaderboard_seq')
+    WHERE user_id = OLD.user_id;
+END;
+
+INSERT OR IGNORE INTO counters (name, value) VALUES ('leaderboard_seq', 0);
+INSERT OR REPLACE INTO leaderboard (user_id, referral_count, total_referral_xp, seq)
+    SELECT user_id, COALESCE(referral_count, 0), COALESCE(total_referral_xp, 0), 0
+    FROM users
+    WHERE referral_count > 0;
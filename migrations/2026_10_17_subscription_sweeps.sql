@@ -0,0 +1,19 @@
+-- Миграция: Массовая перепроверка подписок (reverify_subscriptions.py)
+-- Дата: 2026-10-17
+
+-- Когда подписка пользователя последний раз подтверждалась через Bot API
+ALTER TABLE tickets_subscription ADD COLUMN verified_at TIMESTAMP;
+
+-- Прогресс перепроверок: позволяет продолжить с последнего обработанного user_id
+CREATE TABLE IF NOT EXISTS subscription_sweeps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    holders_only BOOLEAN NOT NULL DEFAULT FALSE,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    checked INTEGER NOT NULL DEFAULT 0,
+    changed INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
@@ -0,0 +1,128 @@
+-- Миграция: Сводка по пользователю для экранов и API (user_summary.py)
+-- Дата: 2026-10-17
+
+-- Производные значения, которые раньше считались COUNT-подзапросами при каждом чтении.
+-- Поддерживаются триггерами в той же транзакции, что и запись (бот, API, скрипты);
+-- rebuild_user_summary.py пересчитывает таблицу с нуля и сообщает о расхождениях
+CREATE TABLE IF NOT EXISTS user_summary (
+    user_id INTEGER PRIMARY KEY,
+    photos_uploaded INTEGER NOT NULL DEFAULT 0,
+    successful_invites INTEGER NOT NULL DEFAULT 0,  -- referral_invites со status = 'joined'
+    folder_entries INTEGER NOT NULL DEFAULT 0,      -- строки giveaway_participants (task1_done)
+    referral_tickets INTEGER NOT NULL DEFAULT 0,    -- строки tickets_referral
+    subscribed INTEGER NOT NULL DEFAULT 0           -- tickets_subscription.is_subscribed_all
+);
+
+-- users: строка сводки появляется вместе с пользователем
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_users_insert AFTER INSERT ON users
+BEGIN
+    INSERT INTO user_summary (user_id) VALUES (NEW.user_id)
+        ON CONFLICT(user_id) DO NOTHING;
+END;
+
+-- photo_uploads: user_id хранится текстом; учитываются только записи, где он совпадает
+-- с CAST(users.user_id AS TEXT), как в прежнем подзапросе get_user_stats
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_photos_insert AFTER INSERT ON photo_uploads
+    WHEN CAST(CAST(NEW.user_id AS INTEGER) AS TEXT) = NEW.user_id
+BEGIN
+    INSERT INTO user_summary (user_id, photos_uploaded) VALUES (CAST(NEW.user_id AS INTEGER), 1)
+        ON CONFLICT(user_id) DO UPDATE SET photos_uploaded = photos_uploaded + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_photos_delete AFTER DELETE ON photo_uploads
+    WHEN CAST(CAST(OLD.user_id AS INTEGER) AS TEXT) = OLD.user_id
+BEGIN
+    UPDATE user_summary SET photos_uploaded = photos_uploaded - 1 WHERE user_id = CAST(OLD.user_id AS INTEGER);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_photos_user AFTER UPDATE OF user_id ON photo_uploads
+    WHEN NEW.user_id IS NOT OLD.user_id
+BEGIN
+    UPDATE user_summary SET photos_uploaded = photos_uploaded - 1
+        WHERE user_id = CAST(OLD.user_id AS INTEGER) AND CAST(CAST(OLD.user_id AS INTEGER) AS TEXT) = OLD.user_id;
+    INSERT INTO user_summary (user_id, photos_uploaded)
+        SELECT CAST(NEW.user_id AS INTEGER), 1
+        WHERE CAST(CAST(NEW.user_id AS INTEGER) AS TEXT) = NEW.user_id
+        ON CONFLICT(user_id) DO UPDATE SET photos_uploaded = photos_uploaded + 1;
+END;
+
+-- referral_invites: успешные приглашения пригласившего (task2_done)
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_invites_insert AFTER INSERT ON referral_invites
+    WHEN NEW.status = 'joined'
+BEGIN
+    INSERT INTO user_summary (user_id, successful_invites) VALUES (NEW.inviter_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET successful_invites = successful_invites + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_invites_delete AFTER DELETE ON referral_invites
+    WHEN OLD.status = 'joined'
+BEGIN
+    UPDATE user_summary SET successful_invites = successful_invites - 1 WHERE user_id = OLD.inviter_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_invites_update AFTER UPDATE OF status, inviter_id ON referral_invites
+    WHEN (OLD.status = 'joined') != (NEW.status = 'joined') OR NEW.inviter_id IS NOT OLD.inviter_id
+BEGIN
+    UPDATE user_summary SET successful_invites = successful_invites - 1
+        WHERE user_id = OLD.inviter_id AND OLD.status = 'joined';
+    INSERT INTO user_summary (user_id, successful_invites)
+        SELECT NEW.inviter_id, 1 WHERE NEW.status = 'joined'
+        ON CONFLICT(user_id) DO UPDATE SET successful_invites = successful_invites + 1;
+END;
+
+-- giveaway_participants: подписка на папку (task1_done)
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_participants_insert AFTER INSERT ON giveaway_participants
+BEGIN
+    INSERT INTO user_summary (user_id, folder_entries) VALUES (NEW.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET folder_entries = folder_entries + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_participants_delete AFTER DELETE ON giveaway_participants
+BEGIN
+    UPDATE user_summary SET folder_entries = folder_entries - 1 WHERE user_id = OLD.user_id;
+END;
+
+-- tickets_referral: билеты за рефералов
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_tickets_referral_insert AFTER INSERT ON tickets_referral
+BEGIN
+    INSERT INTO user_summary (user_id, referral_tickets) VALUES (NEW.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET referral_tickets = referral_tickets + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_tickets_referral_delete AFTER DELETE ON tickets_referral
+BEGIN
+    UPDATE user_summary SET referral_tickets = referral_tickets - 1 WHERE user_id = OLD.user_id;
+END;
+
+-- tickets_subscription: билет за подписку на все каналы
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_subscription_insert AFTER INSERT ON tickets_subscription
+BEGIN
+    INSERT INTO user_summary (user_id, subscribed) VALUES (NEW.user_id, NEW.is_subscribed_all = 1)
+        ON CONFLICT(user_id) DO UPDATE SET subscribed = excluded.subscribed;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_subscription_update AFTER UPDATE OF is_subscribed_all ON tickets_subscription
+BEGIN
+    INSERT INTO user_summary (user_id, subscribed) VALUES (NEW.user_id, NEW.is_subscribed_all = 1)
+        ON CONFLICT(user_id) DO UPDATE SET subscribed = excluded.subscribed;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_user_summary_subscription_delete AFTER DELETE ON tickets_subscription
+BEGIN
+    UPDATE user_summary SET subscribed = 0 WHERE user_id = OLD.user_id;
+END;
+
+-- Начальное заполнение (повторно — rebuild_user_summary.py)
+INSERT OR IGNORE INTO user_summary (user_id)
+    SELECT user_id FROM users
+    UNION SELECT inviter_id FROM referral_invites WHERE status = 'joined'
+    UNION SELECT user_id FROM giveaway_participants
+    UNION SELECT user_id FROM tickets_referral
+    UNION SELECT user_id FROM tickets_subscription
+    UNION SELECT CAST(user_id AS INTEGER) FROM photo_uploads WHERE CAST(CAST(user_id AS INTEGER) AS TEXT) = user_id;
+UPDATE user_summary SET
+    photos_uploaded = (SELECT COUNT(*) FROM photo_uploads WHERE user_id = CAST(user_summary.user_id AS TEXT)),
+    successful_invites = (SELECT COUNT(*) FROM referral_invites WHERE inviter_id = user_summary.user_id AND status = 'joined'),
+    folder_entries = (SELECT COUNT(*) FROM giveaway_participants WHERE user_id = user_summary.user_id),
+    referral_tickets = (SELECT COUNT(*) FROM tickets_referral WHERE user_id = user_summary.user_id),
+    subscribed = COALESCE((SELECT is_subscribed_all = 1 FROM tickets_subscription WHERE user_id = user_summary.user_id), 0);
@@ -0,0 +1,56 @@
+-- Миграция: Счетчики фото для /api/stats в базе фото (fsr.db, counters.py)
+-- Дата: 2026-10-17
+
+-- Часть 2026_10_17_counters.sql, относящаяся только к photo_uploads: в базе фото
+-- нет таблиц бота, поэтому общая миграция к ней не применяется
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+-- photo_uploads: всего, по категориям и число пользователей с загрузками
+-- (проверка «первое/последнее фото пользователя» идет по индексу по user_id)
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_insert AFTER INSERT ON photo_uploads
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('photos_total', 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('photos_category:' || NEW.category, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value)
+        SELECT 'photo_users', 1
+        WHERE NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = NEW.user_id AND rowid != NEW.rowid)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_delete AFTER DELETE ON photo_uploads
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_total';
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_category:' || OLD.category;
+    UPDATE counters SET value = value - 1
+        WHERE name = 'photo_users' AND NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = OLD.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_category AFTER UPDATE OF category ON photo_uploads
+    WHEN NEW.category IS NOT OLD.category
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'photos_category:' || OLD.category;
+    INSERT INTO counters (name, value) VALUES ('photos_category:' || NEW.category, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_counters_photos_user AFTER UPDATE OF user_id ON photo_uploads
+    WHEN NEW.user_id IS NOT OLD.user_id
+BEGIN
+    UPDATE counters SET value = value - 1
+        WHERE name = 'photo_users' AND NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = OLD.user_id);
+    INSERT INTO counters (name, value)
+        SELECT 'photo_users', 1
+        WHERE NOT EXISTS (SELECT 1 FROM photo_uploads WHERE user_id = NEW.user_id AND rowid != NEW.rowid)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+-- Начальные значения по текущим данным
+INSERT OR REPLACE INTO counters (name, value) SELECT 'photos_total', COUNT(*) FROM photo_uploads;
+INSERT OR REPLACE INTO counters (name, value) SELECT 'photo_users', COUNT(DISTINCT user_id) FROM photo_uploads;
+INSERT OR REPLACE INTO counters (name, value)
+    SELECT 'photos_category:' || category, COUNT(*) FROM photo_uploads GROUP BY category;
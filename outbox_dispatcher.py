@@ -0,0 +1,208 @@
+"""
+Доставка уведомлений из outbox (таблица notification_outbox) в служебный чат.
+
+Database пишет строку outbox в той же транзакции, что и изменение состояния
+(приглашение друга, выполнение задания и т.д.), из любого процесса — бота,
+API или скрипта. Диспетчер работает в процессе бота: короткой транзакцией
+захватывает пачку недоставленных строк (аренда claimed_until), без открытой
+транзакции передает их TelegramLogger (журнал на диске, дальше логгер
+доставляет сам) и второй короткой транзакцией отмечает доставленными только
+переданные строки. Захваченную строку другие диспетчеры не берут, пока не
+истечет аренда; повтор возможен только если процесс упал между записью в
+журнал логгера и отметкой доставки.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETENTION_HOURS,
+)
+
+
+class OutboxDispatcher:
+    # Как часто удаляются старые доставленные строки
+    PURGE_INTERVAL = 3600.0
+    # Сколько поток ждет передачи пачки логгеру
+    HAND_OFF_TIMEOUT = 30.0
+    # Аренда захваченной пачки: дольше двух ожиданий передачи, чтобы строки не взял другой диспетчер
+    CLAIM_SECONDS = 120.0
+
+    def __init__(self, db, telegram_logger, batch_size: int = OUTBOX_BATCH_SIZE,
+                 interval: float = OUTBOX_POLL_INTERVAL, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.db = db
+        self.telegram_logger = telegram_logger
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._task = None
+        self._stop = None
+        self._last_purge = 0.0
+        self._stats = {'delivered': 0, 'errors': 0, 'dead': 0, 'batches': 0}
+
+    def start(self):
+        """Запуск диспетчера (вызывать внутри работающего loop)"""
+        if self._task is None or self._task.done():
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка после текущей пачки"""
+        if self._task is None:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set():
+            try:
+                handled = await loop.run_in_executor(None, self.dispatch_batch, loop)
+                if time.time() - self._last_purge > self.PURGE_INTERVAL:
+                    self._last_purge = time.time()
+                    await loop.run_in_executor(None, self.purge)
+            except Exception as e:
+                print(f"Error dispatching outbox: {e}")
+                handled = 0
+            if handled >= self.batch_size:
+                # Очередь не пуста — следующая пачка сразу
+                continue
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _hand_off(self, rows: List[Tuple[int, str, str]], results: Dict[int, Optional[str]],
+                        stop: threading.Event):
+        """Передача пачки логгеру; в results пишется id -> текст ошибки (None — передано)"""
+        for outbox_id, kind, payload in rows:
+            # Диспетчер перестал ждать: оставшиеся строки вернутся в очередь
+            if stop.is_set():
+                break
+            method = getattr(self.telegram_logger, f'log_{kind}', None)
+            if method is None:
+                results[outbox_id] = f"Unknown notification kind: {kind}"
+                continue
+            try:
+                await method(**json.loads(payload))
+                results[outbox_id] = None
+            except Exception as e:
+                results[outbox_id] = str(e)
+
+    def _claim(self) -> List[Tuple[int, str, str, int]]:
+        """Захват пачки недоставленных строк, не арендованных другим диспетчером"""
+        now = time.time()
+        with self.db.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute('''
+                    SELECT id, kind, payload, attempts FROM notification_outbox
+                    WHERE delivered_at IS NULL AND (claimed_until IS NULL OR claimed_until < ?)
+                    ORDER BY id
+                    LIMIT ?
+                ''', (now, self.batch_size)).fetchall()
+                if not rows:
+                    conn.rollback()
+                    return []
+                conn.executemany('''
+                    UPDATE notification_outbox SET claimed_until = ? WHERE id = ?
+                ''', [(now + self.CLAIM_SECONDS, row[0]) for row in rows])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return rows
+
+    def dispatch_batch(self, loop: asyncio.AbstractEventLoop) -> int:
+        """Одна пачка (выполняется в потоке, передача — в loop логгера); возвращает число строк"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        # Передача идет без открытой транзакции: бот и API в это время пишут в базу
+        results: Dict[int, Optional[str]] = {}
+        stop = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._hand_off([row[:3] for row in rows], results, stop), loop
+        )
+        try:
+            future.result(timeout=self.HAND_OFF_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Останавливаем передачу после текущей строки и дожидаемся ее
+            stop.set()
+            try:
+                future.result(timeout=self.HAND_OFF_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                print(f"Outbox hand-off did not stop in {self.HAND_OFF_TIMEOUT}s, "
+                      f"unconfirmed rows stay claimed until the lease expires")
+        results = dict(results)
+
+        with self.db.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for outbox_id, kind, _, attempts in rows:
+                    if outbox_id not in results:
+                        # Строку не передавали — сразу возвращаем в очередь
+                        # (если передача не остановилась, строка ждет истечения аренды)
+                        if future.done():
+                            conn.execute('''
+                                UPDATE notification_outbox SET claimed_until = NULL WHERE id = ?
+                            ''', (outbox_id,))
+                        continue
+                    error = results[outbox_id]
+                    if error is None:
+                        conn.execute('''
+                            UPDATE notification_outbox
+                            SET delivered_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL,
+                                claimed_until = NULL
+                            WHERE id = ?
+                        ''', (outbox_id,))
+                        self._stats['delivered'] += 1
+                        continue
+                    print(f"Error delivering outbox notification {outbox_id} ({kind}): {error}")
+                    self._stats['errors'] += 1
+                    dead = attempts + 1 >= self.max_attempts
+                    if dead:
+                        self._stats['dead'] += 1
+                    # После max_attempts строка закрывается с ошибкой, чтобы не блокировать очередь
+                    conn.execute('''
+                        UPDATE notification_outbox
+                        SET attempts = attempts + 1, last_error = ?, claimed_until = NULL,
+                            delivered_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE NULL END
+                        WHERE id = ?
+                    ''', (error, dead, outbox_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self._stats['batches'] += 1
+        return len(rows)
+
+    def purge(self, retention_hours: float = OUTBOX_RETENTION_HOURS) -> int:
+        """Удаление доставленных строк старше retention_hours"""
+        with self.db.pool.connection() as conn:
+            cursor = conn.execute('''
+                DELETE FROM notification_outbox
+                WHERE delivered_at IS NOT NULL AND delivered_at < datetime('now', ?)
+            ''', (f'-{retention_hours} hours',))
+            conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики диспетчера и число недоставленных строк"""
+        with self.db.pool.connection() as conn:
+            pending, oldest = conn.execute('''
+                SELECT COUNT(*), MIN(created_at) FROM notification_outbox WHERE delivered_at IS NULL
+            ''').fetchone()
+        stats = dict(self._stats)
+        stats['pending'] = pending
+        stats['oldest_pending'] = oldest
+        return stats
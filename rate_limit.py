@@ -0,0 +1,50 @@
+"""
+Ограничение частоты запросов к Bot API (token bucket для asyncio).
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Не больше rate запросов в секунду в среднем, кратковременно — до capacity подряд.
+    pause() останавливает всех ожидающих, когда Telegram ответил retry_after.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ожидание, пока в ведре не наберется tokens"""
+        if self._lock is None:
+            # Lock создается в том loop, где используется ведро
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Остановка выдачи на seconds (ответ 429 с retry_after); ведро после паузы пустое"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
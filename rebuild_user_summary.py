@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Пересчет таблицы user_summary с нуля (заполнение или починка сводки по пользователям)
+Показывает расходящиеся строки и исправляет их; с --dry-run только показывает.
+Код выхода 1, если были расхождения.
+
+Использование: python3 rebuild_user_summary.py [путь_к_бд] [--dry-run]
+"""
+
+import sys
+
+import user_summary
+from config import DATABASE_PATH
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else DATABASE_PATH
+    dry_run = '--dry-run' in sys.argv
+
+    from database import Database
+    db = Database(db_path)
+
+    print(f"🔍 Сверка user_summary в {db_path}{' (без исправления)' if dry_run else ''}\n")
+    drift = user_summary.rebuild(db.pool, fix=not dry_run)
+
+    if not drift:
+        print("✅ Расхождений нет")
+        return
+    for user_id, (stored, actual) in sorted(drift.items())[:50]:
+        changes = ', '.join(
+            f"{column} {old}→{new}"
+            for column, old, new in zip(user_summary.COLUMNS, stored, actual) if old != new
+        )
+        print(f"⚠️ {user_id}: {changes}")
+    if len(drift) > 50:
+        print(f"   ... и еще {len(drift) - 50}")
+    print(f"\n📊 Расходящихся строк: {len(drift)}" + ("" if dry_run else " — исправлены"))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Сверка таблицы counters с данными (пересчет с нуля)
+Показывает расхождения и исправляет их; с --dry-run только показывает.
+С --photos сверяет только счетчики фото в базе фото (fsr.db).
+Код выхода 1, если были расхождения.
+
+Использование: python3 reconcile_counters.py [путь_к_бд] [--dry-run] [--photos]
+"""
+
+import sys
+
+import counters
+from config import DATABASE_PATH
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else DATABASE_PATH
+    dry_run = '--dry-run' in sys.argv
+
+    if '--photos' in sys.argv:
+        # База фото: без таблиц бота, схему приводим только миграциями фото
+        from database import apply_photo_migrations
+        from db_pool import get_pool
+        pool = get_pool(db_path)
+        apply_photo_migrations(pool)
+        queries = counters.PHOTO_COUNTER_QUERIES
+    else:
+        from database import Database
+        pool = Database(db_path).pool
+        queries = counters.COUNTER_QUERIES
+
+    print(f"🔍 Сверка счетчиков в {db_path}{' (без исправления)' if dry_run else ''}\n")
+    drift = counters.reconcile(pool, fix=not dry_run, queries=queries)
+
+    if not drift:
+        print("✅ Расхождений нет")
+        return
+    for name, (stored, actual) in sorted(drift.items()):
+        print(f"⚠️ {name}: сохранено {stored}, на самом деле {actual} ({actual - stored:+d})")
+    print(f"\n📊 Расхождений: {len(drift)}" + ("" if dry_run else " — исправлены"))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Кэш готовых ответов API для часто опрашиваемых маршрутов (призы, статистика,
+сумма билетов, реферальная информация).
+
+Запись живет TTL маршрута и помечена тегами ('prizes', 'stats', 'tickets',
+'referral:<user_id>'). Методы Database и обработчики API, меняющие эти данные,
+вызывают invalidate() с нужными тегами после фиксации транзакции, так что
+запись в этом процессе видна сразу; изменения из других процессов (бот,
+скрипты) — не позже чем через TTL. Пока один поток пересчитывает ответ,
+остальные запросы того же ключа ждут его результат, а не считают заново.
+Размер ограничен числом записей, при переполнении вытесняются давно не
+использованные (LRU).
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from config import RESPONSE_CACHE_MAX_ENTRIES
+
+
+class CachedResponse:
+    __slots__ = ('body', 'mimetype', 'etag', 'expires_at', 'tags')
+
+    def __init__(self, body: bytes, mimetype: str, ttl: float, tags: Tuple[str, ...]):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.expires_at = time.monotonic() + ttl
+        self.tags = tags
+
+    def max_age(self) -> int:
+        """Сколько секунд ответ еще свежий (для Cache-Control)"""
+        return max(math.ceil(self.expires_at - time.monotonic()), 0)
+
+
+class ResponseCache:
+    # Сколько ждущий запрос ждет чужой пересчет, прежде чем посчитать сам
+    WAIT_TIMEOUT = 10.0
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        # Ключ -> событие завершения пересчета, который сейчас идет
+        self._inflight: Dict[str, threading.Event] = {}
+        # Растет при каждом invalidate(): пересчет, начатый до сброса, не сохраняется
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    def _lookup(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self._stats['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_compute(self, key: str, ttl: float, tags: Iterable[str],
+                       compute: Callable[[], Optional[Tuple[bytes, str]]]) -> Optional[CachedResponse]:
+        """
+        Ответ из кэша или результат compute() (один пересчет на ключ одновременно).
+        compute возвращает (тело, mimetype) или None, если ответ кэшировать нельзя
+        (ошибка) — тогда и здесь возвращается None.
+        """
+        tags = tuple(tags)
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._stats['hits'] += 1
+                    return entry
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    generation = self._generation
+                    self._stats['misses'] += 1
+                    break
+                self._stats['waits'] += 1
+            # Ответ уже считает другой поток: ждем и читаем его из кэша
+            if not event.wait(self.WAIT_TIMEOUT):
+                result = compute()
+                return CachedResponse(result[0], result[1], ttl, tags) if result else None
+
+        try:
+            result = compute()
+            if result is None:
+                return None
+            entry = CachedResponse(result[0], result[1], ttl, tags)
+            with self._lock:
+                # Данные изменились, пока считали ответ: отдаем его, но не сохраняем
+                if ttl > 0 and generation == self._generation:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._stats['evicted'] += 1
+            return entry
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, *tags: str) -> int:
+        """Удаление записей с любым из тегов; возвращает число удаленных"""
+        tags = set(tags)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if tags.intersection(entry.tags)]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidated'] += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidated'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кэша для мониторинга"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+def referral_tag(user_id) -> str:
+    """Тег ответов /api/referral/<user_id> (одинаковый для '42' из URL и 42 из Database)"""
+    try:
+        return f'referral:{int(user_id)}'
+    except (TypeError, ValueError):
+        return f'referral:{user_id}'
+
+
+# Общий кэш процесса: маршруты api_server.py читают его, Database и API-обработчики сбрасывают
+response_cache = ResponseCache()
+
+
+def invalidate(*tags: str) -> int:
+    """Сброс ответов с указанными тегами (вызывать после фиксации транзакции)"""
+    return response_cache.invalidate(*tags)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Массовая перепроверка подписок перед розыгрышем
+Обходит tickets_subscription пачками по user_id, проверяет подписку через Bot API
+(параллельно, с ограничением частоты) и записывает результаты пачкой в одной транзакции.
+Прогресс хранится в subscription_sweeps: прерванная перепроверка продолжается с места остановки.
+
+Использование: python3 reverify_subscriptions.py [путь_к_бд] [--holders-only] [--restart]
+               [--chunk=200] [--rate=20] [--concurrency=8]
+"""
+
+import json
+import sys
+import time
+
+from config import DATABASE_PATH, SWEEP_CHUNK_SIZE, SWEEP_CONCURRENCY, SWEEP_RATE_LIMIT
+from rate_limit import TokenBucket
+from subscription_checker import SubscriptionChecker
+
+
+def get_option(name, default, cast):
+    prefix = f'--{name}='
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return cast(arg[len(prefix):])
+    return default
+
+
+def start_sweep(conn, holders_only, restart):
+    """Незавершенная перепроверка (для продолжения) или новая; возвращает строку subscription_sweeps"""
+    if not restart:
+        row = conn.execute('''
+            SELECT id, holders_only, last_user_id, total, checked, changed, errors
+            FROM subscription_sweeps
+            WHERE finished_at IS NULL AND holders_only = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (holders_only,)).fetchone()
+        if row:
+            return row
+
+    where = 'WHERE is_subscribed_all = 1' if holders_only else ''
+    total = conn.execute(f'SELECT COUNT(*) FROM tickets_subscription {where}').fetchone()[0]
+    cursor = conn.execute('''
+        INSERT INTO subscription_sweeps (holders_only, total) VALUES (?, ?)
+    ''', (holders_only, total))
+    conn.commit()
+    return cursor.lastrowid, holders_only, 0, total, 0, 0, 0
+
+
+def fetch_chunk(conn, last_user_id, holders_only, chunk_size):
+    """Следующая пачка (user_id, is_subscribed_all) после last_user_id"""
+    holders_filter = 'AND is_subscribed_all = 1' if holders_only else ''
+    cursor = conn.execute(f'''
+        SELECT user_id, is_subscribed_all FROM tickets_subscription
+        WHERE user_id > ? {holders_filter}
+        ORDER BY user_id
+        LIMIT ?
+    ''', (last_user_id, chunk_size))
+    return cursor.fetchall()
+
+
+def save_chunk(conn, sweep_id, last_user_id, updates, checked, changed, errors):
+    """Результаты пачки и прогресс — в одной транзакции, чтобы продолжение было точным"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('''
+            UPDATE tickets_subscription
+            SET is_subscribed_all = ?, verified_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', updates)
+        conn.execute('''
+            UPDATE subscription_sweeps
+            SET last_user_id = ?, checked = checked + ?, changed = changed + ?, errors = errors + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (last_user_id, checked, changed, errors, sweep_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def reverify(db, checker, holders_only=False, restart=False, chunk_size=SWEEP_CHUNK_SIZE):
+    """Перепроверка; возвращает итоговые счетчики"""
+    with db.pool.connection() as conn:
+        sweep_id, _, last_user_id, total, checked, changed, errors = start_sweep(conn, holders_only, restart)
+    if checked:
+        print(f"↩️ Продолжаем перепроверку #{sweep_id} с user_id > {last_user_id} ({checked}/{total})")
+    else:
+        print(f"🔄 Перепроверка #{sweep_id}: пользователей {total}")
+
+    started = time.monotonic()
+    done_now = 0
+    # Запас по времени на пачку: все запросы по лимиту частоты плюс таймаут на хвост
+    chunk_timeout = chunk_size * len(checker.channel_ids) / checker.rate_limiter.rate + checker.timeout * 3
+
+    while True:
+        with db.pool.connection() as conn:
+            rows = fetch_chunk(conn, last_user_id, holders_only, chunk_size)
+        if not rows:
+            break
+
+        user_ids = [row[0] for row in rows]
+        results = checker.run(checker.check_users_async(user_ids, use_cache=False), timeout=chunk_timeout)
+
+        updates = []
+        chunk_changed = 0
+        chunk_errors = 0
+        for (user_id, was_subscribed), result in zip(rows, results):
+            if any(channel.get('error') for channel in result['channels']):
+                # Ошибка Bot API — статус не трогаем, чтобы не отнять билет по ошибке
+                chunk_errors += 1
+                continue
+            if bool(was_subscribed) != result['subscribed']:
+                chunk_changed += 1
+            updates.append((result['subscribed'], user_id))
+
+        last_user_id = user_ids[-1]
+        with db.pool.connection() as conn:
+            save_chunk(conn, sweep_id, last_user_id, updates, len(rows), chunk_changed, chunk_errors)
+
+        checked += len(rows)
+        changed += chunk_changed
+        errors += chunk_errors
+        done_now += len(rows)
+        elapsed = time.monotonic() - started
+        throughput = done_now / elapsed if elapsed else 0.0
+        eta = (total - checked) / throughput if throughput else 0.0
+        print(f"📊 {checked}/{total} | изменено {changed} | ошибок {errors} | "
+              f"{throughput:.1f} польз/с | осталось ~{eta:.0f} с")
+
+    with db.pool.connection() as conn:
+        conn.execute('''
+            UPDATE subscription_sweeps SET finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (sweep_id,))
+        conn.commit()
+    return {'sweep_id': sweep_id, 'total': total, 'checked': checked, 'changed': changed, 'errors': errors}
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else DATABASE_PATH
+    holders_only = '--holders-only' in sys.argv
+    restart = '--restart' in sys.argv
+    chunk_size = get_option('chunk', SWEEP_CHUNK_SIZE, int)
+    rate = get_option('rate', SWEEP_RATE_LIMIT, float)
+    concurrency = get_option('concurrency', SWEEP_CONCURRENCY, int)
+
+    from database import Database
+    db = Database(db_path)
+
+    with open('channels.json', 'r') as f:
+        channel_ids = json.load(f)['channels']
+    checker = SubscriptionChecker(channel_ids, concurrency=concurrency, rate_limiter=TokenBucket(rate))
+
+    print(f"🔍 Перепроверка подписок в {db_path}: каналов {len(channel_ids)}, "
+          f"пачка {chunk_size}, {rate:g} запросов/с, параллельно {concurrency}")
+    try:
+        summary = reverify(db, checker, holders_only, restart, chunk_size)
+    except KeyboardInterrupt:
+        print("\n⏸️ Остановлено; повторный запуск продолжит с последней сохраненной пачки")
+        sys.exit(130)
+    finally:
+        checker.close()
+
+    print(f"\n✅ Готово: проверено {summary['checked']}, изменено {summary['changed']}, ошибок {summary['errors']}")
+    if summary['errors']:
+        print("⚠️ Пользователи с ошибками Bot API не обновлены; запустите перепроверку повторно с --restart")
+
+
+if __name__ == "__main__":
+    main()
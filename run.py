@@ -12,8 +12,8 @@ import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from bot import main
-    from config import BOT_TOKEN
+    from bot import main, main_webhook
+    from config import BOT_TOKEN, BOT_RUN_MODE
     
     # Проверяем токен
     if BOT_TOKEN == 'your_bot_token_here':
@@ -21,13 +21,21 @@ try:
         print("📝 Создайте файл .env и добавьте BOT_TOKEN=ваш_токен")
         sys.exit(1)
     
-    print("🚀 Запуск FSR Telegram Bot...")
-    print(f"🌐 WebApp URL: https://FSR.agensy/")
-    print(f"📁 Giveaway Link: https://t.me/addlist/f3YaeLmoNsdkYjVl")
-    print("=" * 50)
+    # Режим: --webhook / --polling в аргументах или BOT_RUN_MODE в .env
+    mode = BOT_RUN_MODE
+    if '--webhook' in sys.argv:
+        mode = 'webhook'
+    elif '--polling' in sys.argv:
+        mode = 'polling'
     
     # Запускаем бота
-    asyncio.run(main())
+    if mode == 'webhook':
+        main_webhook()
+    elif mode == 'polling':
+        asyncio.run(main())
+    else:
+        print(f"❌ Ошибка: неизвестный режим BOT_RUN_MODE={mode} (polling или webhook)")
+        sys.exit(1)
     
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
@@ -0,0 +1,172 @@
+"""
+Проверка подписки пользователей на каналы через Bot API.
+
+Один долгоживущий экземпляр Bot (и его aiohttp-сессия) работает в отдельном
+потоке со своим event loop. Flask-обработчики вызывают синхронные методы,
+которые отправляют корутину в этот loop и ждут результат, — без asyncio.run
+и без новой HTTP-сессии на каждый запрос. Каналы проверяются параллельно,
+результаты кэшируются в MembershipCache.
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from membership_cache import MembershipCache
+from rate_limit import TokenBucket
+from config import BOT_TOKEN, SUBSCRIPTION_CHECK_CONCURRENCY, SUBSCRIPTION_CHECK_TIMEOUT
+
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+RETRY_AFTER_ATTEMPTS = 3
+
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+ADMIN_STATUSES = ('administrator', 'creator')
+
+
+class SubscriptionChecker:
+    def __init__(self, channel_ids: Iterable[int], token: str = BOT_TOKEN,
+                 concurrency: int = SUBSCRIPTION_CHECK_CONCURRENCY,
+                 timeout: float = SUBSCRIPTION_CHECK_TIMEOUT, bot: Optional[Bot] = None,
+                 cache: Optional[MembershipCache] = None, rate_limiter: Optional[TokenBucket] = None):
+        self.channel_ids = list(channel_ids)
+        self.rate_limiter = rate_limiter
+        self.cache = cache if cache is not None else MembershipCache()
+        self.timeout = timeout
+        self.bot = bot if bot is not None else Bot(token=token)
+        self._concurrency = concurrency
+        self._semaphore = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Запуск фонового event loop при первом обращении"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    # Семафор создается внутри своего loop
+                    self._semaphore = asyncio.Semaphore(self._concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name='subscription-checker', daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Выполнение корутины в общем loop из синхронного кода (например, из Flask)"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return future.result(timeout if timeout is not None else self.timeout)
+        except Exception:
+            future.cancel()
+            raise
+
+    async def check_member(self, channel_id: int, user_id: int, use_cache: bool = True) -> Dict[str, Any]:
+        """Статус пользователя в одном канале; ошибка API считается отсутствием подписки"""
+        if use_cache:
+            cached = self.cache.get(channel_id, user_id)
+            if cached is not None:
+                cached['cached'] = True
+                return cached
+        async with self._semaphore:
+            try:
+                member = await self._get_chat_member(channel_id, user_id)
+                result = {
+                    'channel_id': channel_id,
+                    'status': member.status,
+                    'subscribed': member.status in SUBSCRIBED_STATUSES,
+                }
+                self.cache.put(channel_id, user_id, result)
+                result['cached'] = False
+                return result
+            except Exception as e:
+                return {
+                    'channel_id': channel_id,
+                    'status': None,
+                    'subscribed': False,
+                    'cached': False,
+                    'error': str(e),
+                }
+
+    async def _get_chat_member(self, channel_id: int, user_id: int):
+        """get_chat_member с учетом ограничения частоты и retry_after от Telegram"""
+        for attempt in range(RETRY_AFTER_ATTEMPTS + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            try:
+                return await self.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+            except TelegramRetryAfter as e:
+                if attempt == RETRY_AFTER_ATTEMPTS:
+                    raise
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
+
+    async def check_user_async(self, user_id: int, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Параллельная проверка подписки пользователя на все каналы.
+        cached=True — все каналы взяты из кэша, то есть итог уже был получен
+        (и сохранен вызывающим) при одной из предыдущих проверок.
+        """
+        channels = await asyncio.gather(*(
+            self.check_member(channel_id, user_id, use_cache) for channel_id in self.channel_ids
+        ))
+        return {
+            'user_id': user_id,
+            'subscribed': all(result['subscribed'] for result in channels),
+            'cached': all(result['cached'] for result in channels),
+            'channels': list(channels),
+        }
+
+    def check_user(self, user_id: int, use_cache: bool = True, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Синхронная обертка над check_user_async"""
+        return self.run(self.check_user_async(user_id, use_cache), timeout)
+
+    async def check_users_async(self, user_ids: Iterable[int], use_cache: bool = True) -> List[Dict[str, Any]]:
+        """Проверка пачки пользователей; параллельность ограничена семафором и rate_limiter"""
+        return list(await asyncio.gather(*(
+            self.check_user_async(user_id, use_cache) for user_id in user_ids
+        )))
+
+    def invalidate(self, user_id: int, only_negative: bool = False) -> int:
+        """Сброс кэша пользователя (например, после того как он сообщил о подписке)"""
+        return self.cache.invalidate(user_id, self.channel_ids, only_negative)
+
+    async def check_admin_rights_async(self) -> List[Dict[str, Any]]:
+        """Статус бота во всех каналах (должен быть администратором)"""
+        me = await self.bot.get_me()
+        channels = await asyncio.gather(*(
+            self.check_member(channel_id, me.id, use_cache=False) for channel_id in self.channel_ids
+        ))
+        for result in channels:
+            result['admin'] = result['status'] in ADMIN_STATUSES
+        return list(channels)
+
+    def check_admin_rights(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self.run(self.check_admin_rights_async(), timeout)
+
+    def close(self):
+        """Закрытие HTTP-сессии бота и остановка loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.bot.session.close(), loop).result(self.timeout)
+        except Exception as e:
+            print(f"Error closing subscription checker session: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        loop.close()
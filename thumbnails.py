@@ -0,0 +1,191 @@
+"""
+Превью загруженных фото.
+
+Для каждой загрузки в фоне создаются JPEG-миниатюры нескольких размеров
+(лежат в blob_store рядом с оригиналом: <sha256>.thumb-<размер>.jpg) и крошечная
+размытая заглушка, которая хранится в photo_uploads.placeholder как data URL.
+Сетка фото в веб-приложении грузит только миниатюры и не трогает оригиналы.
+
+Состояние обработки — photo_uploads.thumbnail_status:
+pending → ready / failed, для видео и неподдерживаемых форматов — unsupported.
+"""
+
+import base64
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from blob_store import BlobStore
+from config import THUMBNAIL_SIZES, THUMBNAIL_QUALITY, THUMBNAIL_WORKERS
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # Pillow не установлен — превью не создаются, отдаются оригиналы
+    Image = None
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+STATUS_UNSUPPORTED = 'unsupported'
+
+# Размер стороны размытой заглушки в пикселях
+PLACEHOLDER_SIZE = 16
+
+# Защита от «декомпрессионных бомб»: картинки больше этого числа пикселей не декодируются
+# (размер проверяется по заголовку до load(); сам Pillow отказывает только выше 2× лимита)
+MAX_IMAGE_PIXELS = 50_000_000
+
+
+def variant_name(size: str) -> str:
+    """Имя производного файла миниатюры в blob_store"""
+    return f'thumb-{size}.jpg'
+
+
+def _to_rgb(image):
+    """Приведение к RGB; прозрачность заливается белым фоном"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def _encode_jpeg(image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def render_thumbnails(content: bytes, sizes: Dict[str, int] = THUMBNAIL_SIZES,
+                      quality: int = THUMBNAIL_QUALITY):
+    """Миниатюры {размер: jpeg} и заглушка (data URL) из содержимого изображения"""
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(io.BytesIO(content)) as source:
+        width, height = source.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image size ({width * height} pixels) exceeds limit of {MAX_IMAGE_PIXELS} pixels"
+            )
+        # Учитываем поворот из EXIF (фото с телефонов)
+        image = _to_rgb(ImageOps.exif_transpose(source))
+
+    thumbnails = {}
+    # От большего размера к меньшему: каждый следующий масштабируется из предыдущего
+    current = image
+    for name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        if max(current.size) > edge:
+            current = current.copy()
+            current.thumbnail((edge, edge), Image.LANCZOS)
+        thumbnails[name] = _encode_jpeg(current, quality)
+
+    tiny = current.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(_encode_jpeg(tiny, 60)).decode('ascii')
+    return thumbnails, placeholder
+
+
+class ThumbnailPipeline:
+    # Сколько записей выбирать за раз при досоздании превью для старых загрузок
+    BACKFILL_BATCH = 100
+
+    def __init__(self, pool, store: BlobStore, sizes: Dict[str, int] = THUMBNAIL_SIZES,
+                 workers: int = THUMBNAIL_WORKERS):
+        self.pool = pool
+        self.store = store
+        self.sizes = sizes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def has_thumbnail(self, blob_sha256: str, size: str) -> bool:
+        return size in self.sizes and self.store.exists_derived(blob_sha256, variant_name(size))
+
+    def thumbnail_path(self, blob_sha256: str, size: str) -> str:
+        return self.store.derived_path(blob_sha256, variant_name(size))
+
+    def submit(self, photo_id: str) -> bool:
+        """Постановка фото в очередь на создание превью (повторная постановка игнорируется)"""
+        with self._lock:
+            if photo_id in self._in_flight:
+                return False
+            self._in_flight.add(photo_id)
+        self._executor.submit(self._run, photo_id)
+        return True
+
+    def _run(self, photo_id: str):
+        try:
+            self.process(photo_id)
+        except Exception as e:
+            print(f"Error creating thumbnails for {photo_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(photo_id)
+
+    def _set_status(self, photo_id: str, status: str, placeholder: Optional[str] = None):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                UPDATE photo_uploads SET thumbnail_status = ?, placeholder = ?
+                WHERE id = ?
+            ''', (status, placeholder, photo_id))
+            conn.commit()
+
+    def process(self, photo_id: str) -> Optional[str]:
+        """Создание превью для одной загрузки; возвращает итоговый статус"""
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT blob_sha256, mime_type FROM photo_uploads WHERE id = ?
+            ''', (photo_id,)).fetchone()
+        if not row:
+            return None
+        blob_sha256, mime_type = row
+        if not blob_sha256:
+            # Содержимое еще в file_data: превью появятся после migrate_photo_blobs.py
+            return None
+        if not self.enabled or not mime_type.startswith('image/'):
+            self._set_status(photo_id, STATUS_UNSUPPORTED)
+            return STATUS_UNSUPPORTED
+
+        try:
+            thumbnails, placeholder = render_thumbnails(self.store.read(blob_sha256), self.sizes)
+        except Exception as e:
+            print(f"Error rendering thumbnails for {photo_id}: {e}")
+            self._set_status(photo_id, STATUS_FAILED)
+            return STATUS_FAILED
+
+        for size, data in thumbnails.items():
+            self.store.put_derived(blob_sha256, variant_name(size), data)
+        self._set_status(photo_id, STATUS_READY, placeholder)
+        return STATUS_READY
+
+    def backfill(self) -> int:
+        """Постановка в очередь всех загрузок без превью (после деплоя или перезапуска)"""
+        queued = 0
+        last_id = ''
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT id FROM photo_uploads
+                    WHERE (thumbnail_status IS NULL OR thumbnail_status = ?)
+                      AND blob_sha256 IS NOT NULL AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (STATUS_PENDING, last_id, self.BACKFILL_BATCH))
+                ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return queued
+            last_id = ids[-1]
+            for photo_id in ids:
+                if self.submit(photo_id):
+                    queued += 1
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,255 @@
+"""
+Возобновляемая загрузка файлов по частям.
+
+Клиент создаёт сессию с метаданными файла, затем отправляет куски сырыми
+байтами с заголовком Upload-Offset; после обрыва связи узнаёт текущее
+смещение и продолжает с него. Куски пишутся сразу на диск, поэтому память
+на загрузку не зависит от размера файла. Размер и тип содержимого
+проверяются по мере поступления байтов, а после завершения файл переносится
+в blob_store.
+"""
+
+import os
+import threading
+import uuid
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from blob_store import BlobStore
+
+# Сигнатуры начала файла: (смещение, байты, семейство, MIME)
+_SIGNATURES = [
+    (0, b'\xff\xd8\xff', 'image', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image', 'image/png'),
+    (0, b'GIF87a', 'image', 'image/gif'),
+    (0, b'GIF89a', 'image', 'image/gif'),
+    (0, b'BM', 'image', 'image/bmp'),
+    (0, b'II*\x00', 'image', 'image/tiff'),
+    (0, b'MM\x00*', 'image', 'image/tiff'),
+    (0, b'\x1a\x45\xdf\xa3', 'video', 'video/webm'),
+]
+
+# Бренды контейнера ISO BMFF (ftyp), которые являются изображениями
+_IMAGE_FTYP_BRANDS = {b'heic', b'heix', b'hevc', b'heim', b'heis', b'mif1', b'msf1', b'avif', b'avis'}
+
+# Сколько первых байтов нужно для определения типа
+SNIFF_SIZE = 16
+
+
+def sniff_media_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """Определение (семейство, MIME) по первым байтам файла; None — неизвестный формат"""
+    if head[:4] == b'RIFF' and len(head) >= 12:
+        if head[8:12] == b'WEBP':
+            return 'image', 'image/webp'
+        if head[8:12] == b'AVI ':
+            return 'video', 'video/x-msvideo'
+    if head[4:8] == b'ftyp' and len(head) >= 12:
+        brand = head[8:12]
+        if brand in _IMAGE_FTYP_BRANDS:
+            return 'image', 'image/heic' if brand != b'avif' else 'image/avif'
+        if brand == b'qt  ':
+            return 'video', 'video/quicktime'
+        return 'video', 'video/mp4'
+    for offset, signature, family, mime in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return family, mime
+    return None
+
+
+class UploadError(Exception):
+    """Ошибка загрузки с HTTP-статусом для ответа клиенту"""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSessions:
+    # Сессии без активности дольше этого срока удаляются
+    SESSION_TTL_HOURS = 24
+
+    def __init__(self, pool, store: BlobStore, max_size: int):
+        self.pool = pool
+        self.store = store
+        self.max_size = max_size
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, upload_id: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(upload_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[upload_id] = lock
+            return lock
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.store.tmp_dir, f'upload-{upload_id}.part')
+
+    def create(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Создание сессии загрузки по метаданным файла"""
+        mime_type = meta.get('mimeType')
+        if not isinstance(mime_type, str) or not mime_type.startswith(('image/', 'video/')):
+            raise UploadError('Only image and video files are allowed', 400)
+        try:
+            file_size = int(meta['fileSize'])
+        except (KeyError, TypeError, ValueError):
+            raise UploadError('fileSize must be an integer', 400)
+        if file_size <= 0:
+            raise UploadError('fileSize must be positive', 400)
+        if file_size > self.max_size:
+            raise UploadError('File size too large. Maximum size: 10MB', 413)
+
+        self.expire_stale()
+
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), 'wb').close()
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO upload_sessions
+                (id, photo_id, user_id, category, file_id, file_name, file_size, mime_type, upload_date, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                upload_id,
+                meta['id'],
+                meta['userId'],
+                meta['category'],
+                meta['fileId'],
+                meta['fileName'],
+                file_size,
+                mime_type,
+                meta['uploadDate'],
+                meta.get('description'),
+            ))
+            conn.commit()
+        return self.get(upload_id)
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние сессии"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, photo_id, user_id, category, file_id, file_name, file_size,
+                       mime_type, upload_date, description, received
+                FROM upload_sessions WHERE id = ?
+            ''', (upload_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            'upload_id': row[0],
+            'id': row[1],
+            'userId': row[2],
+            'category': row[3],
+            'fileId': row[4],
+            'fileName': row[5],
+            'fileSize': row[6],
+            'mimeType': row[7],
+            'uploadDate': row[8],
+            'description': row[9],
+            'offset': row[10],
+        }
+
+    def append(self, upload_id: str, offset: int, stream: BinaryIO,
+               content_length: Optional[int] = None) -> Dict[str, Any]:
+        """Запись очередного куска; offset должен совпадать с уже принятым объемом"""
+        lock = self._lock_for(upload_id)
+        if not lock.acquire(blocking=False):
+            raise UploadError('Another chunk for this upload is in progress', 409)
+        try:
+            session = self.get(upload_id)
+            if session is None:
+                raise UploadError('Upload not found', 404)
+            received = session['offset']
+            if offset != received:
+                raise UploadError('Upload-Offset does not match', 409, offset=received)
+            if content_length is not None and received + content_length > session['fileSize']:
+                raise UploadError('Chunk exceeds declared file size', 413, offset=received)
+
+            # Тип содержимого проверяем, пока не набрали первые SNIFF_SIZE байт
+            sniffed = received >= SNIFF_SIZE
+            head = b''
+            if not sniffed:
+                with open(self._part_path(upload_id), 'rb') as f:
+                    head = f.read(SNIFF_SIZE)
+
+            written = 0
+            try:
+                with open(self._part_path(upload_id), 'r+b') as f:
+                    f.seek(received)
+                    while True:
+                        chunk = stream.read(BlobStore.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if received + written + len(chunk) > session['fileSize']:
+                            raise UploadError('Chunk exceeds declared file size', 413, offset=received)
+                        if not sniffed:
+                            head += chunk[:SNIFF_SIZE - len(head)]
+                            if len(head) >= SNIFF_SIZE or received + written + len(chunk) == session['fileSize']:
+                                self._check_content_type(head, session['mimeType'])
+                                sniffed = True
+                        f.write(chunk)
+                        written += len(chunk)
+                    f.truncate(received + written)
+            except UploadError:
+                # Отбрасываем частично записанный кусок: клиент повторит его с прежнего смещения
+                with open(self._part_path(upload_id), 'r+b') as f:
+                    f.truncate(received)
+                raise
+
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    UPDATE upload_sessions
+                    SET received = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (received + written, upload_id))
+                conn.commit()
+            session['offset'] = received + written
+            return session
+        finally:
+            lock.release()
+
+    @staticmethod
+    def _check_content_type(head: bytes, declared_mime: str):
+        detected = sniff_media_type(head)
+        if detected is None:
+            raise UploadError('Unsupported file content', 415)
+        family, _ = detected
+        if not declared_mime.startswith(family + '/'):
+            raise UploadError(f'File content is {family}, but mimeType is {declared_mime}', 415)
+
+    def complete(self, upload_id: str) -> Tuple[Dict[str, Any], str]:
+        """Завершение загрузки: перенос файла в blob_store; возвращает (сессия, sha256)"""
+        lock = self._lock_for(upload_id)
+        with lock:
+            session = self.get(upload_id)
+            if session is None:
+                raise UploadError('Upload not found', 404)
+            if session['offset'] != session['fileSize']:
+                raise UploadError('Upload is incomplete', 409, offset=session['offset'])
+            with open(self._part_path(upload_id), 'rb') as f:
+                blob_sha256, _ = self.store.put_stream(f, max_size=self.max_size)
+            return session, blob_sha256
+
+    def discard(self, upload_id: str):
+        """Удаление сессии и ее временного файла"""
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+            conn.commit()
+        try:
+            os.remove(self._part_path(upload_id))
+        except FileNotFoundError:
+            pass
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def expire_stale(self) -> int:
+        """Удаление сессий без активности дольше SESSION_TTL_HOURS"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                SELECT id FROM upload_sessions
+                WHERE updated_at < datetime('now', ?)
+            ''', (f'-{self.SESSION_TTL_HOURS} hours',))
+            stale = [row[0] for row in cursor.fetchall()]
+        for upload_id in stale:
+            self.discard(upload_id)
+        return len(stale)
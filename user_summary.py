@@ -0,0 +1,74 @@
+"""
+Сводка по пользователю в таблице user_summary (миграция 2026_10_17_user_summary.sql).
+
+Триггеры обновляют строку пользователя в той же транзакции, что и запись в
+photo_uploads, referral_invites, giveaway_participants и таблицы билетов,
+поэтому get_user_stats, get_user_referral_info, get_task_statuses,
+get_user_tickets и get_user_dashboard читают готовые значения по первичному
+ключу вместо COUNT-подзапросов. rebuild() пересчитывает таблицу с нуля.
+"""
+
+from typing import Dict, Tuple
+
+COLUMNS = ('photos_uploaded', 'successful_invites', 'folder_entries', 'referral_tickets', 'subscribed')
+
+# Сводка, посчитанная с нуля по таблицам (все пользователи, у которых есть хоть что-то)
+COMPUTE_QUERY = '''
+    WITH ids(user_id) AS (
+        SELECT user_id FROM users
+        UNION SELECT inviter_id FROM referral_invites WHERE status = 'joined'
+        UNION SELECT user_id FROM giveaway_participants
+        UNION SELECT user_id FROM tickets_referral
+        UNION SELECT user_id FROM tickets_subscription
+        UNION SELECT CAST(user_id AS INTEGER) FROM photo_uploads
+            WHERE CAST(CAST(user_id AS INTEGER) AS TEXT) = user_id
+    )
+    SELECT ids.user_id,
+           (SELECT COUNT(*) FROM photo_uploads WHERE user_id = CAST(ids.user_id AS TEXT)),
+           (SELECT COUNT(*) FROM referral_invites WHERE inviter_id = ids.user_id AND status = 'joined'),
+           (SELECT COUNT(*) FROM giveaway_participants WHERE user_id = ids.user_id),
+           (SELECT COUNT(*) FROM tickets_referral WHERE user_id = ids.user_id),
+           COALESCE((SELECT is_subscribed_all = 1 FROM tickets_subscription WHERE user_id = ids.user_id), 0)
+    FROM ids
+'''
+
+
+def compute(conn) -> Dict[int, Tuple[int, ...]]:
+    """user_id -> значения COLUMNS, посчитанные с нуля"""
+    return {row[0]: tuple(row[1:]) for row in conn.execute(COMPUTE_QUERY)}
+
+
+def rebuild(pool, fix: bool = True) -> Dict[int, Tuple[Tuple[int, ...], Tuple[int, ...]]]:
+    """
+    Сверка user_summary с таблицами: {user_id: (сохранено, на самом деле)} для расходящихся строк.
+    С fix=True расхождения исправляются (лишние строки обнуляются); пересчет и запись
+    идут под BEGIN IMMEDIATE, чтобы параллельные записи не попали между ними.
+    """
+    empty = (0,) * len(COLUMNS)
+    with pool.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            actual = compute(conn)
+            stored = {
+                row[0]: tuple(row[1:])
+                for row in conn.execute(f"SELECT user_id, {', '.join(COLUMNS)} FROM user_summary")
+            }
+            drift = {
+                user_id: (stored.get(user_id, empty), actual.get(user_id, empty))
+                for user_id in set(actual) | set(stored)
+                if stored.get(user_id, empty) != actual.get(user_id, empty)
+            }
+            if fix and drift:
+                conn.executemany(f'''
+                    INSERT INTO user_summary (user_id, {', '.join(COLUMNS)})
+                    VALUES (?, {', '.join('?' * len(COLUMNS))})
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        {', '.join(f'{column} = excluded.{column}' for column in COLUMNS)}
+                ''', [(user_id,) + values[1] for user_id, values in drift.items()])
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception:
+            conn.rollback()
+            raise
+    return drift
@@ -0,0 +1,102 @@
+"""
+Прием обновлений Telegram через webhook (aiohttp) вместо long polling.
+
+nginx терминирует TLS на fsr.agency и проксирует WEBHOOK_PATH на локальный
+aiohttp-сервер (см. nginx_fsr_agency_webhook.conf). Запросы без верного
+X-Telegram-Bot-Api-Secret-Token отклоняются. Telegram получает ответ сразу,
+а обновление обрабатывается в фоне; одновременно обрабатывается не больше
+WEBHOOK_MAX_CONCURRENT_UPDATES обновлений — следующий запрос ждет свободного
+места, и Telegram сам придерживает новые обновления.
+"""
+
+import asyncio
+import re
+from typing import Any, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_MAX_CONCURRENT_UPDATES,
+)
+
+# Telegram допускает в secret_token только A-Z, a-z, 0-9, _ и -
+_SECRET_RE = re.compile(r'^[A-Za-z0-9_-]{1,256}$')
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler с ограничением числа одновременно обрабатываемых обновлений"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def _limited_feed_update(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot=bot, update=update)
+        finally:
+            self._slots.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        # Ответ Telegram задерживается, пока не освободится место
+        await self._slots.acquire()
+        task = asyncio.create_task(self._limited_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        # Дожидаемся обработки уже принятых обновлений, затем закрываем сессию бота
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+        await super().close()
+
+
+def webhook_url() -> str:
+    return WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+
+
+def check_webhook_config():
+    """Проверка настроек до запуска сервера"""
+    if not WEBHOOK_BASE_URL.startswith('https://'):
+        raise ValueError("WEBHOOK_BASE_URL must be an https:// URL")
+    if not WEBHOOK_SECRET or not _SECRET_RE.match(WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ or -")
+
+
+def build_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение с обработчиком webhook; при старте регистрирует webhook в Telegram"""
+    async def set_webhook():
+        await bot.set_webhook(
+            url=webhook_url(),
+            secret_token=WEBHOOK_SECRET,
+            # Telegram допускает от 1 до 100 одновременных соединений
+            max_connections=max(1, min(WEBHOOK_MAX_CONCURRENT_UPDATES, 100)),
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+
+    dispatcher.startup.register(set_webhook)
+
+    app = web.Application()
+    LimitedRequestHandler(
+        dispatcher,
+        bot,
+        max_concurrent=WEBHOOK_MAX_CONCURRENT_UPDATES,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Запуск сервера webhook (блокирует до остановки)"""
+    check_webhook_config()
+    web.run_app(build_app(dispatcher, bot), host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)